@@ -0,0 +1,6 @@
+# ASGI entry file to the application, E.G. `uvicorn asgi:app`
+from flaskr.asgi import create_asgi_app
+from os import environ
+# creating the app with configuration durrived from FLASK_CONFIG environment variable, or fall back to development.
+config = environ.get('FLASK_CONFIG') or 'development'
+app = create_asgi_app(config)
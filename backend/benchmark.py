@@ -0,0 +1,360 @@
+# benchmark harness for the API
+# seeds a synthetic question bank, drives every API route through the Flask test client
+# and a multi-threaded HTTP load generator, then reports latency percentiles and RPS as JSON.
+# E.G. `python benchmark.py --questions 100000 --requests 500 --threads 8 --output bench.json`
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# the categories from trivia.psql
+CATEGORIES = ('Science', 'Art', 'Geography', 'History', 'Entertainment', 'Sports')
+WORDS = ('what', 'which', 'who', 'title', 'movie', 'river', 'country', 'painter', 'element',
+         'team', 'world', 'cup', 'largest', 'first', 'famous', 'invented', 'city', 'ocean',
+         'planet', 'author', 'novel', 'battle', 'empire', 'king', 'queen', 'song', 'album')
+
+
+def percentile(sorted_values, fraction):
+    '''return the nearest rank percentile of an already sorted list'''
+    if not sorted_values:
+        return None
+    rank = max(int(round(fraction * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(latencies, errors, elapsed):
+    '''turn a list of latencies in seconds into a report, in milliseconds'''
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'count': count,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3) if count else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3) if count else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if count else None,
+        'mean_ms': round(sum(latencies) / count * 1000, 3) if count else None,
+        'rps': round(count / elapsed, 1) if elapsed else None,
+    }
+
+
+def synthetic_questions(count, rng):
+    '''yield random questions, spread over all categories and difficulties'''
+    for number in range(count):
+        words = rng.sample(WORDS, 6)
+        yield {
+            'question': f'{" ".join(words).capitalize()} number {number}?',
+            'answer': rng.choice(WORDS),
+            'category': rng.randint(1, len(CATEGORIES)),
+            'difficulty': rng.randint(1, 5),
+        }
+
+
+def seed(app, size, reseed=False, batch_size=10000):
+    '''create the schema, and fill the database with `size` synthetic questions'''
+    from flaskr import db
+    from flaskr.bulk import batched, insert_rows
+    from flaskr.migrations import upgrade
+    from flaskr.models import Category, Question, notify_questions_changed
+    with app.app_context():
+        upgrade()
+        if reseed:
+            Question.query.delete()
+            Category.query.delete()
+            db.session.commit()
+        if Category.query.count() == 0:
+            db.session.add_all(Category(type) for type in CATEGORIES)
+            db.session.commit()
+        missing = size - Question.query.count()
+        rng = random.Random(size)
+        for batch in batched(synthetic_questions(max(missing, 0), rng), batch_size):
+            insert_rows(batch)
+            db.session.commit()
+        notify_questions_changed('reload')
+
+
+# answer of the questions written by the benchmark, so they can be deleted afterwards
+WRITE_MARKER = 'benchmark write'
+
+
+def prepare_writes(app, count):
+    '''insert `count` questions for DELETE /questions/<id> to delete, and return their ids'''
+    from flaskr import db
+    from flaskr.models import Question, notify_questions_changed
+    with app.app_context():
+        questions = [Question(f'Benchmark question {number}?', WRITE_MARKER, 1, 1) for number in range(count)]
+        db.session.add_all(questions)
+        db.session.commit()
+        ids = [question.id for question in questions]
+        notify_questions_changed('reload')
+    return ids
+
+
+def clean_up_writes(app):
+    '''delete the questions left by the write routes, so every run starts from the seeded bank'''
+    from flaskr import db
+    from flaskr.models import Question, notify_questions_changed
+    with app.app_context():
+        Question.query.filter(Question.answer == WRITE_MARKER).delete(synchronize_session=False)
+        db.session.commit()
+        notify_questions_changed('reload')
+
+
+def prepare_sessions(app, count):
+    '''start `count` quiz sessions, for the session routes to play and end, and return their tokens'''
+    from flaskr.quiz import quiz_sessions
+    with app.app_context():
+        return [quiz_sessions.create(number % (len(CATEGORIES) + 1)) for number in range(count)]
+
+
+def clean_up_sessions(app, tokens):
+    '''end the prepared quiz sessions, the ones started by POST /quizzes/sessions expire after QUIZ_SESSION_TTL'''
+    from flaskr.quiz import quiz_sessions
+    with app.app_context():
+        for token in tokens:
+            quiz_sessions.end(token)
+
+
+def json_request(method, url, body=None):
+    '''return a planned request, with a JSON body'''
+    data = json.dumps(body).encode() if body is not None else None
+    return method, url, data, 'application/json'
+
+
+def request_plan(size, rng, deletable, sessions):
+    '''
+    return {route name: function returning (method, url, body bytes, content type)} for every API route.
+    arguments are randomized, so the response cache only helps as much as it would in production.
+    DELETE /questions/<id> and the batch deletes pop the ids of the `deletable` list,
+    and DELETE /quizzes/sessions/<token> pops the tokens of the `sessions` list, both are refilled before every driver.
+    '''
+    pages = max(size // 10, 1)
+
+    def quiz_body():
+        previous = rng.sample(range(1, size + 1), min(20, size))
+        return {'previous_questions': previous, 'quiz_category': {'id': rng.randint(0, len(CATEGORIES))}}
+
+    def new_question():
+        return {'question': f'Benchmark question {rng.random()}?', 'answer': WRITE_MARKER,
+                'category': rng.randint(1, len(CATEGORIES)), 'difficulty': rng.randint(1, 5)}
+
+    def pop(items, default):
+        # list.pop is atomic, so concurrent HTTP clients never delete the same question or session
+        try:
+            return items.pop()
+        except IndexError:
+            return default
+
+    def bulk_body():
+        lines = (json.dumps(new_question()) for _ in range(10))
+        return ('\n'.join(lines) + '\n').encode()
+
+    def batch_body():
+        operations = [dict(new_question(), op='create') for _ in range(8)]
+        operations += [{'op': 'delete', 'id': pop(deletable, 0)} for _ in range(2)]
+        return {'operations': operations}
+
+    def played_session():
+        # the last tokens of the list are ended first, so the first ones are played
+        return sessions[rng.randrange(len(sessions) // 2)] if len(sessions) > 1 else 'unknown'
+    return {
+        'GET /categories': lambda: json_request('GET', '/api/v1/categories'),
+        'GET /categories/stats': lambda: json_request('GET', '/api/v1/categories/stats'),
+        'GET /questions': lambda: json_request('GET', f'/api/v1/questions?page={rng.randint(1, pages)}'),
+        'GET /questions (cursor)': lambda: json_request('GET', f'/api/v1/questions?after_id={rng.randint(0, size)}&limit=10'),
+        'GET /categories/<id>/questions': lambda: json_request(
+            'GET', f'/api/v1/categories/{rng.randint(1, len(CATEGORIES))}/questions'
+            f'?page={rng.randint(1, max(pages // len(CATEGORIES), 1))}'),
+        'GET /questions/suggest': lambda: json_request('GET', f'/api/v1/questions/suggest?prefix={rng.choice(WORDS)[:3]}'),
+        'GET /questions/export': lambda: json_request('GET', '/api/v1/questions/export?format=ndjson'),
+        'POST /questions/search': lambda: json_request('POST', '/api/v1/questions/search', {'searchTerm': rng.choice(WORDS)}),
+        'POST /quizzes': lambda: json_request('POST', '/api/v1/quizzes', quiz_body()),
+        'POST /quizzes/sessions': lambda: json_request(
+            'POST', '/api/v1/quizzes/sessions', {'quiz_category': {'id': rng.randint(0, len(CATEGORIES))}}),
+        'POST /quizzes/sessions/<token>/next': lambda: json_request(
+            'POST', f'/api/v1/quizzes/sessions/{played_session()}/next'),
+        'DELETE /quizzes/sessions/<token>': lambda: json_request(
+            'DELETE', f'/api/v1/quizzes/sessions/{pop(sessions, "unknown")}'),
+        'POST /questions': lambda: json_request('POST', '/api/v1/questions', new_question()),
+        'POST /questions/bulk': lambda: ('POST', '/api/v1/questions/bulk', bulk_body(), 'application/x-ndjson'),
+        'POST /questions/batch': lambda: json_request('POST', '/api/v1/questions/batch', batch_body()),
+        'DELETE /questions/<id>': lambda: json_request('DELETE', f'/api/v1/questions/{pop(deletable, 0)}'),
+    }
+
+
+def run_test_client(app, plan, requests):
+    '''drive every planned route through the Flask test client, one request at a time'''
+    client = app.test_client()
+    results = {}
+    for name, make_request in plan.items():
+        latencies, errors = [], 0
+        started = time.perf_counter()
+        for _ in range(requests):
+            method, url, data, content_type = make_request()
+            start = time.perf_counter()
+            response = client.open(url, method=method, data=data, content_type=content_type)
+            # streamed responses, like the export, are only produced while they are read
+            response.get_data()
+            response.close()
+            latencies.append(time.perf_counter() - start)
+            # 404s are expected for random pages past the end of a category
+            if response.status_code >= 500:
+                errors += 1
+        results[name] = summarize(latencies, errors, time.perf_counter() - started)
+    return results
+
+
+def run_http(app, plan, requests, threads):
+    '''drive every planned route over HTTP, from `threads` concurrent clients'''
+    from werkzeug.serving import make_server, WSGIRequestHandler
+
+    class QuietHandler(WSGIRequestHandler):
+        # don't log every request, it would slow down the server
+        def log_request(self, *args, **kwargs):
+            pass
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    def send(make_request):
+        method, url, data, content_type = make_request()
+        http_request = urllib.request.Request(base_url + url, data=data, method=method,
+                                              headers={'Content-Type': content_type})
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(http_request) as response:
+                response.read()
+            failed = False
+        except urllib.error.HTTPError as error:
+            failed = error.code >= 500
+        except OSError:
+            failed = True
+        return time.perf_counter() - start, failed
+
+    results = {}
+    try:
+        with ThreadPoolExecutor(threads) as executor:
+            for name, make_request in plan.items():
+                started = time.perf_counter()
+                outcomes = list(executor.map(send, [make_request] * requests))
+                elapsed = time.perf_counter() - started
+                results[name] = summarize([latency for latency, _ in outcomes],
+                                          sum(failed for _, failed in outcomes), elapsed)
+    finally:
+        server.shutdown()
+    return results
+
+
+# the first requests after a start, which load the caches when the app wasn't warmed up
+COLD_START_REQUESTS = (
+    ('GET /questions', 'GET', '/api/v1/questions', None),
+    ('POST /questions/search', 'POST', '/api/v1/questions/search', {'searchTerm': 'what'}),
+    ('POST /quizzes', 'POST', '/api/v1/quizzes', {'previous_questions': [], 'quiz_category': {'id': 0}}),
+)
+
+
+def cold_start_child():
+    '''run in a fresh interpreter: time the app creation and the first requests, print them as JSON'''
+    start = time.perf_counter()
+    from flaskr import create_app
+    app = create_app('production')
+    timings = {'create_app_ms': (time.perf_counter() - start) * 1000}
+    client = app.test_client()
+    for name, method, url, body in COLD_START_REQUESTS:
+        start = time.perf_counter()
+        client.open(url, method=method, json=body)
+        timings[f'first {name}_ms'] = (time.perf_counter() - start) * 1000
+    print(json.dumps(timings))
+
+
+def measure_cold_start(runs):
+    '''
+    start the app `runs` times in new processes, with and without WARM_UP_ON_START,
+    and return the median of every timing in milliseconds.
+    '''
+    results = {}
+    for mode, warm_up in (('lazy', 'false'), ('warm_up', 'true')):
+        env = dict(os.environ, WARM_UP_ON_START=warm_up, SUGGEST_INDEX_ON_START=warm_up)
+        samples = [json.loads(subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--cold-start-child'], env=env,
+            check=True, capture_output=True, text=True).stdout) for _ in range(runs)]
+        results[mode] = {name: round(statistics.median(sample[name] for sample in samples), 3)
+                         for name in samples[0]}
+        results[mode]['until_first_responses_ms'] = round(sum(results[mode].values()), 3)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark every API route.')
+    parser.add_argument('--database-uri', help='database to seed and benchmark, a temporary SQLite file by default')
+    parser.add_argument('--questions', type=int, default=10000, help='size of the synthetic question bank')
+    parser.add_argument('--requests', type=int, default=200, help='requests per route and driver')
+    parser.add_argument('--threads', type=int, default=8, help='concurrent clients of the HTTP load generator')
+    parser.add_argument('--reseed', action='store_true', help='delete all questions before seeding')
+    parser.add_argument('--no-cache', action='store_true', help='disable the response cache')
+    parser.add_argument('--cold-start-runs', type=int, default=3,
+                        help='app starts measured in new processes, 0 to skip the cold start measurement')
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    parser.add_argument('--cold-start-child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.cold_start_child:
+        # the environment was set by the parent process
+        return cold_start_child()
+
+    uri = args.database_uri or 'sqlite:///' + os.path.join(tempfile.gettempdir(), 'trivia_benchmark.db')
+    # the configuration is read from the environment when it is imported
+    os.environ['PROD_DATABASE_URI'] = uri
+    os.environ['AUTO_MIGRATE'] = 'false'
+    if args.no_cache:
+        os.environ['RESPONSE_CACHE_SIZE'] = '0'
+    from flaskr import create_app
+
+    app = create_app('production')
+    seed(app, args.questions, args.reseed)
+    rng = random.Random(0)
+    deletable, sessions = [], []
+    plan = request_plan(args.questions, rng, deletable, sessions)
+    results = {}
+    for driver, run in (('test_client', lambda: run_test_client(app, plan, args.requests)),
+                        ('http', lambda: run_http(app, plan, args.requests, args.threads))):
+        # DELETE /questions/<id> deletes one question per request, and every batch deletes two
+        deletable[:] = prepare_writes(app, args.requests * 3)
+        # half of the sessions are played, the other half are ended
+        sessions[:] = prepare_sessions(app, args.requests * 2)
+        tokens = list(sessions)
+        try:
+            results[driver] = run()
+        finally:
+            clean_up_writes(app)
+            clean_up_sessions(app, tokens)
+    report = {
+        'questions': args.questions,
+        'requests_per_route': args.requests,
+        'threads': args.threads,
+        'database': app.config['SQLALCHEMY_DATABASE_URI'].split('://')[0],
+        'response_cache': not args.no_cache,
+        'test_client': results['test_client'],
+        'http': results['http'],
+    }
+    if args.cold_start_runs:
+        report['cold_start'] = measure_cold_start(args.cold_start_runs)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output + '\n')
+    else:
+        print(output)
+    return report
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -6,11 +6,119 @@ basedir = path.abspath(path.dirname(__file__))
 load_dotenv(path.join(basedir, '.env'))
 
 
+def _flag(name, default):
+    '''read a boolean environment variable'''
+    return (environ.get(name) or default).lower() in ('1', 'true', 'yes')
+
+
+def engine_options(uri):
+    '''connection pool settings for SQLAlchemy, applied to the primary and the replicas'''
+    options = {
+        # test connections before using them, so dropped connections don't fail requests
+        'pool_pre_ping': _flag('DB_POOL_PRE_PING', 'true'),
+        # seconds before a connection is replaced, -1 to keep connections forever
+        'pool_recycle': int(environ.get('DB_POOL_RECYCLE') or 1800),
+    }
+    if uri and not uri.startswith('sqlite'):
+        # SQLite doesn't use a sized connection pool
+        options['pool_size'] = int(environ.get('DB_POOL_SIZE') or 5)
+        options['max_overflow'] = int(environ.get('DB_MAX_OVERFLOW') or 10)
+    return options
+
+
+def replica_binds(uris):
+    '''turn a comma separated list of replica uris into SQLAlchemy binds'''
+    uris = [uri.strip() for uri in (uris or '').split(',') if uri.strip()]
+    return {f'replica_{number}': uri for number, uri in enumerate(uris)}
+
+
 class Config:
     """Base config"""
     SECRET_KEY = environ.get('SECRET_KEY') or 'HackMePleaseLol'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     QUESTIONS_PER_PAGE = 10
+    # apply pending schema migrations when the app starts, otherwise run `flask db upgrade`
+    AUTO_MIGRATE = _flag('AUTO_MIGRATE', 'true')
+    # load the caches, the quiz pool, the search index and a database connection when the app starts
+    WARM_UP_ON_START = _flag('WARM_UP_ON_START', 'false')
+    # seconds a client reads from the primary after a write, so it doesn't see stale replicas
+    REPLICA_LAG_WINDOW = int(environ.get('REPLICA_LAG_WINDOW') or 5)
+    # upper bound for the `limit` argument in cursor pagination
+    MAX_QUESTIONS_PER_PAGE = 100
+    # questions per insert statement, or per fetch, in bulk imports and exports
+    BULK_BATCH_SIZE = int(environ.get('BULK_BATCH_SIZE') or 1000)
+    # upper bound for the number of operations in a /questions/batch request
+    BATCH_MAX_OPERATIONS = int(environ.get('BATCH_MAX_OPERATIONS') or 1000)
+    # seconds before the cached categories are reloaded, 0 to only reload on invalidation
+    CATEGORY_CACHE_TTL = int(environ.get('CATEGORY_CACHE_TTL') or 300)
+    # seconds browsers and CDNs may reuse /categories before revalidating it
+    CATEGORIES_MAX_AGE = int(environ.get('CATEGORIES_MAX_AGE') or 60)
+    # maximum number of cached GET responses, 0 to disable the response cache
+    RESPONSE_CACHE_SIZE = int(environ.get('RESPONSE_CACHE_SIZE') or 1024)
+    # seconds before a cached response expires
+    RESPONSE_CACHE_TTL = int(environ.get('RESPONSE_CACHE_TTL') or 30)
+    # seconds before the question counters are reloaded, to pick up writes from other processes
+    QUESTION_COUNT_TTL = int(environ.get('QUESTION_COUNT_TTL') or 60)
+    # search backend: `auto`, `postgresql`, `memory`, or `like`
+    SEARCH_BACKEND = environ.get('SEARCH_BACKEND') or 'auto'
+    # seconds before the in-memory search index is rebuilt in the background, to pick up writes from other processes and imports,
+    # 0 to only rebuild on changes made by this process
+    SEARCH_INDEX_TTL = int(environ.get('SEARCH_INDEX_TTL') or 300)
+    # suggestions returned by /questions/suggest when no limit is given
+    SUGGEST_LIMIT = int(environ.get('SUGGEST_LIMIT') or 10)
+    # upper bound for the `limit` of /questions/suggest, and suggestions precomputed per one or two letter prefix
+    SUGGEST_MAX_LIMIT = int(environ.get('SUGGEST_MAX_LIMIT') or 20)
+    # build the index of /questions/suggest when the app starts, instead of in the first suggestion request
+    SUGGEST_INDEX_ON_START = _flag('SUGGEST_INDEX_ON_START', 'true')
+    # characters of question text in every suggestion
+    SUGGEST_SNIPPET_LENGTH = int(environ.get('SUGGEST_SNIPPET_LENGTH') or 80)
+    # seconds before the quiz question pool is reloaded in the background, to pick up writes from other processes and imports,
+    # 0 to only reload on changes made by this process
+    QUIZ_POOL_TTL = int(environ.get('QUIZ_POOL_TTL') or 60)
+    # adaptive quizzes pick the next difficulty from this many of the player's last answers,
+    # 0 to ignore the answers and always target difficulty 3
+    ADAPTIVE_QUIZ_WINDOW = int(environ.get('ADAPTIVE_QUIZ_WINDOW') or 5)
+    # upper bound for the `deck_size` of quiz decks
+    QUIZ_DECK_MAX_SIZE = int(environ.get('QUIZ_DECK_MAX_SIZE') or 50)
+    # where quiz sessions are kept: `memory`, or a `redis://` url to share them between processes
+    QUIZ_SESSION_STORE = environ.get('QUIZ_SESSION_STORE') or 'memory'
+    # seconds of inactivity before a quiz session expires
+    QUIZ_SESSION_TTL = int(environ.get('QUIZ_SESSION_TTL') or 3600)
+    # database connections of the async ASGI app, per process
+    ASYNC_POOL_SIZE = int(environ.get('ASYNC_POOL_SIZE') or 5)
+    # compress responses with zstd, brotli or gzip, depending on what the client accepts and what is installed
+    COMPRESS_ENABLED = _flag('COMPRESS_ENABLED', 'true')
+    # responses smaller than this many bytes are sent uncompressed
+    COMPRESS_MIN_SIZE = int(environ.get('COMPRESS_MIN_SIZE') or 500)
+    # compression level, from 1 (fastest) to 9 (smallest)
+    COMPRESS_LEVEL = int(environ.get('COMPRESS_LEVEL') or 6)
+    # compressed bodies memoized by etag and encoding, 0 to compress every response again
+    COMPRESS_CACHE_SIZE = int(environ.get('COMPRESS_CACHE_SIZE') or 256)
+    # json encoder of question listings: `auto` uses orjson when it is installed, `stdlib` never does
+    JSON_BACKEND = environ.get('JSON_BACKEND') or 'auto'
+    # collect per route timings and SQL statement counts, and serve them on /metrics,
+    # which has no authentication, so only turn it on where /metrics isn't public
+    METRICS_ENABLED = _flag('METRICS_ENABLED', 'false')
+    # add a Server-Timing header with the database and serialization times of every request
+    SERVER_TIMING = _flag('SERVER_TIMING', 'false')
+    # profile api requests, the views are left untouched when this is off
+    PROFILE_ENABLED = _flag('PROFILE_ENABLED', 'false')
+    # profile every Nth api request, 0 to only profile requests with a signed header
+    PROFILE_SAMPLE_RATE = int(environ.get('PROFILE_SAMPLE_RATE') or 100)
+    # key used to sign the X-Profile-Request header, signed headers are ignored if it is not set
+    PROFILE_SECRET = environ.get('PROFILE_SECRET')
+    # `sample` writes collapsed stacks for flame graphs, `cprofile` writes cProfile stats files
+    PROFILE_MODE = environ.get('PROFILE_MODE') or 'sample'
+    # seconds between two stack samples
+    PROFILE_INTERVAL = float(environ.get('PROFILE_INTERVAL') or 0.001)
+    # where profiles are written, a `trivia-profiles` temporary directory by default
+    PROFILE_DIR = environ.get('PROFILE_DIR')
+    # file written by `flask trivia snapshot`, and read when serving from a snapshot
+    SNAPSHOT_PATH = environ.get('SNAPSHOT_PATH')
+    # answer the read routes from the memory-mapped snapshot, writes still go to the database
+    SERVE_FROM_SNAPSHOT = _flag('SERVE_FROM_SNAPSHOT', 'false')
+    # seconds between two checks for a new snapshot file
+    SNAPSHOT_CHECK_INTERVAL = float(environ.get('SNAPSHOT_CHECK_INTERVAL') or 5)
 
 
 class ProdConfig(Config):
@@ -19,6 +127,11 @@ class ProdConfig(Config):
     DEBUG = False
     TESTING = False
     SQLALCHEMY_DATABASE_URI = environ.get('PROD_DATABASE_URI')
+    # production deploys run `flask db upgrade` once, instead of checking the schema on every start
+    AUTO_MIGRATE = _flag('AUTO_MIGRATE', 'false')
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    # read only routes are spread over these replicas
+    SQLALCHEMY_BINDS = replica_binds(environ.get('PROD_REPLICA_DATABASE_URIS'))
 
 
 class DevConfig(Config):
@@ -26,9 +139,19 @@ class DevConfig(Config):
     ENV = 'development'
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = environ.get('DEV_DATABASE_URI')
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    # read only routes are spread over these replicas
+    SQLALCHEMY_BINDS = replica_binds(environ.get('DEV_REPLICA_DATABASE_URIS'))
 
 
 class TestConfig(DevConfig):
     """testing config"""
     TESTING = True
+    # tests run with the production json output, without debug pretty printing
+    DEBUG = False
+    # the metrics are tested too
+    METRICS_ENABLED = True
     SQLALCHEMY_DATABASE_URI = environ.get('TEST_DATABASE_URI')
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    # read only routes are spread over these replicas
+    SQLALCHEMY_BINDS = replica_binds(environ.get('TEST_REPLICA_DATABASE_URIS'))
@@ -1,9 +1,11 @@
 import os
 from flask import Flask, jsonify, request
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import SQLAlchemyError
+from .routing import RoutingSQLAlchemy, reset_routing, mark_writes
 
 # Instantiating global objects and variables
-db = SQLAlchemy()
+# the routing session sends read only routes to replica databases when they are configured
+db = RoutingSQLAlchemy()
 
 
 def create_app(config=None):
@@ -20,35 +22,89 @@ def create_app(config=None):
             'Please specify a valid configuration profile for the application. Possible choices are `development`, `testing`, or `production`')
     # initializing application extentions
     db.init_app(app)
-    # bind all extentions to the app instance
-    with app.app_context():
-        # import blueprints
-        from .api1 import api1
-        # register blueprints
-        app.register_blueprint(api1, url_prefix='/api/v1')
-        # create all tables in the database
-        db.create_all()
+    # reads right after a write go to the primary database
+    app.before_request(reset_routing)
+    app.after_request(mark_writes)
+    # bind all extentions to the app instance, nothing here connects to the database
+    # import blueprints
+    from .api1 import api1
+    # register blueprints
+    app.register_blueprint(api1, url_prefix='/api/v1')
+    # reading from a memory-mapped snapshot instead of the database, only when serving from one
+    from .snapshot import question_snapshot
+    question_snapshot.init_app(app)
+    # initializing the search backend
+    from .search import question_search
+    question_search.init_app(app)
+    # initializing the category and response caches
+    from .cache import category_cache, response_cache
+    category_cache.init_app(app)
+    response_cache.init_app(app)
+    # initializing the question counters
+    from .stats import question_stats
+    question_stats.init_app(app)
+    # initializing the quiz question pool
+    from .quiz import question_pool, quiz_sessions
+    question_pool.init_app(app)
+    quiz_sessions.init_app(app)
+    # initializing the request metrics, served on /metrics
+    from .metrics import request_metrics
+    request_metrics.init_app(app)
+    # compressing responses. after_request hooks run in reverse order,
+    # so this one runs before the metrics hook and the compression time is counted
+    from .compression import response_compressor
+    response_compressor.init_app(app)
+    # wrapping the api views with the profiler, only when profiling is enabled
+    from .profiling import request_profiler
+    request_profiler.init_app(app)
+    # register the `flask db` and `flask trivia` commands
+    from .migrations import db_cli, upgrade
+    from .bulk import trivia_cli
+    app.cli.add_command(db_cli)
+    app.cli.add_command(trivia_cli)
+    # the database is only used at startup to migrate, warm up or build the suggestion index,
+    # otherwise the first request connects
+    from .warmup import warm_up
+    if app.config['AUTO_MIGRATE'] or app.config['WARM_UP_ON_START'] or app.config['SUGGEST_INDEX_ON_START']:
+        with app.app_context():
+            if app.config['AUTO_MIGRATE']:
+                # bring the database schema up to date
+                upgrade()
+            if app.config['WARM_UP_ON_START']:
+                # load the caches now, instead of in the first requests
+                warm_up()
+            elif app.config['SUGGEST_INDEX_ON_START']:
+                # the first user typing in the search box shouldn't wait for the index
+                try:
+                    question_search.build()
+                except SQLAlchemyError:
+                    # E.G. `flask db upgrade` on a new database, the first suggestion builds it instead
+                    db.session.rollback()
+                    app.logger.warning('the suggestion index could not be built at startup', exc_info=True)
+        # close the connections opened above, so worker processes forked from this one (E.G. gunicorn --preload)
+        # don't share them, every process connects on its first query instead
+        db.get_engine(app).dispose()
 
-        # force 404 and 405 errors to return a json object if requested from the api blueprint
-        @app.errorhandler(404)
-        def _handle_404(error):
-            if request.path.startswith('/api/v1/'):
-                return jsonify({
-                    'success': False,
-                    'error': 404,
-                    'message': 'resource not found'
-                }), 404
-            else:
-                return error
+    # force 404 and 405 errors to return a json object if requested from the api blueprint
+    @app.errorhandler(404)
+    def _handle_404(error):
+        if request.path.startswith('/api/v1/'):
+            return jsonify({
+                'success': False,
+                'error': 404,
+                'message': 'resource not found'
+            }), 404
+        else:
+            return error
 
-        @app.errorhandler(405)
-        def _handle_405(error):
-            if request.path.startswith('/api/v1/'):
-                return jsonify({
-                    'success': False,
-                    'error': 405,
-                    'message': 'method not allowed'
-                }), 405
-            else:
-                return error
+    @app.errorhandler(405)
+    def _handle_405(error):
+        if request.path.startswith('/api/v1/'):
+            return jsonify({
+                'success': False,
+                'error': 405,
+                'message': 'method not allowed'
+            }), 405
+        else:
+            return error
     return app
@@ -0,0 +1,77 @@
+# pagination.py
+# keyset (cursor) pagination helpers for the api routes
+import base64
+import json
+
+from flask import abort, request, current_app
+
+
+def cursor_requested():
+    '''return True if the client asked for cursor pagination instead of page numbers'''
+    return 'after_id' in request.args or 'cursor' in request.args
+
+
+def encode_cursor(last_id):
+    '''build an opaque cursor that points right after the given question id'''
+    raw = json.dumps({'after_id': last_id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    '''read the question id back from an opaque cursor, return None if it is envalid'''
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(cursor + padding))
+        return int(data['after_id'])
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+def cursor_args():
+    '''
+    read the cursor arguments from the query string.
+    returns a tuple of (after_id, limit, with_total), or aborts with a 400 error.
+    '''
+    if 'cursor' in request.args:
+        after_id = decode_cursor(request.args.get('cursor'))
+    else:
+        after_id = request.args.get('after_id', type=int)
+    if after_id is None:
+        # the cursor or after_id could not be read
+        abort(400)
+    limit = request.args.get(
+        'limit', current_app.config['QUESTIONS_PER_PAGE'], type=int)
+    if limit is None or limit < 1:
+        abort(400)
+    # never let a client request more than the configured maximum
+    limit = min(limit, current_app.config['MAX_QUESTIONS_PER_PAGE'])
+    with_total = request.args.get('with_total', '').lower() in ('1', 'true', 'yes')
+    return after_id, limit, with_total
+
+
+def paginate_by_key(fetch, after_id, limit):
+    '''
+    seek past after_id using the primary key, without an OFFSET or a COUNT(*).
+    `fetch(after_id, limit)` should return up to `limit` rows with a greater id, ordered by id.
+    returns a tuple of (items, next_cursor), where next_cursor is None on the last page.
+    '''
+    # fetch one extra row to know if there is a next page
+    rows = fetch(after_id, limit + 1)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1].id)
+    return rows, None
+
+
+def paginate_without_count(fetch, page, per_page):
+    '''
+    return the items of a page like `paginate` does, aborting with a 404 error for envalid pages,
+    but without running a COUNT(*). totals come from the question counters instead.
+    `fetch(offset, limit)` should return the rows of the page.
+    '''
+    if page is None or page < 1:
+        abort(404)
+    items = fetch((page - 1) * per_page, per_page)
+    if not items and page != 1:
+        abort(404)
+    return items
@@ -1,12 +1,22 @@
 # routes.py
 # for rendering api routes
 from flaskr import db
-from flaskr.models import Question, Category
+from flaskr.models import Question
+from flaskr.cache import category_cache, response_cache
+from flaskr.search import question_search
+from flaskr.quiz import (question_pool, quiz_sessions, QuizSession,
+                         deal_deck, encode_deck_token, decode_deck_token)
+from flaskr.stats import question_stats
+from flaskr.serializers import format_rows, json_response
+from flaskr.readers import question_page, questions_after
+from flaskr.bulk import (validate_question, import_questions, apply_batch, iter_questions,
+                         FORMATTERS, encode_chunks, gzip_chunks)
 from . import api1
-from flask import abort, request, jsonify, current_app
-from sqlalchemy import func
+from flaskr.routing import read_only
+from .pagination import cursor_requested, cursor_args, paginate_by_key, paginate_without_count
+from flask import abort, request, jsonify, current_app, Response, stream_with_context
 
-import random
+from functools import partial
 
 
 @api1.after_request
@@ -16,39 +26,73 @@ def after_request(response):
                          'Content-Type,Authorization,true')
     response.headers.add('Access-Control-Allow-Methods',
                          'GET,PATCH,POST,DELETE,OPTIONS')
-    response.headers.add('Content-Type', 'application/json')
+    if response.mimetype == 'application/json':
+        # streamed exports keep their own content type
+        response.headers.add('Content-Type', 'application/json')
     return response
 
 
 @api1.route('/categories')
+@read_only
+@response_cache.cached
 def get_categories():
     '''get all categories'''
-    categories = Category.query.all()
-    category_dict = {category.id: category.type for category in categories}
+    category_dict = category_cache.all()
     if len(category_dict) == 0:  # no categories available, return a 404 error
         abort(404)
-    return jsonify({
+    response = jsonify({
         'success': True,
         'categories': category_dict
     })
+    # let browsers and caches revalidate with If-None-Match, and get a 304 if nothing changed
+    response.set_etag(category_cache.get_etag())
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['CATEGORIES_MAX_AGE']
+    return response.make_conditional(request)
+
+
+@api1.route('/categories/stats')
+@read_only
+@response_cache.cached
+def get_categories_stats():
+    '''get the number of questions of every category, by difficulty'''
+    category_dict = category_cache.all()
+    if len(category_dict) == 0:  # no categories available, return a 404 error
+        abort(404)
+    # the counts come from the question counters, without a query per category
+    stats = question_stats.category_stats(category_dict)
+    return jsonify({
+        'success': True,
+        'categories': {category_id: {
+            'type': category_type,
+            'total_questions': stats[category_id][0],
+            'difficulties': stats[category_id][1]
+        } for category_id, category_type in category_dict.items()},
+        'total_questions': question_stats.total()
+    })
 
 
 @api1.route('/questions')
+@read_only
+@response_cache.cached
 def get_questions():
     '''gett all questions'''
+    if cursor_requested():
+        # the client opted in to keyset pagination
+        return get_questions_by_cursor()
     # paginate questions, and store the current page questions in a list
     page = request.args.get('page', 1, type=int)
-    selection = Question.query.order_by(Question.id).paginate(
-        page, current_app.config['QUESTIONS_PER_PAGE'], True)
-    total_questions = selection.total
+    # only the question columns are loaded, as tuples
+    items = paginate_without_count(question_page, page, current_app.config['QUESTIONS_PER_PAGE'])
+    # the total comes from the question counters, instead of a COUNT(*)
+    total_questions = question_stats.total()
     if total_questions == 0:
         # no questions are found, abort with a 404 error.
         abort(404)
-    current_questions = [question.format() for question in selection.items]
-    # load all categories from db
-    categories = Category.query.all()
-    category_dict = {category.id: category.type for category in categories}
-    return jsonify({
+    current_questions = format_rows(items)
+    # load all categories from the cache
+    category_dict = category_cache.all()
+    return json_response({
         'success': True,
         'questions': current_questions,
         'total_questions': total_questions,
@@ -56,7 +100,48 @@ def get_questions():
     })
 
 
+def get_questions_by_cursor():
+    '''get questions after a cursor, seeking by id instead of using an offset'''
+    after_id, limit, with_total = cursor_args()
+    items, next_cursor = paginate_by_key(questions_after, after_id, limit)
+    if not items:
+        # no questions are found after this cursor, abort with a 404 error.
+        abort(404)
+    category_dict = category_cache.all()
+    result = {
+        'success': True,
+        'questions': format_rows(items),
+        'next_cursor': next_cursor,
+        'categories': category_dict
+    }
+    if with_total:
+        # the total is only added when the client asks for it
+        result['total_questions'] = question_stats.total()
+    return json_response(result)
+
+
+@api1.route('/questions/suggest')
+@read_only
+def suggest_questions():
+    '''suggest questions as the user types, from the in-memory search index'''
+    prefix = request.args.get('prefix', '').strip()
+    if not prefix:
+        # a prefix is required
+        abort(400)
+    limit = request.args.get('limit', current_app.config['SUGGEST_LIMIT'], type=int)
+    if limit is None or limit < 1:
+        abort(400)
+    # more than SUGGEST_MAX_LIMIT suggestions are never returned
+    suggestions = question_search.suggest(prefix, limit, current_app.config['SUGGEST_SNIPPET_LENGTH'])
+    return jsonify({
+        'success': True,
+        'suggestions': [{'id': question_id, 'question': question, 'snippet': snippet}
+                        for question_id, question, snippet in suggestions]
+    })
+
+
 @api1.route('/questions/search', methods=['POST'])
+@read_only
 def search_questions():
     '''search for a question in the database'''
     body = request.get_json()
@@ -66,16 +151,20 @@ def search_questions():
     if body.get('searchTerm'):
         # searchTerm is available in the request body
         search_term = body.get('searchTerm')
-        # query the database for paginated results, store the current page results in a list
+        if type(search_term) != str:
+            # numbers, lists or objects can't be searched for
+            abort(400)
+        # answers are only searched if the client asks for it
+        search_answers = bool(body.get('searchAnswers'))
+        # search for ranked, paginated results, store the current page results in a list
         page = request.args.get('page', 1, type=int)
-        selection = Question.query.filter(
-            Question.question.ilike(f'%{search_term}%')).paginate(page, current_app.config['QUESTIONS_PER_PAGE'], True)
-        total_questions = selection.total
+        items, total_questions = question_search.search(
+            search_term, page, current_app.config['QUESTIONS_PER_PAGE'], search_answers)
         if total_questions == 0:
             # no questions are available in the search results
             abort(404)
-        current_questions = [question.format() for question in selection.items]
-        return jsonify({
+        current_questions = format_rows(items)
+        return json_response({
             'success': True,
             'questions': current_questions,
             'total_questions': total_questions
@@ -91,44 +180,107 @@ def post_new_question():
     if not body:
         # posting an envalid json should return a 400 error.
         abort(400)
-    if (body.get('question') and body.get('answer') and body.get('difficulty') and body.get('category')):
-        # posted a new question
-        new_question = body.get('question')
-        new_answer = body.get('answer')
-        new_category = body.get('category')
-        new_difficulty = body.get('difficulty')
-        # insure that difficulty is only from 1 to 5
-        if not 1 <= int(new_difficulty) < 6:
-            abort(400)
-        try:
-            # insert the new question to the database
-            question = Question(new_question, new_answer,
-                                new_category, new_difficulty)
-            question.insert()
-            # query the database for all questions
-            page = request.args.get('page', 1, type=int)
-            selection = Question.query.order_by(Question.id).paginate(
-                page, current_app.config['QUESTIONS_PER_PAGE'], True)
-            total_questions = selection.total
-            if total_questions == 0:
-                # no questions were found, return a 404 error.
-                abort(404)
-            current_questions = [question.format()
-                                 for question in selection.items]
+    try:
+        # check the posted question, the same way bulk imports do
+        fields = validate_question(body)
+    except ValueError:
+        # missing fields, or a difficulty that is not from 1 to 5, should return a 400 error
+        abort(400)
+    try:
+        # insert the new question to the database
+        question = Question(fields['question'], fields['answer'],
+                            fields['category'], fields['difficulty'])
+        question.insert()
+        if request.args.get('return') == 'minimal' or request.headers.get('Prefer') == 'return=minimal':
+            # the client only needs the id of the new question, skip loading a page
             return jsonify({
                 'success': True,
-                'id': question.id,
-                'question': question.question,
-                'questions': current_questions,
-                'total_questions': total_questions
+                'id': question.id
             })
-        except:
-            # creating the question failed, rollback and close the connection
-            db.session.rollback()
-            abort(422)
+        # query the database for all questions
+        page = request.args.get('page', 1, type=int)
+        items = paginate_without_count(question_page, page, current_app.config['QUESTIONS_PER_PAGE'])
+        total_questions = question_stats.total()
+        if total_questions == 0:
+            # no questions were found, return a 404 error.
+            abort(404)
+        current_questions = format_rows(items)
+        return json_response({
+            'success': True,
+            'id': question.id,
+            'question': question.question,
+            'questions': current_questions,
+            'total_questions': total_questions
+        })
+    except:
+        # creating the question failed, rollback and close the connection
+        db.session.rollback()
+        abort(422)
+
+
+@api1.route('/questions/bulk', methods=['POST'])
+def bulk_post_questions():
+    '''insert many questions from a streamed NDJSON or CSV body'''
+    if request.mimetype == 'text/csv' or request.args.get('format') == 'csv':
+        format = 'csv'
     else:
-        # anything else posted in the body should return a 400 error
+        format = 'ndjson'
+    try:
+        # the body is read and inserted one batch at a time
+        inserted, rejected, errors = import_questions(request.stream, format)
+    except Exception:
+        abort(422)
+    if inserted == 0 and rejected == 0:
+        # an empty body should return a 400 error
         abort(400)
+    return jsonify({
+        'success': True,
+        'inserted': inserted,
+        'rejected': rejected,
+        'errors': errors
+    })
+
+
+@api1.route('/questions/batch', methods=['POST'])
+def batch_questions():
+    '''create and delete many questions in one transaction'''
+    body = request.get_json()
+    operations = body.get('operations') if isinstance(body, dict) else None
+    if type(operations) != list or not 0 < len(operations) <= current_app.config['BATCH_MAX_OPERATIONS']:
+        # operations should be a non empty list, of a bounded size
+        abort(400)
+    try:
+        results = apply_batch(operations)
+    except Exception:
+        # the transaction was rolled back, nothing was changed
+        abort(422)
+    return jsonify({
+        'success': True,
+        'results': results,
+        'created': sum(result['status'] == 'created' for result in results),
+        'deleted': sum(result['status'] == 'deleted' for result in results)
+    })
+
+
+@api1.route('/questions/export')
+@read_only
+def export_questions():
+    '''stream all questions as NDJSON or CSV, in one pass over a server side cursor'''
+    format = request.args.get('format', 'ndjson')
+    if format not in FORMATTERS:
+        abort(400)
+    chunks = encode_chunks(FORMATTERS[format](iter_questions()))
+    headers = {
+        'Content-Disposition': f'attachment; filename=questions.{format}',
+        'Vary': 'Accept-Encoding'
+    }
+    if 'gzip' in request.accept_encodings:
+        # compress on the fly when the client accepts it
+        chunks = gzip_chunks(chunks)
+        headers['Content-Encoding'] = 'gzip'
+    mimetype = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    # the database session is needed while the response is streamed
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
 
 
 @api1.route('/questions/<question_id>', methods=['DELETE'])
@@ -152,31 +304,52 @@ def delete_question(question_id):
 
 
 @api1.route('/categories/<category_id>/questions')
+@read_only
+@response_cache.cached
 def get_questions_by_category(category_id):
     '''Get all questions for a specific category'''
-    category = Category.query.filter(Category.id == category_id).one_or_none()
+    category_type = category_cache.get(category_id)
     # abort with a 404 error if category is unavailable
-    if category is None:
+    if category_type is None:
         abort(404)
+    category_id = int(category_id)
+    if cursor_requested():
+        # the client opted in to keyset pagination
+        after_id, limit, with_total = cursor_args()
+        items, next_cursor = paginate_by_key(
+            partial(questions_after, category_id=category_id), after_id, limit)
+        if not items:
+            # no questions are found after this cursor, abort with a 404 error.
+            abort(404)
+        result = {
+            'success': True,
+            'questions': format_rows(items),
+            'next_cursor': next_cursor,
+            'current_category': category_type
+        }
+        if with_total:
+            result['total_questions'] = question_stats.category_total(category_id)
+        return json_response(result)
     # paginate questions, and store the current page questions in a list
     page = request.args.get('page', 1, type=int)
-    selection = Question.query.filter(
-        Question.category == category.id).order_by(Question.id).paginate(page, current_app.config['QUESTIONS_PER_PAGE'], True)
-    total_questions = selection.total
+    items = paginate_without_count(partial(question_page, category_id=category_id),
+                                   page, current_app.config['QUESTIONS_PER_PAGE'])
+    # the total comes from the question counters, instead of a COUNT(*)
+    total_questions = question_stats.category_total(category_id)
     if total_questions == 0:
         # if there are no questions for this category, return a 404 error
         abort(404)
-    total_questions = selection.total
-    current_questions = [question.format() for question in selection.items]
-    return jsonify({
+    current_questions = format_rows(items)
+    return json_response({
         'success': True,
         'questions': current_questions,
         'total_questions': total_questions,
-        'current_category': category.type
+        'current_category': category_type
     })
 
 
 @api1.route('/quizzes', methods=['POST'])
+@read_only
 def play_quiz():
     '''play quiz game'''
     # load the request body
@@ -184,6 +357,9 @@ def play_quiz():
     if not body:
         # posting an envalid json should return a 400 error.
         abort(400)
+    if 'deck_size' in body:
+        # the client asked for a batch of questions
+        return play_quiz_deck(body)
     if (body.get('previous_questions') is None or body.get('quiz_category') is None):
         # if previous_questions or quiz_category are missing, return a 400 error
         abort(400)
@@ -194,30 +370,138 @@ def play_quiz():
     category = body.get('quiz_category')
     # just incase, convert category id to integer
     category_id = int(category['id'])
+    try:
+        # a set makes checking played questions O(1)
+        played = {int(question_id) for question_id in previous_questions}
+    except (TypeError, ValueError):
+        # previous_questions should only contain ids
+        abort(400)
+    mode = body.get('mode', 'random')
+    recent_answers = None
+    if mode == 'adaptive':
+        # the difficulty follows the player's last answers, true for correct ones
+        recent_answers = body.get('recent_answers', [])
+        if type(recent_answers) != list or any(type(answer) != bool for answer in recent_answers):
+            abort(400)
+        window = current_app.config['ADAPTIVE_QUIZ_WINDOW']
+        # a window of 0 ignores the answers, recent_answers[-0:] would keep all of them
+        recent_answers = recent_answers[-window:] if window > 0 else []
+    elif mode != 'random':
+        # only random and adaptive quizzes are available
+        abort(400)
     # insure that there are questions to be played.
-    if category_id == 0:
-        # if category id is 0, query the database for a random object of all questions
-        selection = Question.query.order_by(func.random())
-    else:
-        # load a random object of questions from the specified category
-        selection = Question.query.filter(
-            Question.category == category_id).order_by(func.random())
-    if not selection.all():
+    if not question_pool.ids(category_id):
         # No questions available, abort with a 404 error
         abort(404)
-    else:
-        # load a random question from our previous query, which is not in the previous_questions list.
-        question = selection.filter(Question.id.notin_(
-            previous_questions)).first()
+    # pick a question id from the pool, which is not in the previous_questions list, then load it
+    question = question_pool.pick_question(category_id, played, recent_answers)
     if question is None:
         # all questions were played, returning a success message without a question signifies the end of the game
         return jsonify({
             'success': True
         })
     # Found a question that wasn't played before, let's return it to the user
+    return json_response({
+        'success': True,
+        'question': format_rows([question])[0]
+    })
+
+
+def play_quiz_deck(body):
+    '''return a shuffled deck of unplayed questions, and a token to continue with the next deck'''
+    deck_size = body.get('deck_size')
+    if type(deck_size) != int or not 1 <= deck_size <= current_app.config['QUIZ_DECK_MAX_SIZE']:
+        abort(400)
+    previous_questions = body.get('previous_questions') or []
+    if type(previous_questions) != list:
+        abort(400)
+    if body.get('continuation'):
+        # the category and the played questions come from the signed token
+        session = decode_deck_token(body.get('continuation'))
+        if session is None:
+            abort(400)
+    else:
+        try:
+            session = QuizSession(int(body.get('quiz_category')['id']))
+        except (TypeError, KeyError, ValueError):
+            abort(400)
+    try:
+        played = [int(question_id) for question_id in previous_questions]
+    except (TypeError, ValueError):
+        # previous_questions should only contain ids
+        abort(400)
+    if any(question_id < 0 for question_id in played):
+        abort(400)
+    # ids that are not in the pool can't be dealt anyway, and would grow the played bitset and the token
+    max_id = question_pool.max_id()
+    for question_id in played:
+        if question_id <= max_id:
+            session.played.add(question_id)
+    if not question_pool.ids(session.category_id):
+        # No questions available, abort with a 404 error
+        abort(404)
+    # the deck is sampled from the pool, then loaded in one query by primary key
+    rows = deal_deck(session, deck_size)
+    return json_response({
+        'success': True,
+        'questions': format_rows(rows),
+        # a short deck means every question was played
+        'continuation': encode_deck_token(session) if len(rows) == deck_size else None
+    })
+
+
+@api1.route('/quizzes/sessions', methods=['POST'])
+@read_only
+def create_quiz_session():
+    '''start a quiz game, the played questions are kept on the server'''
+    body = request.get_json()
+    if not body or body.get('quiz_category') is None:
+        # quiz_category is missing, return a 400 error
+        abort(400)
+    try:
+        category_id = int(body.get('quiz_category')['id'])
+    except (TypeError, KeyError, ValueError):
+        abort(400)
+    total_questions = len(question_pool.ids(category_id))
+    if total_questions == 0:
+        # No questions available, abort with a 404 error
+        abort(404)
+    return jsonify({
+        'success': True,
+        'session': quiz_sessions.create(category_id),
+        'total_questions': total_questions
+    })
+
+
+@api1.route('/quizzes/sessions/<token>/next', methods=['POST'])
+@read_only
+def next_quiz_question(token):
+    '''get the next unplayed question of a quiz session'''
+    session = quiz_sessions.load(token)
+    if session is None:
+        # the session is unknown or expired
+        abort(404)
+    question = quiz_sessions.next_question(token, session)
+    if question is None:
+        # all questions were played, returning a success message without a question signifies the end of the game
+        return jsonify({
+            'success': True
+        })
+    return json_response({
+        'success': True,
+        'question': format_rows([question])[0]
+    })
+
+
+@api1.route('/quizzes/sessions/<token>', methods=['DELETE'])
+@read_only
+def end_quiz_session(token):
+    '''end a quiz session'''
+    if not quiz_sessions.end(token):
+        abort(404)
     return jsonify({
         'success': True,
-        'question': question.format()
+        'deleted': token
     })
 
 # error handlers
@@ -0,0 +1,500 @@
+# asgi.py
+# an async ASGI app serving the /api/v1 contract, for many concurrent quiz players in one process.
+# SQLAlchemy 1.3 has no asyncio support, so queries go straight to an async driver:
+# asyncpg for PostgreSQL, or aiosqlite for SQLite.
+import asyncio
+import json
+import logging
+import re
+import time
+from array import array
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from urllib.parse import parse_qs
+
+from sqlalchemy.engine.url import make_url
+
+from .bulk import validate_question
+from .quiz import QuestionPool
+from .search import QuestionSearch, tokenize
+
+logger = logging.getLogger(__name__)
+
+QUESTION_COLUMNS = 'id, question, answer, category, difficulty'
+CONFIGS = {
+    'development': 'DevConfig',
+    'production': 'ProdConfig',
+    'testing': 'TestConfig',
+}
+ERROR_MESSAGES = {
+    400: 'bad request',
+    404: 'resource not found',
+    405: 'method not allowed',
+    422: 'unprocessable',
+    500: 'internal error',
+}
+
+
+class HTTPError(Exception):
+    '''raised by handlers to return a json error'''
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+class AsyncDatabase:
+    '''
+    a thin async database layer. queries use `?` placeholders,
+    which are rewritten to `$1, $2, ...` for asyncpg.
+    both drivers use a pool of `pool_size` connections, so concurrent requests don't wait for each other.
+    '''
+
+    def __init__(self, uri, pool_size=5):
+        self.url = make_url(uri)
+        self.backend = self.url.get_backend_name()
+        self.pool_size = pool_size
+        self.pool = None
+        # idle aiosqlite connections
+        self.connections = None
+
+    async def connect(self):
+        if self.backend == 'postgresql':
+            import asyncpg
+            # asyncpg doesn't understand SQLAlchemy driver names like postgresql+psycopg2
+            dsn = str(self.url).replace(self.url.drivername, 'postgresql', 1)
+            self.pool = await asyncpg.create_pool(dsn, min_size=1, max_size=self.pool_size)
+        elif self.backend == 'sqlite':
+            import aiosqlite
+            database = self.url.database or ':memory:'
+            # every connection to an in-memory database opens a different database
+            size = 1 if database == ':memory:' else self.pool_size
+            self.connections = asyncio.Queue()
+            for _ in range(size):
+                self.connections.put_nowait(await aiosqlite.connect(database))
+        else:
+            raise ValueError(f'no async driver for `{self.backend}` databases')
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+        if self.connections is not None:
+            while not self.connections.empty():
+                await self.connections.get_nowait().close()
+
+    @asynccontextmanager
+    async def connection(self):
+        '''borrow an aiosqlite connection, waiting for one when all of them are busy'''
+        connection = await self.connections.get()
+        try:
+            yield connection
+        finally:
+            self.connections.put_nowait(connection)
+
+    def _sql(self, sql):
+        if self.backend != 'postgresql':
+            return sql
+        parts = sql.split('?')
+        return ''.join(part + (f'${number}' if number < len(parts) else '')
+                       for number, part in enumerate(parts, 1))
+
+    async def fetch_all(self, sql, *args):
+        if self.pool is not None:
+            return [tuple(row) for row in await self.pool.fetch(self._sql(sql), *args)]
+        async with self.connection() as connection:
+            async with connection.execute(sql, args) as cursor:
+                return await cursor.fetchall()
+
+    async def fetch_one(self, sql, *args):
+        rows = await self.fetch_all(sql, *args)
+        return rows[0] if rows else None
+
+    async def insert(self, sql, *args):
+        '''run an INSERT and return the new id'''
+        if self.pool is not None:
+            return await self.pool.fetchval(self._sql(sql) + ' RETURNING id', *args)
+        async with self.connection() as connection:
+            cursor = await connection.execute(sql, args)
+            await connection.commit()
+            return cursor.lastrowid
+
+    async def execute(self, sql, *args):
+        if self.pool is not None:
+            await self.pool.execute(self._sql(sql), *args)
+            return
+        async with self.connection() as connection:
+            await connection.execute(sql, args)
+            await connection.commit()
+
+
+class AsyncQuestionSearch(QuestionSearch):
+    '''the in-memory search index of the Flask app, loaded with the async database'''
+
+    async def load(self, database):
+        if not self.is_stale():
+            return
+        rows = await database.fetch_all('SELECT id, question, answer FROM questions')
+        index = self.load_index(rows)
+        with self.reload.lock:
+            self.swap(index, [])
+
+    def ensure_built(self):
+        # the index is loaded by `load`, never from the Flask session
+        pass
+
+
+class AsyncQuestionPool(QuestionPool):
+    '''the quiz question pool, loaded with the async database'''
+
+    async def load(self, database):
+        if not self.is_stale():
+            return
+        pools, levels = {0: array('l')}, {}
+        for question_id, category, difficulty in await database.fetch_all(
+                'SELECT id, category, difficulty FROM questions ORDER BY id'):
+            self._add(pools, levels, question_id, category, difficulty)
+        with self.reload.lock:
+            self.swap((pools, levels), [])
+
+    def ensure_loaded(self):
+        # the pools are loaded by `load`, never from the Flask session
+        pass
+
+    def ids(self, category_id):
+        return self.pools.get(category_id, array('l'))
+
+
+def format_question(row):
+    return dict(zip(('id', 'question', 'answer', 'category', 'difficulty'), row))
+
+
+class Request:
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.headers = {key.decode().lower(): value.decode() for key, value in scope.get('headers', [])}
+        self.args = {key: values[0] for key, values in
+                     parse_qs(scope.get('query_string', b'').decode()).items()}
+        self.body = body
+
+    def arg_int(self, name, default):
+        '''like request.args.get(name, default, type=int) in Flask'''
+        try:
+            return int(self.args[name])
+        except (KeyError, ValueError):
+            return default
+
+    def get_json(self):
+        try:
+            return json.loads(self.body) if self.body else None
+        except ValueError:
+            raise HTTPError(400)
+
+
+class TriviaASGI:
+    '''the trivia API as an ASGI application, with async route handlers'''
+
+    def __init__(self, config):
+        self.config = config
+        self.database = AsyncDatabase(config.SQLALCHEMY_DATABASE_URI, config.ASYNC_POOL_SIZE)
+        self.connected = False
+        self.pool = AsyncQuestionPool()
+        self.pool.ttl = config.QUIZ_POOL_TTL
+        self.search = AsyncQuestionSearch()
+        self.search.ttl = config.SEARCH_INDEX_TTL
+        self.search.top_k = config.SUGGEST_MAX_LIMIT
+        self.categories = None
+        self.categories_loaded_at = 0
+        self.routes = [
+            ('GET', re.compile(r'/api/v1/categories$'), self.get_categories),
+            ('GET', re.compile(r'/api/v1/questions$'), self.get_questions),
+            ('POST', re.compile(r'/api/v1/questions$'), self.post_new_question),
+            ('POST', re.compile(r'/api/v1/questions/search$'), self.search_questions),
+            ('DELETE', re.compile(r'/api/v1/questions/(?P<question_id>[^/]+)$'), self.delete_question),
+            ('GET', re.compile(r'/api/v1/categories/(?P<category_id>[^/]+)/questions$'),
+             self.get_questions_by_category),
+            ('POST', re.compile(r'/api/v1/quizzes$'), self.play_quiz),
+        ]
+
+    # ASGI protocol
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.handle(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.startup()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def startup(self):
+        if not self.connected:
+            await self.database.connect()
+            self.connected = True
+
+    async def shutdown(self):
+        if self.connected:
+            await self.database.close()
+            self.connected = False
+
+    async def handle(self, scope, receive, send):
+        body = b''
+        while True:
+            message = await receive()
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        request = Request(scope, body)
+        # like the Flask blueprint, only responses of matched routes get CORS headers
+        matched = False
+        try:
+            handler, params = self.route(request)
+            matched = True
+            if handler is None:
+                # a CORS preflight request, answered without a body like Flask does
+                await self.respond(send, request, 200, b'', matched)
+                return
+            # servers without lifespan support connect on the first request
+            await self.startup()
+            status, payload = 200, await handler(request, **params)
+        except HTTPError as error:
+            status, payload = error.code, self.error(error.code)
+        except Exception:
+            logger.exception('%s %s failed', request.method, request.path)
+            status, payload = 500, self.error(500)
+        # the same json layout as Flask's jsonify
+        data = (json.dumps(payload, indent=None, separators=(',', ':'), sort_keys=True) + '\n').encode()
+        await self.respond(send, request, status, data, matched)
+
+    async def respond(self, send, request, status, data, cors):
+        headers = [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(data)).encode()),
+        ]
+        if cors:
+            # flask-cors sends back the origin of the request, or `*` when there is none
+            origin = request.headers.get('origin')
+            headers += [
+                (b'access-control-allow-headers', b'Content-Type,Authorization,true'),
+                (b'access-control-allow-methods', b'GET,PATCH,POST,DELETE,OPTIONS'),
+                (b'access-control-allow-origin', origin.encode() if origin else b'*'),
+            ]
+            if origin:
+                headers.append((b'vary', b'Origin'))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': data})
+
+    def route(self, request):
+        '''return (handler, url parameters) of the request, with a None handler for OPTIONS requests'''
+        path_found = False
+        for method, pattern, handler in self.routes:
+            match = pattern.match(request.path)
+            if match is None:
+                continue
+            path_found = True
+            if method == request.method:
+                return handler, match.groupdict()
+        if path_found and request.method == 'OPTIONS':
+            return None, {}
+        raise HTTPError(405 if path_found else 404)
+
+    @staticmethod
+    def error(code):
+        return {
+            'success': False,
+            'error': code,
+            'message': ERROR_MESSAGES[code]
+        }
+
+    # helpers
+
+    async def category_dict(self):
+        '''return the {id: type} map of all categories, cached like the Flask category cache'''
+        ttl = self.config.CATEGORY_CACHE_TTL
+        if self.categories is None or (ttl and time.monotonic() - self.categories_loaded_at > ttl):
+            rows = await self.database.fetch_all('SELECT id, type FROM categories ORDER BY id')
+            self.categories = dict(rows)
+            self.categories_loaded_at = time.monotonic()
+        return self.categories
+
+    async def paginate(self, request, where='', args=()):
+        '''return (current page questions, total) like `paginate`, aborting with a 404 error for envalid pages'''
+        page = request.arg_int('page', 1)
+        per_page = self.config.QUESTIONS_PER_PAGE
+        if page < 1:
+            raise HTTPError(404)
+        rows = await self.database.fetch_all(
+            f'SELECT {QUESTION_COLUMNS} FROM questions {where} ORDER BY id LIMIT ? OFFSET ?',
+            *args, per_page, (page - 1) * per_page)
+        if not rows and page != 1:
+            raise HTTPError(404)
+        total = (await self.database.fetch_one(f'SELECT count(*) FROM questions {where}', *args))[0]
+        return [format_question(row) for row in rows], total
+
+    # route handlers
+
+    async def get_categories(self, request):
+        categories = await self.category_dict()
+        if not categories:
+            raise HTTPError(404)
+        return {
+            'success': True,
+            'categories': categories
+        }
+
+    async def get_questions(self, request):
+        questions, total = await self.paginate(request)
+        if total == 0:
+            raise HTTPError(404)
+        return {
+            'success': True,
+            'questions': questions,
+            'total_questions': total,
+            'categories': await self.category_dict()
+        }
+
+    async def search_questions(self, request):
+        body = request.get_json()
+        if not body or not body.get('searchTerm') or type(body['searchTerm']) != str:
+            raise HTTPError(400)
+        # ranked word prefix matching, with the in-memory index of the Flask app
+        words = tokenize(body['searchTerm'])
+        if not words:
+            raise HTTPError(404)
+        await self.search.load(self.database)
+        ids = self.search.ranked_ids(words, bool(body.get('searchAnswers')))
+        page = request.arg_int('page', 1)
+        per_page = self.config.QUESTIONS_PER_PAGE
+        start = (page - 1) * per_page
+        if page < 1 or (ids and start >= len(ids)):
+            raise HTTPError(404)
+        total = len(ids)
+        if total == 0:
+            raise HTTPError(404)
+        page_ids = ids[start:start + per_page]
+        rows = await self.database.fetch_all(
+            f'SELECT {QUESTION_COLUMNS} FROM questions WHERE id IN ({", ".join("?" * len(page_ids))})', *page_ids)
+        # in rank order
+        by_id = {row[0]: row for row in rows}
+        questions = [format_question(by_id[question_id]) for question_id in page_ids if question_id in by_id]
+        return {
+            'success': True,
+            'questions': questions,
+            'total_questions': total
+        }
+
+    async def post_new_question(self, request):
+        body = request.get_json()
+        if not body:
+            raise HTTPError(400)
+        try:
+            fields = validate_question(body)
+        except ValueError:
+            raise HTTPError(400)
+        try:
+            question_id = await self.database.insert(
+                'INSERT INTO questions (question, answer, category, difficulty) VALUES (?, ?, ?, ?)',
+                fields['question'], fields['answer'], fields['category'], fields['difficulty'])
+        except Exception:
+            raise HTTPError(422)
+        self.pool.questions_changed('insert', [SimpleNamespace(id=question_id, **fields)])
+        self.search.questions_changed('insert', [SimpleNamespace(id=question_id, **fields)])
+        if request.args.get('return') == 'minimal':
+            return {
+                'success': True,
+                'id': question_id
+            }
+        questions, total = await self.paginate(request)
+        return {
+            'success': True,
+            'id': question_id,
+            'question': fields['question'],
+            'questions': questions,
+            'total_questions': total
+        }
+
+    async def delete_question(self, request, question_id):
+        try:
+            question_id = int(question_id)
+            row = await self.database.fetch_one('SELECT id FROM questions WHERE id = ?', question_id)
+            if row is None:
+                raise HTTPError(404)
+            await self.database.execute('DELETE FROM questions WHERE id = ?', question_id)
+        except Exception:
+            # like the Flask route, any failure is reported as unprocessable
+            raise HTTPError(422)
+        self.pool.questions_changed('delete', [SimpleNamespace(id=question_id)])
+        self.search.questions_changed('delete', [SimpleNamespace(id=question_id)])
+        return {
+            'success': True,
+            'deleted': str(question_id)
+        }
+
+    async def get_questions_by_category(self, request, category_id):
+        categories = await self.category_dict()
+        try:
+            category_id = int(category_id)
+        except ValueError:
+            raise HTTPError(404)
+        if category_id not in categories:
+            raise HTTPError(404)
+        questions, total = await self.paginate(request, 'WHERE category = ?', (category_id,))
+        if total == 0:
+            raise HTTPError(404)
+        return {
+            'success': True,
+            'questions': questions,
+            'total_questions': total,
+            'current_category': categories[category_id]
+        }
+
+    async def play_quiz(self, request):
+        body = request.get_json()
+        if not body:
+            raise HTTPError(400)
+        previous_questions = body.get('previous_questions')
+        if previous_questions is None or body.get('quiz_category') is None:
+            raise HTTPError(400)
+        if type(previous_questions) != list:
+            raise HTTPError(400)
+        try:
+            category_id = int(body['quiz_category']['id'])
+            played = {int(question_id) for question_id in previous_questions}
+        except (TypeError, KeyError, ValueError):
+            raise HTTPError(400)
+        await self.pool.load(self.database)
+        if not self.pool.ids(category_id):
+            raise HTTPError(404)
+        for _ in range(2):
+            question_id = self.pool.pick(category_id, played)
+            if question_id is None:
+                # all questions were played, the end of the game
+                return {'success': True}
+            row = await self.database.fetch_one(
+                f'SELECT {QUESTION_COLUMNS} FROM questions WHERE id = ?', question_id)
+            if row is not None:
+                return {
+                    'success': True,
+                    'question': format_question(row)
+                }
+            # the question was deleted by another process, reload the pools and try again
+            self.pool.invalidate()
+            await self.pool.load(self.database)
+        return {'success': True}
+
+
+def create_asgi_app(config=None):
+    '''create the ASGI app with the same configuration profiles as `create_app`'''
+    if config not in CONFIGS:
+        raise EnvironmentError(
+            'Please specify a valid configuration profile for the application. Possible choices are `development`, `testing`, or `production`')
+    import config as config_module
+    return TriviaASGI(getattr(config_module, CONFIGS[config]))
@@ -0,0 +1,372 @@
+# bulk.py
+# streaming import and export of questions, in NDJSON or CSV
+import csv
+import io
+import json
+import zlib
+from itertools import islice
+
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import select
+
+from . import db
+from .cache import category_cache
+from .models import Question, notify_questions_changed
+from .serializers import QUESTION_FIELDS, QuestionRow
+from .snapshot import build_snapshot
+from .warmup import warm_up
+
+# the fields of a question, in import and export order
+FIELDS = ('id', 'question', 'answer', 'category', 'difficulty')
+IMPORT_FIELDS = ('question', 'answer', 'category', 'difficulty')
+# only the first errors are reported back, so that a bad file can't fill the memory
+MAX_REPORTED_ERRORS = 100
+# the lowest limit of bound variables per statement, of SQLite versions before 3.32
+SQLITE_MAX_VARIABLES = 999
+
+
+def validate_question(record):
+    '''
+    check a posted question, the same way for single and bulk inserts.
+    returns a dict of the question fields, or raises a ValueError.
+    '''
+    if not isinstance(record, dict):
+        raise ValueError('a question should be an object')
+    if not (record.get('question') and record.get('answer') and record.get('difficulty') and record.get('category')):
+        raise ValueError('question, answer, difficulty and category are required')
+    try:
+        difficulty = int(record.get('difficulty'))
+        category = int(record.get('category'))
+    except (TypeError, ValueError):
+        raise ValueError('difficulty and category should be integers')
+    # insure that difficulty is only from 1 to 5
+    if not 1 <= difficulty < 6:
+        raise ValueError('difficulty should be from 1 to 5')
+    return {
+        'question': record.get('question'),
+        'answer': record.get('answer'),
+        'category': category,
+        'difficulty': difficulty
+    }
+
+
+# parsers, yielding (line number, record or None, error or None) one line at a time
+
+def parse_ndjson(lines):
+    for number, line in enumerate(lines, 1):
+        try:
+            if isinstance(line, bytes):
+                line = line.decode('utf-8')
+        except UnicodeDecodeError:
+            yield number, None, 'invalid utf-8'
+            continue
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line), None
+        except ValueError:
+            yield number, None, 'invalid json'
+
+
+def parse_csv(lines):
+    # numbers of the lines that are not utf-8, reported in order with the records
+    bad_lines = []
+
+    def decoded():
+        for number, line in enumerate(lines, 1):
+            try:
+                yield line.decode('utf-8') if isinstance(line, bytes) else line
+            except UnicodeDecodeError:
+                bad_lines.append(number)
+                # an empty line keeps the line numbers, and is skipped by the reader
+                yield '\n'
+    reader = csv.DictReader(decoded())
+    for record in reader:
+        while bad_lines:
+            yield bad_lines.pop(0), None, 'invalid utf-8'
+        yield reader.line_num, record, None
+    while bad_lines:
+        yield bad_lines.pop(0), None, 'invalid utf-8'
+
+
+PARSERS = {'ndjson': parse_ndjson, 'csv': parse_csv}
+
+
+def batched(iterable, size):
+    '''yield lists of up to `size` items'''
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def copy_rows(rows):
+    '''insert rows using PostgreSQL COPY, which is much faster than INSERT statements'''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[field] for field in IMPORT_FIELDS])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(
+        f'COPY questions ({", ".join(IMPORT_FIELDS)}) FROM STDIN WITH (FORMAT csv)', buffer)
+
+
+def insert_rows(rows):
+    '''insert a batch of question dicts in as few statements as possible'''
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        copy_rows(rows)
+    elif dialect == 'sqlite':
+        # SQLite runs in process, executemany has no round trips and no variable limit
+        db.session.execute(Question.__table__.insert(), rows)
+    else:
+        # a single multi-row INSERT ... VALUES statement
+        db.session.execute(Question.__table__.insert().values(rows))
+
+
+def import_questions(lines, format='ndjson', batch_size=None):
+    '''
+    validate and insert questions from an iterable of lines, one batch at a time,
+    so that memory use doesn't depend on the size of the input.
+    all batches are committed in one transaction, so a failing batch leaves the database unchanged.
+    returns a tuple of (inserted, rejected, errors), errors being a list of {line, message} dicts.
+    '''
+    batch_size = batch_size or current_app.config['BULK_BATCH_SIZE']
+    categories = category_cache.all()
+    result = {'rejected': 0, 'errors': []}
+
+    def valid_records():
+        for number, record, error in PARSERS[format](lines):
+            if error is None:
+                try:
+                    record = validate_question(record)
+                    if record['category'] not in categories:
+                        raise ValueError('unknown category')
+                    yield record
+                    continue
+                except ValueError as exception:
+                    error = str(exception)
+            result['rejected'] += 1
+            if len(result['errors']) < MAX_REPORTED_ERRORS:
+                result['errors'].append({'line': number, 'message': error})
+
+    inserted = 0
+    try:
+        for batch in batched(valid_records(), batch_size):
+            insert_rows(batch)
+            inserted += len(batch)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    if inserted:
+        # the new ids are unknown, let caches and indexes reload
+        notify_questions_changed('reload')
+    return inserted, result['rejected'], result['errors']
+
+
+def delete_rows(ids, batch_size):
+    '''delete questions with one DELETE ... WHERE id IN per batch of ids, returning the deleted rows'''
+    table = Question.__table__
+    columns = [table.c[field] for field in QUESTION_FIELDS]
+    returning = db.session.get_bind().dialect.name == 'postgresql'
+    deleted = []
+    for batch in batched(ids, batch_size):
+        condition = table.c.id.in_(batch)
+        if returning:
+            deleted.extend(db.session.execute(table.delete().where(condition).returning(*columns)))
+        else:
+            # the rows are read first, in the same transaction, to tell the listeners what was deleted
+            deleted.extend(db.session.execute(select(columns).where(condition)))
+            db.session.execute(table.delete().where(condition))
+    return deleted
+
+
+def insert_returning(rows, batch_size):
+    '''
+    insert question dicts with one multi-row INSERT per batch, returning their new ids in the same order.
+    other databases than PostgreSQL and SQLite can't tell the ids of a multi-row INSERT,
+    so their rows are inserted one at a time, still in the same transaction.
+    '''
+    table = Question.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        # one multi-row INSERT ... RETURNING per batch
+        return [question_id for batch in batched(rows, batch_size)
+                for question_id, in db.session.execute(table.insert().values(batch).returning(table.c.id))]
+    if dialect == 'sqlite':
+        ids = []
+        # older SQLite versions bind at most 999 variables per statement
+        for batch in batched(rows, min(batch_size, SQLITE_MAX_VARIABLES // len(IMPORT_FIELDS))):
+            # SQLite holds the write lock until the commit, so the rows of a statement get consecutive ids,
+            # ending with the last inserted rowid
+            last_id = db.session.execute(table.insert().values(batch)).lastrowid
+            ids.extend(range(last_id - len(batch) + 1, last_id + 1))
+        return ids
+    return [db.session.execute(table.insert(), row).inserted_primary_key[0] for row in rows]
+
+
+def apply_batch(operations, batch_size=None):
+    '''
+    run a list of {"op": "create", question fields} and {"op": "delete", "id": id} operations in one transaction.
+    invalid operations are rejected without failing the others.
+    returns a list of {status, id or message} dicts, one per operation, in the same order.
+    '''
+    batch_size = batch_size or current_app.config['BULK_BATCH_SIZE']
+    categories = category_cache.all()
+    results = [None] * len(operations)
+    # (index, question fields) of creates, and {question id: [indexes]} of deletes
+    creates, deletes = [], {}
+    for index, operation in enumerate(operations):
+        try:
+            op = operation.get('op') if isinstance(operation, dict) else None
+            if op == 'create':
+                record = validate_question(operation)
+                if record['category'] not in categories:
+                    raise ValueError('unknown category')
+                creates.append((index, record))
+            elif op == 'delete':
+                question_id = operation.get('id')
+                if type(question_id) != int:
+                    raise ValueError('id should be an integer')
+                deletes.setdefault(question_id, []).append(index)
+            else:
+                raise ValueError('op should be `create` or `delete`')
+        except ValueError as exception:
+            results[index] = {'status': 'rejected', 'message': str(exception)}
+
+    try:
+        deleted = delete_rows(list(deletes), batch_size) if deletes else []
+        ids = insert_returning([record for _, record in creates], batch_size) if creates else []
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    for question_id, indexes in deletes.items():
+        for index in indexes:
+            results[index] = {'status': 'not_found', 'id': question_id}
+    for row in deleted:
+        for index in deletes[row.id]:
+            results[index] = {'status': 'deleted', 'id': row.id}
+    created = []
+    for (index, record), question_id in zip(creates, ids):
+        results[index] = {'status': 'created', 'id': question_id}
+        created.append(QuestionRow(id=question_id, **record))
+    # listeners are told once per action, however many questions changed
+    if deleted:
+        notify_questions_changed('delete', deleted)
+    if created:
+        notify_questions_changed('insert', created)
+    return results
+
+
+def iter_questions(batch_size=None):
+    '''yield all questions as (id, question, answer, category, difficulty) tuples, using a server side cursor'''
+    batch_size = batch_size or current_app.config['BULK_BATCH_SIZE']
+    columns = [getattr(Question, field) for field in FIELDS]
+    return db.session.query(*columns).order_by(Question.id).yield_per(batch_size)
+
+
+def format_ndjson(rows):
+    '''yield one json line per question'''
+    for row in rows:
+        yield json.dumps(dict(zip(FIELDS, row))) + '\n'
+
+
+def format_csv(rows):
+    '''yield a csv header, then one line per question'''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+FORMATTERS = {'ndjson': format_ndjson, 'csv': format_csv}
+
+
+def encode_chunks(lines, chunk_size=64 * 1024):
+    '''join text lines into byte chunks of about chunk_size, to avoid one write per line'''
+    chunk, size = [], 0
+    for line in lines:
+        data = line.encode('utf-8')
+        chunk.append(data)
+        size += len(data)
+        if size >= chunk_size:
+            yield b''.join(chunk)
+            chunk, size = [], 0
+    if chunk:
+        yield b''.join(chunk)
+
+
+def gzip_chunks(chunks, level=6):
+    '''compress a stream of byte chunks into a gzip stream'''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def guess_format(filename, default='ndjson'):
+    return 'csv' if filename and filename.endswith('.csv') else default
+
+
+# command line interface, E.G. `flask trivia import questions.ndjson`
+trivia_cli = click.Group('trivia', help='Manage trivia questions.')
+
+
+@trivia_cli.command('import')
+@click.argument('file', type=click.File('r'))
+@click.option('--format', 'format', type=click.Choice(PARSERS), help='file format, guessed from the file name')
+@click.option('--batch-size', type=int, help='questions per insert statement')
+@with_appcontext
+def import_command(file, format, batch_size):
+    '''import questions from an NDJSON or CSV file, `-` for stdin'''
+    format = format or guess_format(file.name)
+    inserted, rejected, errors = import_questions(file, format, batch_size)
+    for error in errors:
+        click.echo(f'line {error["line"]}: {error["message"]}', err=True)
+    click.echo(f'inserted {inserted} questions, rejected {rejected}')
+
+
+@trivia_cli.command('export')
+@click.argument('file', type=click.File('w'), default='-')
+@click.option('--format', 'format', type=click.Choice(FORMATTERS), help='file format, guessed from the file name')
+@click.option('--batch-size', type=int, help='questions fetched per round trip')
+@with_appcontext
+def export_command(file, format, batch_size):
+    '''export all questions to an NDJSON or CSV file, stdout by default'''
+    format = format or guess_format(file.name)
+    for line in FORMATTERS[format](iter_questions(batch_size)):
+        file.write(line)
+
+
+@trivia_cli.command('warmup')
+@with_appcontext
+def warmup_command():
+    '''load the caches and indexes, and report how long each one took'''
+    for name, seconds in warm_up().items():
+        click.echo(f'{name}: {seconds * 1000:.1f} ms')
+
+
+@trivia_cli.command('snapshot')
+@click.argument('path', required=False)
+@with_appcontext
+def snapshot_command(path):
+    '''write a snapshot of the questions and categories to PATH, SNAPSHOT_PATH by default'''
+    path = path or current_app.config.get('SNAPSHOT_PATH')
+    if not path:
+        raise click.UsageError('give a PATH, or set SNAPSHOT_PATH')
+    count = build_snapshot(path)
+    click.echo(f'wrote {count} questions to {path}')
@@ -0,0 +1,160 @@
+# cache.py
+# application level caches for data that rarely changes
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request
+from werkzeug.datastructures import Headers
+
+from .models import on_questions_changed
+from .readers import all_categories
+
+
+class CategoryCache:
+    '''
+    caches the {id: type} map of all categories.
+    every invalidation bumps `version`, so that anything built from the categories can tell it is out of date.
+    '''
+
+    def __init__(self):
+        self.ttl = 0
+        self.categories = None
+        self.etag = None
+        self.version = 0
+        self.loaded_at = 0
+
+    def init_app(self, app):
+        self.ttl = app.config.get('CATEGORY_CACHE_TTL', 0)
+        self.invalidate()
+
+    def invalidate(self):
+        '''drop the cached categories, they will be reloaded when needed'''
+        self.categories = None
+        self.version += 1
+
+    def questions_changed(self, action, questions):
+        # a reload may come with new categories, e.g. from a new snapshot
+        if action == 'reload':
+            self.invalidate()
+
+    def is_stale(self):
+        if self.categories is None:
+            return True
+        return bool(self.ttl) and time.monotonic() - self.loaded_at > self.ttl
+
+    def load(self):
+        categories = dict(all_categories())
+        # the etag only depends on the content, so every process serves the same one
+        content = json.dumps(sorted(categories.items())).encode()
+        self.etag = hashlib.sha1(content).hexdigest()
+        self.categories = categories
+        self.loaded_at = time.monotonic()
+
+    def all(self):
+        '''return the {id: type} map of all categories'''
+        if self.is_stale():
+            self.load()
+        return self.categories
+
+    def get(self, category_id):
+        '''return the type of a category, or None if it doesn't exist'''
+        try:
+            return self.all().get(int(category_id))
+        except (TypeError, ValueError):
+            return None
+
+    def get_etag(self):
+        '''return the etag for the current categories'''
+        self.all()
+        return self.etag
+
+
+class ResponseCache:
+    '''
+    caches the responses of GET routes, keyed by route, arguments, and data version.
+    entries are kept in least recently used order, up to RESPONSE_CACHE_SIZE entries for RESPONSE_CACHE_TTL seconds.
+    the data version is bumped whenever questions or categories change, so cached responses are never stale in this process.
+    '''
+
+    def __init__(self):
+        self.max_entries = 0
+        self.ttl = 0
+        # key -> (expiry time, body, status, headers, etag)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.data_version = 0
+
+    def init_app(self, app):
+        self.max_entries = app.config.get('RESPONSE_CACHE_SIZE', 0)
+        self.ttl = app.config.get('RESPONSE_CACHE_TTL', 0)
+        self.bump()
+
+    def bump(self):
+        '''mark all cached responses as out of date'''
+        with self.lock:
+            self.data_version += 1
+            self.entries.clear()
+
+    def questions_changed(self, action, questions):
+        self.bump()
+
+    def version(self):
+        return (self.data_version, category_cache.version)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def cached(self, view):
+        '''
+        decorator for GET routes: serve cached responses without calling the view,
+        and answer conditional requests with a 304 using strong etags.
+        there is no Last-Modified: this process only knows when it last saw a change, not when the data changed.
+        '''
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self.max_entries or request.method not in ('GET', 'HEAD'):
+                return view(*args, **kwargs)
+            key = (request.endpoint, tuple(sorted(kwargs.items())),
+                   tuple(sorted(request.args.items(multi=True))), self.version())
+            entry = self.get(key)
+            if entry is None:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    # only complete, successful responses are cached
+                    return response
+                body = response.get_data()
+                # keep the etag set by the view, otherwise hash the body
+                etag = response.get_etag()[0] or hashlib.sha1(body).hexdigest()
+                self.put(key, (time.monotonic() + self.ttl, body, response.status_code,
+                               Headers(response.headers), etag))
+            else:
+                _, body, status, headers, etag = entry
+                response = current_app.response_class(body, status, Headers(headers))
+            response.set_etag(etag)
+            return response.make_conditional(request)
+        return wrapper
+
+
+category_cache = CategoryCache()
+response_cache = ResponseCache()
+on_questions_changed(category_cache.questions_changed)
+on_questions_changed(response_cache.questions_changed)
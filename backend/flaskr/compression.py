@@ -0,0 +1,109 @@
+# compression.py
+# compresses responses with the best encoding the client accepts, memoizing bodies of cacheable GETs
+import gzip
+import threading
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # zstandard is optional too
+    zstandard = None
+
+# only text responses are worth compressing
+COMPRESSIBLE_MIMETYPES = ('application/json', 'application/x-ndjson', 'text/csv', 'text/plain', 'text/html')
+
+
+def gzip_compress(data, level):
+    # mtime=0 keeps the output the same for the same body
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def brotli_compress(data, level):
+    # brotli levels go from 0 to 11, scale the gzip style level
+    return brotli.compress(data, quality=min(round(level * 11 / 9), 11))
+
+
+def zstd_compress(data, level):
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+# encodings in order of preference, when the client accepts several of them with the same quality
+ENCODERS = OrderedDict()
+if zstandard is not None:
+    ENCODERS['zstd'] = zstd_compress
+if brotli is not None:
+    ENCODERS['br'] = brotli_compress
+ENCODERS['gzip'] = gzip_compress
+
+
+class ResponseCompressor:
+    '''
+    compresses responses of at least COMPRESS_MIN_SIZE bytes at COMPRESS_LEVEL.
+    compressed bodies of GET responses with an etag are memoized by (etag, encoding),
+    up to COMPRESS_CACHE_SIZE entries, so a cached page is only compressed once.
+    '''
+
+    def __init__(self):
+        self.min_size = 0
+        self.level = 6
+        self.max_entries = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.min_size = app.config.get('COMPRESS_MIN_SIZE', 500)
+        self.level = app.config.get('COMPRESS_LEVEL', 6)
+        self.max_entries = app.config.get('COMPRESS_CACHE_SIZE', 0)
+        self.entries.clear()
+        if app.config.get('COMPRESS_ENABLED', True):
+            app.after_request(self.compress_response)
+
+    def compress(self, data, encoding, etag=None):
+        '''return the compressed body, from the memo if the same etag was compressed before'''
+        if etag is None or not self.max_entries:
+            return ENCODERS[encoding](data, self.level)
+        key = (etag, encoding)
+        with self.lock:
+            body = self.entries.get(key)
+            if body is not None:
+                self.entries.move_to_end(key)
+                return body
+        body = ENCODERS[encoding](data, self.level)
+        with self.lock:
+            self.entries[key] = body
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return body
+
+    def compress_response(self, response):
+        if (response.mimetype not in COMPRESSIBLE_MIMETYPES or response.status_code != 200
+                or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers):
+            # streamed exports compress themselves, and 304s have no body
+            return response
+        # the body depends on Accept-Encoding, even when it is sent uncompressed
+        response.vary.add('Accept-Encoding')
+        encoding = request.accept_encodings.best_match(ENCODERS)
+        if encoding is None:
+            return response
+        data = response.get_data()
+        if len(data) < self.min_size:
+            # small bodies don't shrink enough to be worth it
+            return response
+        etag, weak = response.get_etag()
+        memoized = etag if request.method == 'GET' and etag and not weak else None
+        response.set_data(self.compress(data, encoding, memoized))
+        response.headers['Content-Encoding'] = encoding
+        if etag:
+            # the compressed body is a different representation, so the etag can only stay as a weak one
+            response.set_etag(etag, weak=True)
+        return response
+
+
+response_compressor = ResponseCompressor()
@@ -0,0 +1,163 @@
+# metrics.py
+# per route timings of requests, SQL statements and json serialization, exposed on /metrics
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, current_app, g, has_request_context, request
+from flask.json import JSONEncoder
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# upper bounds of the histogram buckets, in seconds
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# upper bounds of the SQL statement count buckets, more than 2 or 3 statements in a route hints at N+1 queries
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+# name, help text and buckets of every histogram, in /metrics order
+HISTOGRAMS = (
+    ('trivia_request_duration_seconds', 'Time spent handling a request.', TIME_BUCKETS),
+    ('trivia_request_sql_statements', 'SQL statements executed by a request.', STATEMENT_BUCKETS),
+    ('trivia_request_db_seconds', 'Time spent executing SQL statements in a request.', TIME_BUCKETS),
+    ('trivia_request_serialization_seconds', 'Time spent encoding json in a request.', TIME_BUCKETS),
+)
+
+
+class Histogram:
+    '''a prometheus style histogram, with cumulative buckets'''
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        # the last count is the +Inf bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        '''yield the text exposition lines of this histogram'''
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def add_serialization_time(seconds):
+    '''add time spent encoding json to the current request, E.G. from a faster encoder'''
+    if has_request_context() and 'metrics_start' in g:
+        g.metrics_serialization += seconds
+
+
+class TimedJSONEncoder(JSONEncoder):
+    '''the flask json encoder, adding the time spent encoding to the current request'''
+
+    def encode(self, o):
+        if not has_request_context() or 'metrics_start' not in g:
+            return super().encode(o)
+        start = time.perf_counter()
+        try:
+            return super().encode(o)
+        finally:
+            add_serialization_time(time.perf_counter() - start)
+
+
+class RequestMetrics:
+    '''
+    collects per route histograms of the request duration, the number of SQL statements,
+    the time spent in the database and the time spent encoding json.
+    the histograms are kept in memory, so every process reports its own requests.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', False)
+        self.histograms = {}
+        if not self.enabled:
+            return
+        app.json_encoder = TimedJSONEncoder
+        app.before_request(self.start_request)
+        app.after_request(self.end_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    def start_request(self):
+        # reset every counter, in case the app context is shared (E.G. in tests)
+        g.metrics_start = time.perf_counter()
+        g.metrics_statements = 0
+        g.metrics_db = 0
+        g.metrics_serialization = 0
+
+    def end_request(self, response):
+        if 'metrics_start' not in g or request.endpoint == 'metrics':
+            return response
+        # streamed responses are only timed until their first chunk is ready
+        duration = time.perf_counter() - g.metrics_start
+        # unknown urls are grouped together, so random paths can't add labels
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        self.observe(route, request.method, (duration, g.metrics_statements,
+                                             g.metrics_db, g.metrics_serialization))
+        if current_app.config.get('SERVER_TIMING'):
+            response.headers['Server-Timing'] = (
+                f'db;dur={g.metrics_db * 1000:.3f};desc="{g.metrics_statements} statements", '
+                f'serialize;dur={g.metrics_serialization * 1000:.3f}, '
+                f'total;dur={duration * 1000:.3f}')
+        g.pop('metrics_start')
+        return response
+
+    def observe(self, route, method, values):
+        with self.lock:
+            histograms = self.histograms.get((route, method))
+            if histograms is None:
+                histograms = [Histogram(buckets) for _, _, buckets in HISTOGRAMS]
+                self.histograms[(route, method)] = histograms
+            for histogram, value in zip(histograms, values):
+                histogram.observe(value)
+
+    def render(self):
+        '''return all histograms in the prometheus text format'''
+        lines = []
+        with self.lock:
+            for index, (name, help, _) in enumerate(HISTOGRAMS):
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} histogram')
+                for (route, method), histograms in sorted(self.histograms.items()):
+                    labels = f'route="{escape_label(route)}",method="{method}"'
+                    lines.extend(histograms[index].lines(name, labels))
+        return '\n'.join(lines) + '\n'
+
+    def metrics_view(self):
+        return Response(self.render(), mimetype='text/plain; version=0.0.4')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # the start time lives on the execution context, so a failing statement doesn't leave it behind
+    if context is not None:
+        context.metrics_query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'metrics_query_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    # statements outside of requests, E.G. from the command line, are not counted
+    if has_request_context() and 'metrics_start' in g:
+        g.metrics_statements += 1
+        g.metrics_db += elapsed
+
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,149 @@
+# migrations.py
+# a small schema migration runner, which replaces db.create_all() at startup
+import logging
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, Integer, text
+
+from . import db
+from .models import Question
+
+logger = logging.getLogger(__name__)
+
+# ordered list of (version, description, function) tuples
+MIGRATIONS = []
+
+
+def migration(version, description):
+    '''register a function(connection) as the migration to a schema version'''
+    def decorator(function):
+        MIGRATIONS.append((version, description, function))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return function
+    return decorator
+
+
+def ensure_version_table(connection):
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations '
+        '(version INTEGER PRIMARY KEY, description VARCHAR)'))
+
+
+def applied_versions(connection):
+    '''return the set of migration versions applied to the database'''
+    ensure_version_table(connection)
+    return {row[0] for row in connection.execute(text('SELECT version FROM schema_migrations'))}
+
+
+def upgrade(engine=None):
+    '''
+    apply all pending migrations, each one in its own transaction.
+    returns the list of applied (version, description) tuples.
+    '''
+    engine = engine or db.engine
+    applied = []
+    for version, description, function in MIGRATIONS:
+        with engine.begin() as connection:
+            if connection.dialect.name == 'postgresql':
+                # only one process migrates at a time, others wait and then skip applied migrations
+                connection.execute(text('SELECT pg_advisory_xact_lock(7346298)'))
+            if version in applied_versions(connection):
+                continue
+            function(connection)
+            connection.execute(text(
+                'INSERT INTO schema_migrations (version, description) VALUES (:version, :description)'),
+                version=version, description=description)
+            applied.append((version, description))
+    return applied
+
+
+@migration(1, 'create tables')
+def create_tables(connection):
+    # creates missing tables only, so databases restored from trivia.psql are kept
+    db.metadata.create_all(bind=connection)
+
+
+@migration(2, 'integer category foreign key and category indexes')
+def category_foreign_key(connection):
+    inspector = inspect(connection)
+    column = next(column for column in inspector.get_columns('questions')
+                  if column['name'] == 'category')
+    has_foreign_key = any(key['referred_table'] == 'categories'
+                          for key in inspector.get_foreign_keys('questions'))
+    if connection.dialect.name == 'sqlite':
+        if not isinstance(column['type'], Integer) or not has_foreign_key:
+            # SQLite can't alter columns, copy the rows into a new table instead
+            rebuild_questions_table(connection)
+            clear_removed_categories(connection)
+    else:
+        if not isinstance(column['type'], Integer):
+            connection.execute(text(
+                "ALTER TABLE questions ALTER COLUMN category TYPE INTEGER "
+                "USING NULLIF(trim(category), '')::integer"))
+        if not has_foreign_key:
+            # questions of removed categories would break the new constraint
+            clear_removed_categories(connection)
+            connection.execute(text(
+                'ALTER TABLE questions ADD CONSTRAINT fk_questions_category '
+                'FOREIGN KEY (category) REFERENCES categories (id) '
+                'ON UPDATE CASCADE ON DELETE SET NULL'))
+    existing = {index['name'] for index in inspect(connection).get_indexes('questions')}
+    for index in Question.__table__.indexes:
+        if index.name not in existing:
+            index.create(bind=connection)
+
+
+def rebuild_questions_table(connection):
+    '''recreate the questions table from the model, keeping its rows'''
+    connection.execute(text('ALTER TABLE questions RENAME TO questions_old'))
+    # index names are global in SQLite, drop the old ones before creating the new table
+    for index in inspect(connection).get_indexes('questions_old'):
+        connection.execute(text(f'DROP INDEX IF EXISTS {index["name"]}'))
+    Question.__table__.create(bind=connection)
+    connection.execute(text(
+        'INSERT INTO questions (id, question, answer, category, difficulty) '
+        'SELECT id, question, answer, CAST(NULLIF(category, \'\') AS INTEGER), difficulty '
+        'FROM questions_old'))
+    connection.execute(text('DROP TABLE questions_old'))
+
+
+def clear_removed_categories(connection):
+    '''set the category of questions to NULL when it doesn't exist, like the foreign key does on deletes'''
+    result = connection.execute(text(
+        'UPDATE questions SET category = NULL '
+        'WHERE category NOT IN (SELECT id FROM categories)'))
+    if result.rowcount:
+        logger.warning('%d questions had a removed category, their category is now empty', result.rowcount)
+
+
+@migration(3, 'text search indexes')
+def text_search_indexes(connection):
+    from .search import create_search_indexes
+    create_search_indexes(connection)
+
+
+# command line interface, E.G. `flask db upgrade`
+db_cli = click.Group('db', help='Manage the database schema.')
+
+
+@db_cli.command('upgrade')
+@with_appcontext
+def upgrade_command():
+    '''apply all pending migrations'''
+    applied = upgrade()
+    for version, description in applied:
+        click.echo(f'applied {version}: {description}')
+    if not applied:
+        click.echo('the database is up to date')
+
+
+@db_cli.command('status')
+@with_appcontext
+def status_command():
+    '''list migrations and whether they are applied'''
+    with db.engine.begin() as connection:
+        applied = applied_versions(connection)
+    for version, description, _ in MIGRATIONS:
+        state = 'applied' if version in applied else 'pending'
+        click.echo(f'{version}: {description} ({state})')
@@ -1,5 +1,36 @@
+import logging
+
 from . import db
 
+logger = logging.getLogger(__name__)
+
+# listeners called after questions are inserted or deleted, see `on_questions_changed`
+_question_listeners = []
+
+
+def on_questions_changed(listener):
+    '''
+    register a function that is called as listener(action, questions) after questions change.
+    action is 'insert' or 'delete' with the affected questions,
+    or 'reload' with no questions when the changed rows are unknown (E.G. bulk writes).
+    '''
+    _question_listeners.append(listener)
+    return listener
+
+
+def notify_questions_changed(action, questions=()):
+    '''
+    tell all registered listeners that questions were changed.
+    the change is already committed, so a failing listener is logged and reloads instead of failing the request.
+    '''
+    for listener in _question_listeners:
+        try:
+            listener(action, questions)
+        except Exception:
+            logger.exception('a question listener failed on %s, reloading it', action)
+            listener('reload', ())
+
+
 '''
 Question
 
@@ -8,11 +39,17 @@ Question
 
 class Question(db.Model):
     __tablename__ = 'questions'
+    __table_args__ = (
+        # used by category listings, ordered by id, and by quiz selection by difficulty
+        db.Index('ix_questions_category_id', 'category', 'id'),
+        db.Index('ix_questions_category_difficulty', 'category', 'difficulty'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     question = db.Column(db.String)
     answer = db.Column(db.String)
-    category = db.Column(db.String)
+    category = db.Column(db.Integer, db.ForeignKey(
+        'categories.id', onupdate='CASCADE', ondelete='SET NULL'))
     difficulty = db.Column(db.Integer)
 
     def __init__(self, question, answer, category, difficulty):
@@ -24,6 +61,7 @@ class Question(db.Model):
     def insert(self):
         db.session.add(self)
         db.session.commit()
+        notify_questions_changed('insert', [self])
 
     def update(self):
         db.session.commit()
@@ -31,6 +69,7 @@ class Question(db.Model):
     def delete(self):
         db.session.delete(self)
         db.session.commit()
+        notify_questions_changed('delete', [self])
 
     def format(self):
         return {
@@ -0,0 +1,161 @@
+# profiling.py
+# opt-in profiling of live api requests, written as collapsed stacks or cProfile files
+import cProfile
+import hashlib
+import hmac
+import itertools
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from functools import wraps
+
+from flask import current_app, request
+
+# requests carrying a valid signature in this header are always profiled
+PROFILE_HEADER = 'X-Profile-Request'
+# seconds a signed header stays valid
+SIGNATURE_MAX_AGE = 300
+
+
+def sign_profile_request(secret, timestamp=None):
+    '''return a header value asking to profile a request, E.G. `1700000000.3f2a...`'''
+    timestamp = str(int(time.time() if timestamp is None else timestamp))
+    signature = hmac.new(secret.encode(), timestamp.encode(), hashlib.sha256).hexdigest()
+    return f'{timestamp}.{signature}'
+
+
+def verify_profile_request(secret, value):
+    '''return True if the header value was signed with the secret, recently'''
+    if not secret or not value or '.' not in value:
+        return False
+    timestamp, signature = value.split('.', 1)
+    try:
+        if abs(time.time() - int(timestamp)) > SIGNATURE_MAX_AGE:
+            return False
+    except ValueError:
+        return False
+    expected = sign_profile_request(secret, timestamp).split('.', 1)[1]
+    return hmac.compare_digest(expected, signature)
+
+
+def frame_label(frame):
+    code = frame.f_code
+    # semicolons separate frames in the collapsed format
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'.replace(';', ':')
+
+
+class StackSampler:
+    '''
+    samples the stack of one thread from a background thread, every `interval` seconds.
+    the samples are counted as collapsed stacks, the input format of flamegraph.pl and speedscope.
+    '''
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                stack.append(frame_label(frame))
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        return self.stacks
+
+
+class RequestProfiler:
+    '''
+    profiles every PROFILE_SAMPLE_RATE-th api request, and requests with a signed PROFILE_HEADER.
+    the api views are only wrapped when PROFILE_ENABLED is set, so there is no overhead otherwise.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.counter = itertools.count(1)
+        # numbers the profile files, so profiles of the same second don't overwrite each other
+        self.sequence = itertools.count(1)
+        # only one cProfile profiler can be active at a time in recent Python versions
+        self.cprofile_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('PROFILE_ENABLED', False)
+        if not self.enabled:
+            return
+        self.counter = itertools.count(1)
+        os.makedirs(self.directory(app), exist_ok=True)
+        for endpoint, view in list(app.view_functions.items()):
+            if endpoint.startswith('api1.'):
+                app.view_functions[endpoint] = self.wrap(view)
+
+    @staticmethod
+    def directory(app):
+        return app.config.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'trivia-profiles')
+
+    def should_profile(self):
+        config = current_app.config
+        if verify_profile_request(config.get('PROFILE_SECRET'), request.headers.get(PROFILE_HEADER)):
+            return True
+        rate = config.get('PROFILE_SAMPLE_RATE', 0)
+        return bool(rate) and next(self.counter) % rate == 0
+
+    def wrap(self, view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self.should_profile():
+                return view(*args, **kwargs)
+            if current_app.config.get('PROFILE_MODE') == 'cprofile':
+                return self.run_cprofile(view, args, kwargs)
+            return self.run_sampled(view, args, kwargs)
+        return wrapper
+
+    def output_path(self, extension):
+        name = f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{next(self.sequence)}-{request.endpoint}.{extension}'
+        return os.path.join(self.directory(current_app), name)
+
+    def run_cprofile(self, view, args, kwargs):
+        if not self.cprofile_lock.acquire(blocking=False):
+            # another request is being profiled, don't make this one wait
+            return view(*args, **kwargs)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            profile.disable()
+            self.cprofile_lock.release()
+            path = self.output_path('prof')
+            profile.dump_stats(path)
+            current_app.logger.info('profiled %s to %s', request.path, path)
+
+    def run_sampled(self, view, args, kwargs):
+        sampler = StackSampler(threading.get_ident(), current_app.config.get('PROFILE_INTERVAL', 0.001))
+        sampler.start()
+        try:
+            return view(*args, **kwargs)
+        finally:
+            stacks = sampler.stop()
+            path = self.output_path('folded')
+            with open(path, 'w') as file:
+                for stack, count in stacks.most_common():
+                    file.write(f'{stack} {count}\n')
+            current_app.logger.info('profiled %s to %s', request.path, path)
+
+
+request_profiler = RequestProfiler()
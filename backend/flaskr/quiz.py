@@ -0,0 +1,454 @@
+# quiz.py
+# in-process pools of question ids, for picking random quiz questions without sorting the table
+import base64
+import bisect
+import random
+import secrets
+import time
+from array import array
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+
+from .readers import on_read_questions_changed, question_keys, questions_by_ids
+from .refresh import BackgroundReload
+
+# how many random picks to try before falling back to scanning for unplayed questions
+RANDOM_PROBES = 8
+DIFFICULTIES = (1, 2, 3, 4, 5)
+# adaptive quizzes: weight of a difficulty by its distance from the player's target difficulty
+DISTANCE_WEIGHTS = (8, 4, 1, 0.25, 0.1)
+
+
+class AliasTable:
+    '''
+    samples an index with probability proportional to its weight in O(1), using Vose's alias method.
+    weights should not all be 0.
+    '''
+
+    def __init__(self, weights):
+        count = len(weights)
+        total = sum(weights)
+        scaled = [weight * count / total for weight in weights]
+        self.probabilities = [0.0] * count
+        self.aliases = [0] * count
+        small = [index for index, weight in enumerate(scaled) if weight < 1]
+        large = [index for index, weight in enumerate(scaled) if weight >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probabilities[less] = scaled[less]
+            self.aliases[less] = more
+            scaled[more] -= 1 - scaled[less]
+            (small if scaled[more] < 1 else large).append(more)
+        for index in small + large:
+            # what is left is 1, up to rounding errors
+            self.probabilities[index] = 1.0
+
+    def sample(self):
+        index = random.randrange(len(self.probabilities))
+        return index if random.random() < self.probabilities[index] else self.aliases[index]
+
+
+def target_difficulty(recent_answers):
+    '''
+    return the difficulty a player should get next, from their recent answers (True for correct ones).
+    no answers start in the middle, all wrong is the easiest, all right is the hardest.
+    '''
+    if not recent_answers:
+        return DIFFICULTIES[len(DIFFICULTIES) // 2]
+    accuracy = sum(1 for answer in recent_answers if answer) / len(recent_answers)
+    return DIFFICULTIES[round(accuracy * (len(DIFFICULTIES) - 1))]
+
+
+class QuestionPool:
+    '''
+    keeps the ids of all questions, and of every category, in compact arrays sorted by id.
+    picking an unplayed question is O(1) expected while less than half of the pool is played,
+    and only the picked question is loaded from the database.
+    ids are also indexed by (category, difficulty), for adaptive quizzes.
+    '''
+
+    def __init__(self):
+        self.ttl = 0
+        # category id -> array of question ids, category 0 holds all questions
+        self.pools = None
+        # (category id, difficulty) -> array of question ids
+        self.levels = None
+        # (category id, target difficulty) -> AliasTable over the difficulties with questions
+        self.alias_tables = {}
+        # the greatest question id in the pools
+        self.highest_id = 0
+        self.built_at = 0
+        self.reload = BackgroundReload('quiz pool')
+
+    def init_app(self, app):
+        self.ttl = app.config.get('QUIZ_POOL_TTL', 0)
+        self.reload.init_app(app)
+        self.invalidate()
+
+    def invalidate(self):
+        '''drop the pools, they will be reloaded on the next pick'''
+        self.pools = None
+        self.levels = None
+
+    def is_stale(self):
+        if self.pools is None:
+            return True
+        return bool(self.ttl) and time.monotonic() - self.built_at > self.ttl
+
+    def build(self):
+        '''load the id, category and difficulty of every question, in this thread'''
+        loaded = self.load_pools()
+        with self.reload.lock:
+            self.swap(loaded, [])
+
+    def ensure_loaded(self):
+        '''
+        load the pools if there are none. when they are older than QUIZ_POOL_TTL, they are reloaded in the background,
+        and quizzes keep using the current ones until the new ones are ready.
+        '''
+        self.reload.ensure(lambda: self.pools is None, self.is_stale, self.load_pools, self.swap)
+
+    def load_pools(self):
+        '''return the (pools, levels) of every question'''
+        pools, levels = {0: array('l')}, {}
+        # question_keys is ordered by id, so appending keeps every array sorted
+        for question_id, category, difficulty in question_keys():
+            pools[0].append(question_id)
+            levels.setdefault((0, difficulty), array('l')).append(question_id)
+            if category is not None:
+                pools.setdefault(category, array('l')).append(question_id)
+                levels.setdefault((category, difficulty), array('l')).append(question_id)
+        return pools, levels
+
+    def swap(self, loaded, changes):
+        '''use loaded pools, with the changes made while they were loading'''
+        self.pools, self.levels = loaded
+        self.highest_id = self.pools[0][-1] if self.pools[0] else 0
+        for action, questions in changes:
+            self.apply(action, questions)
+        self.alias_tables = {}
+        self.built_at = time.monotonic()
+
+    @staticmethod
+    def _add(pools, levels, question_id, category, difficulty):
+        keys = [(pools, 0), (levels, (0, difficulty))]
+        if category is not None:
+            keys += [(pools, int(category)), (levels, (int(category), difficulty))]
+        for arrays, key in keys:
+            ids = arrays.setdefault(key, array('l'))
+            position = bisect.bisect_left(ids, question_id)
+            if position == len(ids) or ids[position] != question_id:
+                ids.insert(position, question_id)
+
+    @staticmethod
+    def _remove(arrays, question_id):
+        '''remove an id with a binary search in every array, instead of scanning them'''
+        for ids in arrays.values():
+            position = bisect.bisect_left(ids, question_id)
+            if position < len(ids) and ids[position] == question_id:
+                del ids[position]
+
+    def questions_changed(self, action, questions):
+        '''keep the pools in sync with inserted and deleted questions'''
+        if action not in ('insert', 'delete'):
+            self.reload.cancel()
+            self.invalidate()
+            return
+        with self.reload.lock:
+            if self.pools is None:
+                return
+            # a reload running in the background replays the change on its new pools
+            self.reload.record(action, questions)
+            self.apply(action, questions)
+
+    def apply(self, action, questions):
+        '''add inserted questions to the pools, or remove deleted ones. applying a change twice changes nothing'''
+        if action == 'insert':
+            for question in questions:
+                self._add(self.pools, self.levels, question.id, question.category, question.difficulty)
+                self.highest_id = max(self.highest_id, question.id)
+        else:
+            for question in questions:
+                self._remove(self.pools, question.id)
+                self._remove(self.levels, question.id)
+        # the difficulties with questions may have changed
+        self.alias_tables = {}
+
+    def discard(self, question_id):
+        '''drop a question that was deleted by another process'''
+        with self.reload.lock:
+            if self.pools is not None:
+                self.reload.record('delete', [SimpleNamespace(id=question_id)])
+                self.apply('delete', [SimpleNamespace(id=question_id)])
+
+    def ids(self, category_id):
+        '''return the array of question ids for a category, 0 for all categories'''
+        self.ensure_loaded()
+        return self.pools.get(category_id, array('l'))
+
+    def max_id(self):
+        '''return the greatest question id in the pools, played ids above it can't be in any pool'''
+        self.ensure_loaded()
+        return self.highest_id
+
+    def pick(self, category_id, played):
+        '''
+        return a random question id from the category which is not in `played`,
+        or None if every question was played.
+        '''
+        return self._pick_from(self.ids(category_id), played)
+
+    def alias_table(self, category_id, target):
+        '''return the AliasTable of difficulties for a target, or None if the category has no questions'''
+        key = (category_id, target)
+        if key not in self.alias_tables:
+            weights = [DISTANCE_WEIGHTS[abs(difficulty - target)]
+                       if self.levels.get((category_id, difficulty)) else 0
+                       for difficulty in DIFFICULTIES]
+            self.alias_tables[key] = AliasTable(weights) if any(weights) else None
+        return self.alias_tables[key]
+
+    def pick_adaptive(self, category_id, played, recent_answers):
+        '''
+        return an unplayed question id from the category, with a difficulty close to the target
+        of the player's recent answers, or None if every question was played.
+        '''
+        self.ensure_loaded()
+        target = target_difficulty(recent_answers)
+        table = self.alias_table(category_id, target)
+        if table is None:
+            return None
+        difficulty = DIFFICULTIES[table.sample()]
+        question_id = self._pick_from(self.levels.get((category_id, difficulty)), played)
+        if question_id is not None:
+            return question_id
+        # every question of the sampled difficulty was played, try the closest ones
+        for difficulty in sorted(DIFFICULTIES, key=lambda level: (abs(level - target), level)):
+            question_id = self._pick_from(self.levels.get((category_id, difficulty)), played)
+            if question_id is not None:
+                return question_id
+        return None
+
+    def sample(self, category_id, played, count):
+        '''
+        return up to `count` distinct question ids from the category which are not in `played`,
+        in random order. fewer are returned when fewer are left.
+        '''
+        ids = self.ids(category_id)
+        if not ids:
+            return []
+        picked, seen = [], set()
+        # random probes are fast while most of the pool is unplayed
+        for _ in range(RANDOM_PROBES * count):
+            question_id = ids[random.randrange(len(ids))]
+            if question_id not in played and question_id not in seen:
+                seen.add(question_id)
+                picked.append(question_id)
+                if len(picked) == count:
+                    return picked
+        # most of the pool was played, sample from what is left
+        remaining = [question_id for question_id in ids
+                     if question_id not in played and question_id not in seen]
+        return picked + random.sample(remaining, min(count - len(picked), len(remaining)))
+
+    @staticmethod
+    def _pick_from(ids, played):
+        if not ids:
+            return None
+        for _ in range(RANDOM_PROBES):
+            question_id = ids[random.randrange(len(ids))]
+            if question_id not in played:
+                return question_id
+        # most of the pool was played, pick from what is left
+        remaining = [question_id for question_id in ids if question_id not in played]
+        return random.choice(remaining) if remaining else None
+
+    def pick_question(self, category_id, played, recent_answers=None):
+        '''
+        pick an unplayed question and load its row.
+        questions are picked at random, or adaptively when the player's recent answers are given.
+        returns None if every question was played.
+        '''
+        def pick():
+            if recent_answers is None:
+                return self.pick(category_id, played)
+            return self.pick_adaptive(category_id, played, recent_answers)
+        question_id = pick()
+        if question_id is None:
+            return None
+        rows = questions_by_ids([question_id])
+        if not rows:
+            # the question was deleted by another process, drop it from the pools and try again
+            self.discard(question_id)
+            question_id = pick()
+            rows = questions_by_ids([question_id]) if question_id else []
+        return rows[0] if rows else None
+
+
+class PlayedSet:
+    '''a compact set of played question ids, stored as a bitset'''
+
+    def __init__(self, bits=b''):
+        self.bits = bytearray(bits)
+
+    def __contains__(self, question_id):
+        byte = question_id >> 3
+        return byte < len(self.bits) and bool(self.bits[byte] & (1 << (question_id & 7)))
+
+    def add(self, question_id):
+        byte = question_id >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(byte - len(self.bits) + 1))
+        self.bits[byte] |= 1 << (question_id & 7)
+
+
+class QuizSession:
+    '''the state of a quiz game: its category, and the questions played so far'''
+
+    def __init__(self, category_id, played=None):
+        self.category_id = category_id
+        self.played = played or PlayedSet()
+
+    def to_bytes(self):
+        return b'%d:' % self.category_id + bytes(self.played.bits)
+
+    @classmethod
+    def from_bytes(cls, data):
+        category_id, bits = data.split(b':', 1)
+        return cls(int(category_id), PlayedSet(bits))
+
+
+def deck_serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='quiz-deck')
+
+
+def encode_deck_token(session):
+    '''sign a quiz session into a continuation token, so the client can carry it between decks'''
+    return deck_serializer().dumps(base64.urlsafe_b64encode(session.to_bytes()).decode())
+
+
+def decode_deck_token(token):
+    '''return the quiz session of a continuation token, or None if it is envalid or was tampered with'''
+    try:
+        return QuizSession.from_bytes(base64.urlsafe_b64decode(deck_serializer().loads(token)))
+    except (BadSignature, TypeError, ValueError):
+        return None
+
+
+def deal_deck(session, size):
+    '''
+    sample up to `size` unplayed questions for a quiz session, load them in one query,
+    and mark them as played. returns the question rows, in random order.
+    '''
+    rows = questions_by_ids(question_pool.sample(session.category_id, session.played, size))
+    for row in rows:
+        session.played.add(row.id)
+    return rows
+
+
+class MemorySessionStore:
+    '''
+    keeps quiz sessions in this process.
+    sessions are kept in least recently used order, so expired sessions are evicted from the front.
+    '''
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        # token -> (expiry time, session)
+        self.sessions = OrderedDict()
+
+    def _evict(self):
+        now = time.monotonic()
+        while self.sessions:
+            token, (expires, _) = next(iter(self.sessions.items()))
+            if expires > now:
+                break
+            del self.sessions[token]
+
+    def load(self, token):
+        self._evict()
+        entry = self.sessions.get(token)
+        return entry and entry[1]
+
+    def save(self, token, session):
+        self._evict()
+        self.sessions[token] = (time.monotonic() + self.ttl, session)
+        self.sessions.move_to_end(token)
+
+    def delete(self, token):
+        return self.sessions.pop(token, None) is not None
+
+
+class RedisSessionStore:
+    '''
+    keeps quiz sessions in a Redis compatible server, so that they are shared between processes.
+    requires the `redis` package.
+    '''
+
+    key_prefix = 'trivia:quiz:'
+
+    def __init__(self, url, ttl):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def load(self, token):
+        data = self.client.get(self.key_prefix + token)
+        return data and QuizSession.from_bytes(data)
+
+    def save(self, token, session):
+        self.client.set(self.key_prefix + token, session.to_bytes(), ex=self.ttl)
+
+    def delete(self, token):
+        return bool(self.client.delete(self.key_prefix + token))
+
+
+class QuizSessions:
+    '''
+    server side quiz sessions, so that clients don't resend the played questions every round.
+    the store is selected by the QUIZ_SESSION_STORE config: `memory`, or a `redis://` url.
+    '''
+
+    def __init__(self):
+        self.store = None
+
+    def init_app(self, app):
+        store = app.config.get('QUIZ_SESSION_STORE', 'memory')
+        ttl = app.config.get('QUIZ_SESSION_TTL', 3600)
+        if store == 'memory':
+            self.store = MemorySessionStore(ttl)
+        elif store.startswith(('redis://', 'rediss://', 'unix://')):
+            self.store = RedisSessionStore(store, ttl)
+        else:
+            raise ValueError(f'unknown QUIZ_SESSION_STORE `{store}`')
+
+    def create(self, category_id):
+        '''start a new session, and return its token'''
+        token = secrets.token_urlsafe(16)
+        self.store.save(token, QuizSession(category_id))
+        return token
+
+    def load(self, token):
+        '''return the session for a token, or None if it is unknown or expired'''
+        return self.store.load(token)
+
+    def next_question(self, token, session):
+        '''pick an unplayed question for the session, and mark it as played'''
+        question = question_pool.pick_question(session.category_id, session.played)
+        if question is not None:
+            session.played.add(question.id)
+        # saving also refreshes the session expiry
+        self.store.save(token, session)
+        return question
+
+    def end(self, token):
+        '''remove a session, return False if it didn't exist'''
+        return self.store.delete(token)
+
+
+question_pool = QuestionPool()
+on_read_questions_changed(question_pool.questions_changed)
+quiz_sessions = QuizSessions()
@@ -0,0 +1,128 @@
+# readers.py
+# read only queries over questions and categories, as Core statements returning plain rows
+# when SERVE_FROM_SNAPSHOT is set, they read from the memory-mapped snapshot instead of the database
+from functools import wraps
+
+from sqlalchemy import bindparam, func, select
+
+from . import db
+from .models import Question, Category, on_questions_changed
+from .serializers import QUESTION_FIELDS
+from .snapshot import question_snapshot
+
+questions = Question.__table__
+categories = Category.__table__
+# the question columns, in the order their json keys are sorted, so rows go straight to `format_rows`
+QUESTION_COLUMNS = [questions.c[field] for field in QUESTION_FIELDS]
+
+# compiled statements, shared by all requests. every statement below is built once,
+# with bound parameters, so it is only compiled once per database dialect.
+COMPILED_CACHE = {}
+
+
+def page_of(statement):
+    '''add an ORDER BY id, with the `limit` and `offset` parameters'''
+    return statement.order_by(questions.c.id).limit(bindparam('limit')).offset(bindparam('offset'))
+
+
+def after_id_of(statement):
+    '''seek past the `after_id` parameter, ordered by id, with the `limit` parameter'''
+    return statement.where(questions.c.id > bindparam('after_id')).order_by(
+        questions.c.id).limit(bindparam('limit'))
+
+
+ALL_QUESTIONS = select(QUESTION_COLUMNS)
+CATEGORY_QUESTIONS = ALL_QUESTIONS.where(questions.c.category == bindparam('category'))
+QUESTION_PAGE = page_of(ALL_QUESTIONS)
+CATEGORY_QUESTION_PAGE = page_of(CATEGORY_QUESTIONS)
+QUESTIONS_AFTER = after_id_of(ALL_QUESTIONS)
+CATEGORY_QUESTIONS_AFTER = after_id_of(CATEGORY_QUESTIONS)
+QUESTIONS_BY_IDS = ALL_QUESTIONS.where(questions.c.id.in_(bindparam('ids', expanding=True)))
+ALL_CATEGORIES = select([categories.c.id, categories.c.type]).order_by(categories.c.id)
+QUESTION_COUNTS = select([questions.c.category, questions.c.difficulty, func.count(questions.c.id)]).group_by(
+    questions.c.category, questions.c.difficulty)
+QUESTION_KEYS = select([questions.c.id, questions.c.category, questions.c.difficulty]).order_by(questions.c.id)
+QUESTION_TEXTS = select([questions.c.id, questions.c.question, questions.c.answer])
+
+
+def execute(statement, **params):
+    '''run a statement on the session's connection, which follows the replica routing'''
+    connection = db.session.connection(clause=statement)
+    return connection.execution_options(compiled_cache=COMPILED_CACHE).execute(statement, params)
+
+
+def question_page(offset, limit, category_id=None):
+    '''return the question rows of a page, ordered by id'''
+    snapshot = question_snapshot.current()
+    if snapshot is not None:
+        return snapshot.page(offset, limit, category_id)
+    if category_id is None:
+        return execute(QUESTION_PAGE, offset=offset, limit=limit).fetchall()
+    return execute(CATEGORY_QUESTION_PAGE, category=category_id, offset=offset, limit=limit).fetchall()
+
+
+def questions_after(after_id, limit, category_id=None):
+    '''return up to `limit` question rows with an id greater than after_id, ordered by id'''
+    snapshot = question_snapshot.current()
+    if snapshot is not None:
+        return snapshot.after(after_id, limit, category_id)
+    if category_id is None:
+        return execute(QUESTIONS_AFTER, after_id=after_id, limit=limit).fetchall()
+    return execute(CATEGORY_QUESTIONS_AFTER, category=category_id, after_id=after_id, limit=limit).fetchall()
+
+
+def questions_by_ids(ids):
+    '''return the question rows with the given ids, in the same order, skipping missing ones'''
+    if not ids:
+        return []
+    snapshot = question_snapshot.current()
+    if snapshot is not None:
+        return snapshot.by_ids(ids)
+    rows = {row.id: row for row in execute(QUESTIONS_BY_IDS, ids=list(ids))}
+    return [rows[question_id] for question_id in ids if question_id in rows]
+
+
+def all_categories():
+    '''return the (id, type) rows of all categories, ordered by id'''
+    snapshot = question_snapshot.current()
+    if snapshot is not None:
+        return snapshot.all_categories()
+    return execute(ALL_CATEGORIES).fetchall()
+
+
+def question_counts():
+    '''return the (category, difficulty, number of questions) rows'''
+    snapshot = question_snapshot.current()
+    if snapshot is not None:
+        return [(category, difficulty, count) for (category, difficulty), count in snapshot.counts().items()]
+    return execute(QUESTION_COUNTS).fetchall()
+
+
+def question_keys():
+    '''return the (id, category, difficulty) rows of all questions, ordered by id'''
+    snapshot = question_snapshot.current()
+    if snapshot is not None:
+        return snapshot.keys()
+    return execute(QUESTION_KEYS).fetchall()
+
+
+def question_texts():
+    '''return the (id, question, answer) rows of all questions'''
+    snapshot = question_snapshot.current()
+    if snapshot is not None:
+        return snapshot.texts()
+    return execute(QUESTION_TEXTS).fetchall()
+
+
+def on_read_questions_changed(listener):
+    '''
+    register a question listener for data loaded through this module.
+    while reads come from a snapshot, inserts and deletes in the database don't change what is read, so they are
+    skipped instead of being counted twice once the next snapshot is mapped, which reloads every listener.
+    '''
+    @wraps(listener)
+    def wrapper(action, questions):
+        if action != 'reload' and question_snapshot.serving():
+            return
+        listener(action, questions)
+    return on_questions_changed(wrapper)
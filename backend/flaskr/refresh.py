@@ -0,0 +1,82 @@
+# refresh.py
+# reloads in-memory indexes in a background thread, so no request waits for a periodic reload
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundReload:
+    '''
+    loads an in-memory structure once, then reloads it in a daemon thread when it gets old,
+    while the current one keeps serving requests. only one thread loads at a time.
+    question changes seen while a reload runs are recorded, and replayed on the new structure when it is swapped in,
+    so they must be idempotent.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.app = None
+        # held while the structure is swapped or changed
+        self.lock = threading.Lock()
+        # held while a request loads the first structure, so other requests wait instead of loading it again
+        self.load_lock = threading.Lock()
+        # (action, questions) changes seen since the running reload started, None when no reload runs
+        self.changes = None
+        self.generation = 0
+        self.thread = None
+
+    def init_app(self, app):
+        self.app = app
+        self.cancel()
+
+    def ensure(self, missing, stale, load, swap):
+        '''
+        call load() and then swap(result, changes) when missing() is true, in this thread.
+        when only stale() is true, do the same in the background, and return at once.
+        '''
+        if missing():
+            with self.load_lock:
+                if missing():
+                    result = load()
+                    with self.lock:
+                        swap(result, [])
+        elif stale():
+            self.start(load, swap)
+
+    def start(self, load, swap):
+        '''start a background reload, unless one is already running'''
+        with self.lock:
+            if self.changes is not None or self.app is None:
+                return
+            self.changes = []
+            generation = self.generation
+        self.thread = threading.Thread(target=self._run, args=(load, swap, generation),
+                                       name=f'{self.name} reload', daemon=True)
+        self.thread.start()
+
+    def _run(self, load, swap, generation):
+        try:
+            with self.app.app_context():
+                result = load()
+            with self.lock:
+                # a reload action dropped the structure meanwhile, it is loaded again on the next request
+                if generation == self.generation:
+                    swap(result, self.changes)
+        except Exception:
+            logger.exception('reloading the %s failed, the current one is kept', self.name)
+        finally:
+            with self.lock:
+                if generation == self.generation:
+                    self.changes = None
+
+    def record(self, action, questions):
+        '''remember a change for the running reload, with the lock held'''
+        if self.changes is not None:
+            self.changes.append((action, list(questions)))
+
+    def cancel(self):
+        '''forget the running reload, with the lock not held'''
+        with self.lock:
+            self.generation += 1
+            self.changes = None
@@ -0,0 +1,83 @@
+# routing.py
+# sends the queries of read only routes to replica databases, and everything else to the primary
+import random
+from functools import wraps
+
+from flask import current_app, g, has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+
+# a client that wrote recently reads from the primary while this cookie lives
+PRIMARY_COOKIE = 'trivia_read_primary'
+WRITE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+
+def replica_binds(app):
+    '''return the bind keys of the configured replicas'''
+    return [key for key in app.config.get('SQLALCHEMY_BINDS') or {}
+            if key.startswith('replica')]
+
+
+def read_only(view):
+    '''decorator for routes that never write, so their queries can go to a replica'''
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        return view(*args, **kwargs)
+    wrapper.read_only = True
+    return wrapper
+
+
+def replica_for_request(app):
+    '''
+    return the replica bind key to use for the current request, or None to use the primary.
+    the replica is chosen once per request, so all its reads see the same database.
+    '''
+    if not has_request_context() or not g.get('read_only'):
+        return None
+    if 'replica_bind' not in g:
+        binds = replica_binds(app)
+        if not binds or PRIMARY_COOKIE in request.cookies:
+            # no replicas, or the client just wrote and the replicas may lag behind
+            g.replica_bind = None
+        else:
+            g.replica_bind = random.choice(binds)
+    return g.replica_bind
+
+
+class RoutingSession(SignallingSession):
+    '''a session that reads from a replica in read only routes'''
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing:
+            bind = replica_for_request(self.app)
+            if bind is not None:
+                state = get_state(self.app)
+                return state.db.get_engine(self.app, bind=bind)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    '''SQLAlchemy extension using the routing session'''
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def reset_routing():
+    '''forget the routing of the previous request, in case the app context is shared (E.G. in tests)'''
+    g.pop('read_only', None)
+    g.pop('replica_bind', None)
+
+
+def mark_writes(response):
+    '''
+    after a successful write, let the client read from the primary for REPLICA_LAG_WINDOW seconds,
+    so it sees its own writes even if the replicas lag behind.
+    '''
+    view = current_app.view_functions.get(request.endpoint)
+    if (request.method in WRITE_METHODS and response.status_code < 400
+            and replica_binds(current_app) and not getattr(view, 'read_only', False)):
+        response.set_cookie(PRIMARY_COOKIE, '1', httponly=True,
+                            max_age=current_app.config['REPLICA_LAG_WINDOW'])
+    return response
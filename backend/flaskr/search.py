@@ -0,0 +1,404 @@
+# search.py
+# full-text search for questions, using PostgreSQL text search or an in-memory inverted index
+import bisect
+import heapq
+import re
+import time
+from collections import defaultdict
+
+from flask import abort
+from sqlalchemy import DDL, bindparam, event, func, literal_column, select
+from sqlalchemy.engine.url import make_url
+
+from .models import Question
+from .readers import ALL_QUESTIONS, execute, on_read_questions_changed, page_of, question_texts, questions, questions_by_ids
+from .refresh import BackgroundReload
+
+# words are matched case insensitively, by prefix
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+# the best suggestions of prefixes up to this long are precomputed, they match most questions and are asked the most
+SHORT_PREFIX_LENGTH = 2
+# the text search configuration used by both the query and the GIN indexes
+TS_CONFIG = "'english'::regconfig"
+# expression indexes are always in sync with the questions table, no extra column is needed
+SEARCH_INDEXES = (
+    DDL("CREATE INDEX IF NOT EXISTS ix_questions_search ON questions USING gin "
+        f"(to_tsvector({TS_CONFIG}, coalesce(question, '')))"),
+    DDL("CREATE INDEX IF NOT EXISTS ix_questions_search_answers ON questions USING gin "
+        f"(to_tsvector({TS_CONFIG}, coalesce(question, '') || ' ' || coalesce(answer, '')))"),
+)
+for index in SEARCH_INDEXES:
+    # create the indexes with the table, on PostgreSQL only
+    event.listen(Question.__table__, 'after_create',
+                 index.execute_if(dialect='postgresql'))
+
+
+def _like_condition(search_answers):
+    condition = questions.c.question.ilike(bindparam('pattern'))
+    if search_answers:
+        condition = condition | questions.c.answer.ilike(bindparam('pattern'))
+    return condition
+
+
+def _text_match(search_answers):
+    '''return (match condition, rank) expressions, which must match the GIN indexes above'''
+    text = func.coalesce(questions.c.question, '')
+    if search_answers:
+        text = text + ' ' + func.coalesce(questions.c.answer, '')
+    vector = func.to_tsvector(literal_column(TS_CONFIG), text)
+    query = func.to_tsquery(literal_column(TS_CONFIG), bindparam('query'))
+    return vector.op('@@')(query), func.ts_rank(vector, query)
+
+
+def _text_search(search_answers):
+    condition, rank = _text_match(search_answers)
+    page = ALL_QUESTIONS.where(condition).order_by(rank.desc(), questions.c.id).limit(
+        bindparam('limit')).offset(bindparam('offset'))
+    return page, select([func.count()]).where(condition)
+
+
+# (page, count) statements by search_answers, built once with bound parameters
+LIKE_SEARCH = {search_answers: (page_of(ALL_QUESTIONS.where(_like_condition(search_answers))),
+                                select([func.count()]).where(_like_condition(search_answers)))
+               for search_answers in (False, True)}
+TEXT_SEARCH = {search_answers: _text_search(search_answers) for search_answers in (False, True)}
+
+
+def paginate_statement(statements, page, per_page, **params):
+    '''
+    run a (page, count) pair of statements like `paginate` does, aborting with a 404 error for envalid pages.
+    returns a tuple of (current page rows, total rows).
+    '''
+    if page < 1:
+        abort(404)
+    page_statement, count_statement = statements
+    items = execute(page_statement, offset=(page - 1) * per_page, limit=per_page, **params).fetchall()
+    if not items and page != 1:
+        abort(404)
+    if page == 1 and len(items) < per_page:
+        # the first page holds every result, no need to count them
+        return items, len(items)
+    return items, execute(count_statement, **params).scalar()
+
+
+def tokenize(text):
+    '''split a text into lower case words'''
+    return TOKEN_RE.findall((text or '').lower())
+
+
+def snippet(text, word, length):
+    '''cut a text to `length` characters around the first occurrence of word'''
+    if len(text) <= length:
+        return text
+    start = max(0, min(text.lower().find(word) - length // 4, len(text) - length))
+    end = start + length
+    return ('...' if start else '') + text[start:end].strip() + ('...' if end < len(text) else '')
+
+
+def create_search_indexes(bind):
+    '''create the text search indexes on an existing PostgreSQL database, using an engine or a connection'''
+    if bind.dialect.name == 'postgresql':
+        for index in SEARCH_INDEXES:
+            bind.execute(index)
+
+
+class InvertedIndex:
+    '''
+    a pure python inverted index, mapping words to the ids of the documents that contain them.
+    distinct words are kept sorted, so that prefixes can be found with a binary search.
+    '''
+
+    def __init__(self):
+        # word -> {document id: number of times the word appears}
+        self.postings = defaultdict(dict)
+        # sorted list of all distinct words
+        self.words = []
+        # document id -> the words of the document, needed to remove it again
+        self.documents = {}
+
+    def __len__(self):
+        return len(self.documents)
+
+    @classmethod
+    def build(cls, documents):
+        '''build an index from (document id, text) pairs, sorting the distinct words once at the end'''
+        index = cls()
+        for doc_id, text in documents:
+            words = tokenize(text)
+            index.documents[doc_id] = words
+            for word in words:
+                posting = index.postings[word]
+                posting[doc_id] = posting.get(doc_id, 0) + 1
+        index.words = sorted(index.postings)
+        return index
+
+    def add(self, doc_id, text):
+        '''add or replace a document'''
+        if doc_id in self.documents:
+            self.remove(doc_id)
+        words = tokenize(text)
+        self.documents[doc_id] = words
+        for word in words:
+            posting = self.postings[word]
+            if not posting:
+                # a new word, keep the word list sorted
+                bisect.insort(self.words, word)
+            posting[doc_id] = posting.get(doc_id, 0) + 1
+
+    def remove(self, doc_id):
+        '''remove a document, ignoring unknown ids'''
+        for word in set(self.documents.pop(doc_id, ())):
+            posting = self.postings[word]
+            posting.pop(doc_id, None)
+            if not posting:
+                del self.postings[word]
+                del self.words[bisect.bisect_left(self.words, word)]
+
+    def words_with_prefix(self, prefix):
+        '''return all distinct words starting with prefix'''
+        start = bisect.bisect_left(self.words, prefix)
+        end = bisect.bisect_left(self.words, prefix + '\U0010ffff')
+        return self.words[start:end]
+
+    def match(self, word):
+        '''
+        return {document id: score} for all documents containing a word that starts with `word`.
+        exact matches count double, so that they rank above prefix matches.
+        '''
+        scores = {}
+        for candidate in self.words_with_prefix(word):
+            weight = 2 if candidate == word else 1
+            for doc_id, count in self.postings[candidate].items():
+                scores[doc_id] = scores.get(doc_id, 0) + weight * count
+        return scores
+
+
+class QuestionSearch:
+    '''
+    searches questions with the backend selected by the SEARCH_BACKEND config:
+    - `postgresql`: ranked text search, backed by GIN expression indexes.
+    - `memory`: an in-memory inverted index, for SQLite and testing.
+    - `like`: the old ILIKE scan.
+    - `auto`: `postgresql` on PostgreSQL databases, `memory` otherwise, or when serving from a snapshot.
+    '''
+
+    def __init__(self):
+        self.backend = 'memory'
+        self.ttl = 0
+        self.questions = None
+        self.answers = None
+        # question id -> question text, for suggestion snippets
+        self.texts = None
+        # short prefix -> sorted list of the best (-score, question id) pairs, None to recompute it
+        self.prefix_tops = {}
+        # how many suggestions are kept per short prefix, and the upper bound of the `limit` of suggestions
+        self.top_k = 20
+        self.built_at = 0
+        self.reload = BackgroundReload('search index')
+
+    def init_app(self, app):
+        backend = app.config.get('SEARCH_BACKEND', 'auto')
+        if backend == 'auto':
+            uri = app.config.get('SQLALCHEMY_DATABASE_URI')
+            is_postgres = uri and make_url(uri).get_backend_name() == 'postgresql'
+            # a snapshot has no text search indexes, the in-memory index is built from it instead
+            serving_snapshot = app.config.get('SERVE_FROM_SNAPSHOT', False)
+            backend = 'postgresql' if is_postgres and not serving_snapshot else 'memory'
+        if backend not in ('postgresql', 'memory', 'like'):
+            raise ValueError(f'unknown SEARCH_BACKEND `{backend}`')
+        self.backend = backend
+        self.ttl = app.config.get('SEARCH_INDEX_TTL', 0)
+        self.top_k = app.config.get('SUGGEST_MAX_LIMIT', 20)
+        self.reload.init_app(app)
+        self.invalidate()
+
+    # in-memory index maintenance
+
+    def invalidate(self):
+        '''drop the in-memory index, it will be rebuilt by the next search'''
+        self.questions = None
+        self.answers = None
+        self.texts = None
+        self.prefix_tops = {}
+
+    def is_stale(self):
+        if self.questions is None:
+            return True
+        return bool(self.ttl) and time.monotonic() - self.built_at > self.ttl
+
+    def build(self):
+        '''load all questions into the in-memory index, in this thread'''
+        index = self.load_index()
+        with self.reload.lock:
+            self.swap(index, [])
+
+    def ensure_built(self):
+        '''
+        build the index if there is none. when it is older than SEARCH_INDEX_TTL, it is rebuilt in the background,
+        and searches keep using the current one until the new one is ready.
+        '''
+        self.reload.ensure(lambda: self.questions is None, self.is_stale, self.load_index, self.swap)
+
+    def load_index(self, rows=None):
+        '''return (questions index, answers index, texts, prefix tops) of the (id, question, answer) rows of all questions'''
+        if rows is None:
+            rows = question_texts()
+        questions = InvertedIndex.build((question_id, question) for question_id, question, _ in rows)
+        answers = InvertedIndex.build((question_id, answer) for question_id, _, answer in rows)
+        texts = {question_id: question for question_id, question, _ in rows}
+        # every short prefix of the words is ranked now, instead of scanning its postings on every keystroke
+        prefix_tops = {prefix: self.rank_prefix(questions, prefix) for prefix in
+                       {word[:length] for word in questions.words for length in range(1, SHORT_PREFIX_LENGTH + 1)}}
+        return questions, answers, texts, prefix_tops
+
+    def swap(self, index, changes):
+        '''use a loaded index, with the changes made while it was loading'''
+        self.questions, self.answers, self.texts, self.prefix_tops = index
+        for action, questions in changes:
+            self.apply(action, questions)
+        self.built_at = time.monotonic()
+
+    def rank_prefix(self, index, prefix):
+        scores = index.match(prefix)
+        return heapq.nsmallest(self.top_k, ((-score, doc_id) for doc_id, score in scores.items()))
+
+    def prefix_top(self, prefix):
+        '''return the best (-score, question id) pairs of a short prefix, ranking it if needed'''
+        top = self.prefix_tops.get(prefix)
+        if top is None:
+            top = self.rank_prefix(self.questions, prefix)
+            self.prefix_tops[prefix] = top
+        return top
+
+    def add_to_prefix_tops(self, doc_id, text):
+        '''rank a new question in the tops of the short prefixes of its words'''
+        scores = {}
+        for word in tokenize(text):
+            for length in range(1, min(len(word), SHORT_PREFIX_LENGTH) + 1):
+                prefix = word[:length]
+                # scored like `InvertedIndex.match`, exact matches count double
+                scores[prefix] = scores.get(prefix, 0) + (2 if word == prefix else 1)
+        for prefix, score in scores.items():
+            if prefix not in self.prefix_tops:
+                self.prefix_tops[prefix] = []
+            top = self.prefix_tops[prefix]
+            if top is None:
+                # ranked again on the next read, with this question
+                continue
+            entry = (-score, doc_id)
+            if len(top) < self.top_k or entry < top[-1]:
+                bisect.insort(top, entry)
+                del top[self.top_k:]
+
+    def remove_from_prefix_tops(self, doc_id):
+        '''drop the tops a deleted question was in, the next best question is only known after ranking them again'''
+        for word in set(self.questions.documents.get(doc_id, ())):
+            for length in range(1, min(len(word), SHORT_PREFIX_LENGTH) + 1):
+                top = self.prefix_tops.get(word[:length])
+                if top and any(entry[1] == doc_id for entry in top):
+                    self.prefix_tops[word[:length]] = None
+
+    def questions_changed(self, action, questions):
+        '''keep the in-memory index in sync with inserted and deleted questions'''
+        if action not in ('insert', 'delete'):
+            self.reload.cancel()
+            self.invalidate()
+            return
+        with self.reload.lock:
+            if self.questions is None:
+                # the index is not built yet, nothing to update
+                return
+            # a rebuild running in the background replays the change on its new index
+            self.reload.record(action, questions)
+            self.apply(action, questions)
+
+    def apply(self, action, questions):
+        '''add inserted questions to the index, or remove deleted ones. applying a change twice changes nothing'''
+        if action == 'insert':
+            for question in questions:
+                if question.id in self.questions.documents:
+                    # replayed after a rebuild which already loaded it
+                    self.remove_from_prefix_tops(question.id)
+                self.questions.add(question.id, question.question)
+                self.answers.add(question.id, question.answer)
+                self.texts[question.id] = question.question
+                self.add_to_prefix_tops(question.id, question.question)
+        elif action == 'delete':
+            for question in questions:
+                self.remove_from_prefix_tops(question.id)
+                self.questions.remove(question.id)
+                self.answers.remove(question.id)
+                self.texts.pop(question.id, None)
+
+    def scores(self, words, search_answers=False):
+        '''return {question id: score} for the questions matching all words'''
+        self.ensure_built()
+        totals = None
+        for word in words:
+            scores = self.questions.match(word)
+            if search_answers:
+                for doc_id, score in self.answers.match(word).items():
+                    scores[doc_id] = scores.get(doc_id, 0) + score
+            if totals is None:
+                totals = scores
+            else:
+                # every word must match, keep only documents found so far
+                totals = {doc_id: totals[doc_id] + score
+                          for doc_id, score in scores.items() if doc_id in totals}
+            if not totals:
+                return {}
+        return totals
+
+    def ranked_ids(self, words, search_answers=False):
+        '''return question ids matching all words, best matches first'''
+        totals = self.scores(words, search_answers)
+        return sorted(totals, key=lambda doc_id: (-totals[doc_id], doc_id))
+
+    def suggest(self, prefix, limit, snippet_length=80):
+        '''
+        return up to `limit` (question id, question, snippet) tuples for questions with words starting with
+        every word of prefix, best matches first. only the in-memory index is used, whatever the search backend.
+        '''
+        words = tokenize(prefix)
+        if not words:
+            return []
+        self.ensure_built()
+        limit = min(limit, self.top_k)
+        if len(words) == 1 and len(words[0]) <= SHORT_PREFIX_LENGTH:
+            # short prefixes match most questions, their best ones are already ranked
+            ids = [doc_id for _, doc_id in self.prefix_top(words[0])[:limit]]
+        else:
+            totals = self.scores(words)
+            # only the best `limit` matches are ordered
+            ids = heapq.nsmallest(limit, totals, key=lambda doc_id: (-totals[doc_id], doc_id))
+        return [(question_id, self.texts[question_id], snippet(self.texts[question_id], words[0], snippet_length))
+                for question_id in ids]
+
+    # searching
+
+    def search(self, term, page, per_page, search_answers=False):
+        '''
+        search questions for a term.
+        returns a tuple of (current page questions, total results),
+        aborting with a 404 error if the page is out of range like `paginate` does.
+        '''
+        if self.backend == 'like':
+            return paginate_statement(LIKE_SEARCH[search_answers], page, per_page,
+                                      pattern=f'%{term}%')
+        words = tokenize(term)
+        if not words:
+            return [], 0
+        if self.backend == 'postgresql':
+            return paginate_statement(TEXT_SEARCH[search_answers], page, per_page,
+                                      query=' & '.join(f'{word}:*' for word in words))
+        ids = self.ranked_ids(words, search_answers)
+        start = (page - 1) * per_page
+        if page < 1 or (ids and start >= len(ids)):
+            abort(404)
+        page_ids = ids[start:start + per_page]
+        # load the page, in rank order
+        return questions_by_ids(page_ids), len(ids)
+
+
+question_search = QuestionSearch()
+on_read_questions_changed(question_search.questions_changed)
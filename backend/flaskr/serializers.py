@@ -0,0 +1,96 @@
+# serializers.py
+# fast json responses for question listings, byte for byte the same as `jsonify`
+import re
+import time
+from collections import namedtuple
+
+from flask import current_app, jsonify
+
+from .metrics import add_serialization_time
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library encoder is used without it
+    orjson = None
+
+# the fields of a question, in the order `jsonify` sorts them
+QUESTION_FIELDS = ('answer', 'category', 'difficulty', 'id', 'question')
+# what the standard library escapes with `ensure_ascii`, besides quotes, backslashes and control characters
+NON_ASCII_RE = re.compile(r'[^\x00-\x7e]')
+# a question row built outside of a query, e.g. from a snapshot, with the same fields as the rows of readers.py
+QuestionRow = namedtuple('QuestionRow', QUESTION_FIELDS)
+
+
+class Rows(list):
+    '''a list of question dicts whose keys are already in sorted order'''
+
+
+def format_rows(rows):
+    '''turn question rows from readers.py into dicts, like `Question.format` does'''
+    return Rows(dict(zip(QUESTION_FIELDS, row)) for row in rows)
+
+
+def _ordered(value):
+    '''sort dict keys the way the standard library does, before encoding without OPT_SORT_KEYS'''
+    if type(value) is Rows:
+        return value
+    if isinstance(value, dict):
+        # keys are sorted by their value, so integer keys stay in numeric order
+        return {(key if isinstance(key, str) else _key(key)): _ordered(item)
+                for key, item in sorted(value.items())}
+    if isinstance(value, list):
+        return [_ordered(item) for item in value]
+    return value
+
+
+def _key(key):
+    if type(key) is not int:
+        # let the standard library handle floats, booleans and None keys
+        raise TypeError(key)
+    return str(key)
+
+
+def _escape(match):
+    '''escape a character like the standard library does, as a surrogate pair outside of the basic plane'''
+    code = ord(match.group())
+    if code < 0x10000:
+        return '\\u%04x' % code
+    code -= 0x10000
+    return '\\u%04x\\u%04x' % (0xd800 | (code >> 10), 0xdc00 | (code & 0x3ff))
+
+
+def escape_non_ascii(body):
+    '''turn the utf-8 output of orjson into the ascii output of `jsonify`'''
+    if body.isascii() and b'\x7f' not in body:
+        return body
+    # non ascii characters can only be inside json strings, so they can be escaped anywhere in the body
+    return NON_ASCII_RE.sub(_escape, body.decode('utf-8')).encode('ascii')
+
+
+def fast_path_enabled():
+    config = current_app.config
+    backend = config.get('JSON_BACKEND', 'auto')
+    if orjson is None or backend == 'stdlib':
+        return False
+    # pretty printing, unsorted keys and non ascii output are left to `jsonify`
+    return (config['JSON_SORT_KEYS'] and config['JSON_AS_ASCII']
+            and not (config['JSONIFY_PRETTYPRINT_REGULAR'] or current_app.debug))
+
+
+def json_response(payload):
+    '''
+    return a json response for a dict, the same bytes `jsonify` would return.
+    orjson encodes it when installed, otherwise, or for values orjson can't encode, `jsonify` does.
+    '''
+    if fast_path_enabled():
+        start = time.perf_counter()
+        try:
+            # the standard library escapes everything from DEL up, orjson writes utf-8
+            body = escape_non_ascii(orjson.dumps(_ordered(payload)))
+        except TypeError:
+            # E.G. lone surrogates, or types only the flask encoder knows
+            body = None
+        add_serialization_time(time.perf_counter() - start)
+        if body is not None:
+            return current_app.response_class(body + b'\n', mimetype=current_app.config['JSONIFY_MIMETYPE'])
+    return jsonify(payload)
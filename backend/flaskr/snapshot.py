@@ -0,0 +1,273 @@
+# snapshot.py
+# a read only, memory-mapped binary snapshot of the questions and categories, for serving without the database
+import bisect
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from collections import Counter
+
+from sqlalchemy import select
+
+from . import db
+from .models import Question, Category, notify_questions_changed
+from .serializers import QuestionRow
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'TRIVIASN'
+VERSION = 2
+# the sections of a snapshot, in file order. all of them are arrays of 8 byte integers, except the strings:
+# - ids: question ids, sorted
+# - categories, difficulties: of every question, -1 for questions without a category or a difficulty
+# - string_offsets: where each string starts in `strings`, the question and answer of every question,
+#   then the type of every category, and the end of the last string
+# - category_ids: category ids, sorted
+# - category_offsets: where the questions of each category start in `category_positions`, and where the last ends
+# - category_positions: the positions of the questions of every category, sorted by question id
+# - strings: utf-8 text
+SECTIONS = ('ids', 'categories', 'difficulties', 'string_offsets',
+            'category_ids', 'category_offsets', 'category_positions', 'strings')
+TYPECODES = {'ids': 'q', 'categories': 'q', 'difficulties': 'q', 'string_offsets': 'Q',
+             'category_ids': 'q', 'category_offsets': 'Q', 'category_positions': 'Q'}
+# magic, version, number of questions, number of categories, then the offset of every section
+HEADER = struct.Struct('<8sIII' + 'Q' * len(SECTIONS))
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _nullable(value):
+    '''turn the -1 written for a missing category or difficulty back into None'''
+    return None if value < 0 else value
+
+
+def build_snapshot(path):
+    '''
+    write a snapshot of the database to `path`, then return the number of questions in it.
+    the snapshot is written to a temporary file next to `path` and renamed over it,
+    so readers either see the old snapshot or the new one.
+    '''
+    ids, categories, difficulties = array('q'), array('q'), array('q')
+    string_offsets = array('Q', [0])
+    positions_by_category = {}
+    directory = os.path.dirname(os.path.abspath(path))
+    # strings are streamed to a temporary file, only the integer arrays are kept in memory
+    with tempfile.TemporaryFile(dir=directory) as strings:
+        size = 0
+
+        def add_string(text):
+            nonlocal size
+            data = (text or '').encode('utf-8')
+            strings.write(data)
+            size += len(data)
+            string_offsets.append(size)
+
+        table = Question.__table__
+        rows = db.session.execute(select([table.c.id, table.c.category, table.c.difficulty,
+                                          table.c.question, table.c.answer]).order_by(table.c.id)
+                                  .execution_options(stream_results=True))
+        for position, (question_id, category, difficulty, question, answer) in enumerate(rows):
+            ids.append(question_id)
+            categories.append(-1 if category is None else category)
+            difficulties.append(-1 if difficulty is None else difficulty)
+            add_string(question)
+            add_string(answer)
+            if category is not None:
+                positions_by_category.setdefault(category, array('Q')).append(position)
+        category_ids = array('q')
+        for category_id, category_type in db.session.execute(
+                select([Category.__table__.c.id, Category.__table__.c.type]).order_by(Category.__table__.c.id)):
+            category_ids.append(category_id)
+            add_string(category_type)
+        category_offsets, category_positions = array('Q', [0]), array('Q')
+        for category_id in category_ids:
+            category_positions.extend(positions_by_category.get(category_id, ()))
+            category_offsets.append(len(category_positions))
+
+        sections = {'ids': ids, 'categories': categories, 'difficulties': difficulties,
+                    'string_offsets': string_offsets, 'category_ids': category_ids,
+                    'category_offsets': category_offsets, 'category_positions': category_positions}
+        offsets, offset = [], _align(HEADER.size)
+        for name in SECTIONS:
+            offsets.append(offset)
+            length = size if name == 'strings' else len(sections[name]) * 8
+            offset = _align(offset + length)
+
+        file = tempfile.NamedTemporaryFile(dir=directory, prefix='.snapshot-', delete=False)
+        try:
+            with file:
+                file.write(HEADER.pack(MAGIC, VERSION, len(ids), len(category_ids), *offsets))
+                for name, offset in zip(SECTIONS, offsets):
+                    file.write(bytes(offset - file.tell()))
+                    if name == 'strings':
+                        strings.seek(0)
+                        while True:
+                            chunk = strings.read(1024 * 1024)
+                            if not chunk:
+                                break
+                            file.write(chunk)
+                    else:
+                        sections[name].tofile(file)
+                file.flush()
+                os.fsync(file.fileno())
+            # workers see the new snapshot once the rename is done, never a partial one
+            os.replace(file.name, path)
+        except BaseException:
+            os.unlink(file.name)
+            raise
+    return len(ids)
+
+
+class Snapshot:
+    '''
+    reads a snapshot file through a read only memory map.
+    the pages are shared by every process mapping the same file, and nothing is copied until a row is read.
+    '''
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self.mmap)
+        magic, version, question_count, category_count, *offsets = HEADER.unpack_from(view)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a version {VERSION} question snapshot')
+        self.question_count = question_count
+        offsets = dict(zip(SECTIONS, offsets))
+
+        def section(name, length):
+            start = offsets[name]
+            return view[start:start + length * 8].cast(TYPECODES[name])
+        self.ids = section('ids', question_count)
+        self.categories = section('categories', question_count)
+        self.difficulties = section('difficulties', question_count)
+        self.string_offsets = section('string_offsets', 2 * question_count + category_count + 1)
+        self.category_ids = section('category_ids', category_count)
+        self.category_offsets = section('category_offsets', category_count + 1)
+        self.category_positions = section('category_positions', self.category_offsets[-1])
+        self.strings = view[offsets['strings']:]
+        # category id -> index in the category arrays
+        self.category_index = {category_id: index for index, category_id in enumerate(self.category_ids)}
+
+    def string(self, index):
+        return str(self.strings[self.string_offsets[index]:self.string_offsets[index + 1]], 'utf-8')
+
+    def row(self, position):
+        return QuestionRow(self.string(2 * position + 1), _nullable(self.categories[position]),
+                           _nullable(self.difficulties[position]), self.ids[position], self.string(2 * position))
+
+    def positions(self, category_id=None):
+        '''return the positions of the questions of a category, or of all questions, sorted by id'''
+        if category_id is None:
+            return range(self.question_count)
+        index = self.category_index.get(category_id)
+        if index is None:
+            return range(0)
+        return self.category_positions[self.category_offsets[index]:self.category_offsets[index + 1]]
+
+    # the queries of readers.py
+
+    def page(self, offset, limit, category_id=None):
+        return [self.row(position) for position in self.positions(category_id)[offset:offset + limit]]
+
+    def after(self, after_id, limit, category_id=None):
+        positions = self.positions(category_id)
+        # binary search for the first question with a greater id
+        low, high = 0, len(positions)
+        while low < high:
+            middle = (low + high) // 2
+            if self.ids[positions[middle]] <= after_id:
+                low = middle + 1
+            else:
+                high = middle
+        return [self.row(position) for position in positions[low:low + limit]]
+
+    def by_ids(self, ids):
+        rows = []
+        for question_id in ids:
+            position = bisect.bisect_left(self.ids, question_id)
+            if position < self.question_count and self.ids[position] == question_id:
+                rows.append(self.row(position))
+        return rows
+
+    def all_categories(self):
+        first = 2 * self.question_count
+        return [(category_id, self.string(first + index)) for index, category_id in enumerate(self.category_ids)]
+
+    def keys(self):
+        return [(self.ids[position], _nullable(self.categories[position]), _nullable(self.difficulties[position]))
+                for position in range(self.question_count)]
+
+    def texts(self):
+        return [(self.ids[position], self.string(2 * position), self.string(2 * position + 1))
+                for position in range(self.question_count)]
+
+    def counts(self):
+        return Counter((_nullable(category), _nullable(difficulty))
+                       for category, difficulty in zip(self.categories, self.difficulties))
+
+
+class SnapshotStore:
+    '''
+    serves the snapshot at SNAPSHOT_PATH when SERVE_FROM_SNAPSHOT is set.
+    every SNAPSHOT_CHECK_INTERVAL seconds, the file is checked for a new inode, size or mtime,
+    and a new snapshot is mapped, replacing the old one for the next reads.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.interval = 0
+        self.snapshot = None
+        self.stamp = None
+        self.checked_at = 0
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get('SERVE_FROM_SNAPSHOT', False)
+        self.path = app.config.get('SNAPSHOT_PATH')
+        self.interval = app.config.get('SNAPSHOT_CHECK_INTERVAL', 5)
+        self.snapshot, self.stamp, self.checked_at = None, None, 0
+        if self.enabled and not self.path:
+            raise ValueError('SERVE_FROM_SNAPSHOT needs a SNAPSHOT_PATH')
+
+    def serving(self):
+        '''return True while reads come from a snapshot, without checking for a new one'''
+        return self.enabled and self.snapshot is not None
+
+    def current(self):
+        '''return the current snapshot, or None to read from the database'''
+        if not self.enabled:
+            return None
+        if time.monotonic() - self.checked_at >= self.interval and self.lock.acquire(blocking=False):
+            # one thread checks for a new file, the others keep reading the current snapshot
+            try:
+                self.checked_at = time.monotonic()
+                self.refresh()
+            finally:
+                self.lock.release()
+        return self.snapshot
+
+    def refresh(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            if self.snapshot is None:
+                logger.warning('no snapshot at %s yet, reading from the database', self.path)
+            return
+        stamp = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if stamp == self.stamp:
+            return
+        # the old map is released once the requests still reading it are done
+        self.snapshot, self.stamp = Snapshot(self.path), stamp
+        logger.info('serving %d questions from %s', self.snapshot.question_count, self.path)
+        # caches, counters, the quiz pool and the search index reload from the new snapshot
+        notify_questions_changed('reload')
+
+
+question_snapshot = SnapshotStore()
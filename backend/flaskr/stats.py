@@ -0,0 +1,92 @@
+# stats.py
+# question counters, kept up to date incrementally so listings don't need COUNT(*)
+import threading
+import time
+from collections import Counter
+
+from .readers import on_read_questions_changed, question_counts
+
+# the key of the questions without a difficulty in `category_stats`
+UNKNOWN_DIFFICULTY = 'unknown'
+
+
+class QuestionStats:
+    '''
+    counts questions per (category, difficulty).
+    the counts are loaded with one GROUP BY query, then updated on every insert and delete,
+    and reloaded every QUESTION_COUNT_TTL seconds to pick up writes from other processes.
+    '''
+
+    def __init__(self):
+        self.ttl = 0
+        self.counts = None
+        self.loaded_at = 0
+        self.lock = threading.Lock()
+
+    def init_app(self, app):
+        self.ttl = app.config.get('QUESTION_COUNT_TTL', 0)
+        self.invalidate()
+
+    def invalidate(self):
+        '''drop the counts, they will be reloaded when needed'''
+        self.counts = None
+
+    def is_stale(self):
+        if self.counts is None:
+            return True
+        return bool(self.ttl) and time.monotonic() - self.loaded_at > self.ttl
+
+    def load(self):
+        rows = question_counts()
+        self.counts = Counter({(category, difficulty): count
+                               for category, difficulty, count in rows})
+        self.loaded_at = time.monotonic()
+
+    def get_counts(self):
+        '''return a Counter of {(category, difficulty): number of questions}'''
+        if self.is_stale():
+            self.load()
+        return self.counts
+
+    def questions_changed(self, action, questions):
+        '''update the counts with inserted and deleted questions'''
+        if self.counts is None:
+            return
+        if action not in ('insert', 'delete'):
+            self.invalidate()
+            return
+        step = 1 if action == 'insert' else -1
+        with self.lock:
+            for question in questions:
+                category = int(question.category) if question.category is not None else None
+                # keyed on the raw difficulty like `load`, questions without one are counted under None
+                self.counts[(category, question.difficulty)] += step
+
+    def total(self):
+        '''return the number of all questions'''
+        return sum(self.get_counts().values())
+
+    def category_total(self, category_id):
+        '''return the number of questions in a category'''
+        return sum(count for (category, _), count in self.get_counts().items()
+                   if category == category_id)
+
+    def category_stats(self, category_ids):
+        '''
+        return {category id: (number of questions, {difficulty: number of questions})} for the given categories,
+        every difficulty from 1 to 5 is included, even without questions.
+        difficulties are strings, like json keys, and questions without one are counted under 'unknown'.
+        '''
+        stats = {category_id: (0, dict.fromkeys(map(str, range(1, 6)), 0)) for category_id in category_ids}
+        for (category, difficulty), count in self.get_counts().items():
+            if category in stats and count:
+                total, difficulties = stats[category]
+                # mixing None with numbers would break sorting the json keys
+                key = UNKNOWN_DIFFICULTY if difficulty is None else str(difficulty)
+                difficulties[key] = difficulties.get(key, 0) + count
+                stats[category] = (total + count, difficulties)
+        return stats
+
+
+question_stats = QuestionStats()
+on_read_questions_changed(question_stats.questions_changed)
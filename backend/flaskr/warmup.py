@@ -0,0 +1,46 @@
+# warmup.py
+# preloads the caches and indexes, so that the first requests after a start don't pay for them
+import time
+
+from sqlalchemy import text
+
+from . import db
+from .cache import category_cache
+from .quiz import question_pool
+from .search import question_search
+from .snapshot import question_snapshot
+from .stats import question_stats
+
+
+def open_connection():
+    '''connect to the database, so a bad database url fails the start, or map the snapshot when serving from one'''
+    if question_snapshot.current() is None:
+        db.session.execute(text('SELECT 1'))
+
+
+def build_search_index():
+    # suggestions use the in-memory index with every search backend
+    question_search.build()
+
+
+# (name, loader) of everything warmed up, in order
+WARM_UP_STEPS = (
+    ('connection', open_connection),
+    ('categories', category_cache.load),
+    ('question counters', question_stats.load),
+    ('quiz pool', question_pool.build),
+    ('search index', build_search_index),
+)
+
+
+def warm_up():
+    '''
+    run every warm up step, in the app context.
+    returns a dict of {step name: seconds taken}.
+    '''
+    timings = {}
+    for name, load in WARM_UP_STEPS:
+        start = time.perf_counter()
+        load()
+        timings[name] = time.perf_counter() - start
+    return timings
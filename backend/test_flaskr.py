@@ -1,11 +1,33 @@
 # tests for the API
 import json
+from flask import g, jsonify
 from flaskr import create_app, db
-from flaskr.models import Question, Category
+from flaskr.models import Question, Category, notify_questions_changed
+from flaskr.migrations import upgrade
+from flaskr import serializers
+from flaskr.serializers import format_rows, json_response
+from flaskr.quiz import AliasTable, question_pool, target_difficulty
+from flaskr.readers import question_page, questions_by_ids
+from flaskr.metrics import request_metrics
+from flaskr.profiling import request_profiler, sign_profile_request
+from flaskr.bulk import insert_rows
+from flaskr.search import question_search
+from flaskr.snapshot import question_snapshot
+import gzip
 import math
+import os
+import pstats
+import tempfile
+import threading
 # generating random queries for the data
-from sqlalchemy import func, desc
+from sqlalchemy import create_engine, func, desc, event
+from sqlalchemy.exc import DBAPIError
+import asyncio
+import importlib.util
 import unittest
+from unittest import mock
+from flaskr.asgi import create_asgi_app
+from config import TestConfig
 
 
 class TriviaAPI(unittest.TestCase):
@@ -13,11 +35,20 @@ class TriviaAPI(unittest.TestCase):
     base class for testing the API
     '''
 
+    # the application is created once for the whole session
+    app = None
+
+    @classmethod
+    def setUpClass(cls):
+        if TriviaAPI.app is None:
+            # creating the application
+            TriviaAPI.app = create_app('testing')
+            TriviaAPI.config = dict(TriviaAPI.app.config)
+            TriviaAPI.view_functions = dict(TriviaAPI.app.view_functions)
+
     # Setup and teardown methods
     # executed before and after each test.
     def setUp(self):
-        # creating the application
-        self.app = create_app('testing')
         self.app_context = self.app.app_context()
         # push the application context with all extentions
         self.app_context.push()
@@ -25,6 +56,11 @@ class TriviaAPI(unittest.TestCase):
             self.client = self.app.test_client()
 
     def tearDown(self):
+        # undo the config changes and wrapped views of the test
+        self.app.config.clear()
+        self.app.config.update(self.config)
+        self.app.view_functions.clear()
+        self.app.view_functions.update(self.view_functions)
         # pop the app context
         self.app_context.pop()
 
@@ -125,6 +161,11 @@ class TriviaAPI(unittest.TestCase):
         self.assertFalse(data['success'])
         # message should be 'bad request'
         self.assertEqual(data['message'], 'bad request')
+        # searchTerm should be a string
+        for search_term in (123, ['title'], {'term': 'title'}):
+            response = self.client.post('/api/v1/questions/search',
+                                        json={'searchTerm': search_term})
+            self.assertEqual(response.status_code, 400)
 
     def test_post_new_question(self):
         '''
@@ -222,6 +263,26 @@ class TriviaAPI(unittest.TestCase):
         # categories length should be more than 0
         self.assertGreater(len(data['categories']), 0)
 
+    def test_cors_headers(self):
+        '''
+        tests that the api routes allow every origin, and answer preflight requests
+        '''
+        response = self.client.get('/api/v1/categories')
+        self.assertEqual(response.headers.get('Access-Control-Allow-Origin'), '*')
+        # a request from a page gets its origin back
+        response = self.client.get('/api/v1/categories', headers={'Origin': 'http://localhost:3000'})
+        self.assertEqual(response.headers.get('Access-Control-Allow-Origin'), 'http://localhost:3000')
+        self.assertIn('Origin', response.headers.get('Vary'))
+        response = self.client.options('/api/v1/questions', headers={
+            'Origin': 'http://localhost:3000', 'Access-Control-Request-Method': 'POST'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.get('Access-Control-Allow-Origin'), 'http://localhost:3000')
+        self.assertIn('Content-Type', response.headers.get('Access-Control-Allow-Headers'))
+        # unknown urls are not api routes
+        response = self.client.get('/api/v1/unknown', headers={'Origin': 'http://localhost:3000'})
+        self.assertEqual(response.status_code, 404)
+        self.assertIsNone(response.headers.get('Access-Control-Allow-Origin'))
+
     def test_play_quiz(self):
         '''
         tests playing a quizs
@@ -256,6 +317,1039 @@ class TriviaAPI(unittest.TestCase):
         # message should be 'bad request'
         self.assertEqual(data['message'], 'bad request')
 
+    def test_get_questions_by_cursor(self):
+        '''
+        tests walking all questions with keyset pagination
+        '''
+        # follow next_cursor until the last page
+        seen = []
+        response = self.client.get('/api/v1/questions?after_id=0&limit=5')
+        while True:
+            data = json.loads(response.data)
+            # status code should be 200
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(data['success'])
+            # total_questions is not counted unless requested
+            self.assertNotIn('total_questions', data)
+            self.assertLessEqual(len(data['questions']), 5)
+            seen.extend(question['id'] for question in data['questions'])
+            if data['next_cursor'] is None:
+                break
+            response = self.client.get(
+                f'/api/v1/questions?cursor={data["next_cursor"]}&limit=5')
+        # the cursor walk should return every question once, ordered by id
+        ids = [question.id for question in Question.query.order_by(Question.id)]
+        self.assertEqual(seen, ids)
+
+    def test_get_category_questions_by_cursor(self):
+        '''
+        tests getting questions by category with keyset pagination and a total
+        '''
+        category = Category.query.order_by(func.random()).first()
+        response = self.client.get(
+            f'/api/v1/categories/{category.id}/questions?after_id=0&with_total=true')
+        data = json.loads(response.data)
+        # status code should be 200
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['current_category'], category.type)
+        # total_questions was requested, so it should be present
+        self.assertEqual(data['total_questions'], Question.query.filter(
+            Question.category == category.id).count())
+        for question in data['questions']:
+            self.assertEqual(question['category'], category.id)
+
+    def test_envalid_cursor(self):
+        '''
+        tests requesting questions with an envalid cursor
+        '''
+        response = self.client.get('/api/v1/questions?cursor=blahblahblah')
+        data = json.loads(response.data)
+        # status code should be 400
+        self.assertEqual(response.status_code, 400)
+        # success should be false
+        self.assertFalse(data['success'])
+        # message should be 'bad request'
+        self.assertEqual(data['message'], 'bad request')
+
+    def test_search_answers(self):
+        '''
+        tests searching in answers only when searchAnswers is set
+        '''
+        # 'apollo' only appears in an answer
+        response = self.client.post('/api/v1/questions/search',
+                                    json={'searchTerm': 'apollo'})
+        self.assertEqual(response.status_code, 404)
+        response = self.client.post('/api/v1/questions/search',
+                                    json={'searchTerm': 'apollo', 'searchAnswers': True})
+        data = json.loads(response.data)
+        # status code should be 200
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Apollo 13', [question['answer'] for question in data['questions']])
+
+    def test_search_follows_new_questions(self):
+        '''
+        tests that search results include new questions and drop deleted ones
+        '''
+        # search once, so that any search index is built before the insert
+        self.client.post('/api/v1/questions/search', json={'searchTerm': 'title'})
+        question = Question('Who wrote zyxwvut?', 'test answer', 1, 1)
+        question.insert()
+        response = self.client.post('/api/v1/questions/search',
+                                    json={'searchTerm': 'zyxwv'})
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([q['id'] for q in data['questions']], [question.id])
+        # cleanup the DB, the question should not be found anymore
+        question.delete()
+        response = self.client.post('/api/v1/questions/search',
+                                    json={'searchTerm': 'zyxwv'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_search_index_reloads_in_background(self):
+        '''
+        tests that an old search index keeps answering while it is rebuilt, and that the new one gets the changes
+        made during the rebuild
+        '''
+        question_search.ensure_built()
+        # a question written by another process, this one is not told about it
+        table = Question.__table__
+        other_id = db.session.execute(table.insert().values(
+            question='Who wrote qwxyzzy?', answer='other', category=1, difficulty=1)).inserted_primary_key[0]
+        db.session.commit()
+        loaded, release = threading.Event(), threading.Event()
+        load_index = question_search.load_index
+
+        def slow_load_index():
+            index = load_index()
+            loaded.set()
+            release.wait(5)
+            return index
+        question_search.built_at -= question_search.ttl + 1
+        with mock.patch.object(question_search, 'load_index', slow_load_index):
+            # the old index answers at once, while the new one loads
+            self.assertEqual(question_search.suggest('qwxyzz', 5), [])
+            self.assertTrue(loaded.wait(5))
+            question = Question('Who wrote qwxyzzz?', 'this', 1, 1)
+            question.insert()
+            release.set()
+            question_search.reload.thread.join(5)
+        self.assertEqual({suggestion[0] for suggestion in question_search.suggest('qwxyzz', 5)},
+                         {other_id, question.id})
+        question.delete()
+        db.session.execute(table.delete().where(table.c.id == other_id))
+        db.session.commit()
+        notify_questions_changed('reload')
+
+    def test_quiz_pool_reloads_in_background(self):
+        '''
+        tests that an old quiz pool keeps answering while it is reloaded, and that the new one gets the changes
+        made during the reload
+        '''
+        question_pool.ensure_loaded()
+        total = len(question_pool.ids(0))
+        # a question written by another process, this one is not told about it
+        table = Question.__table__
+        other_id = db.session.execute(table.insert().values(
+            question='Other process?', answer='yes', category=1, difficulty=1)).inserted_primary_key[0]
+        db.session.commit()
+        doomed = Question.query.filter(Question.category == 2).first()
+        loaded, release = threading.Event(), threading.Event()
+        load_pools = question_pool.load_pools
+
+        def slow_load_pools():
+            pools = load_pools()
+            loaded.set()
+            release.wait(5)
+            return pools
+        question_pool.built_at -= question_pool.ttl + 1
+        with mock.patch.object(question_pool, 'load_pools', slow_load_pools):
+            # the old pool answers at once, while the new one loads
+            self.assertEqual(len(question_pool.ids(0)), total)
+            self.assertTrue(loaded.wait(5))
+            question = Question('During the reload?', 'yes', 1, 1)
+            question.insert()
+            # deletes are replayed too, without scanning the pools
+            question_pool.questions_changed('delete', [doomed])
+            release.set()
+            question_pool.reload.thread.join(5)
+        ids = question_pool.ids(0)
+        self.assertEqual(len(ids), total + 1)
+        self.assertIn(other_id, ids)
+        self.assertIn(question.id, question_pool.ids(1))
+        self.assertNotIn(doomed.id, question_pool.ids(2))
+        self.assertEqual(list(ids), sorted(ids))
+        question.delete()
+        db.session.execute(table.delete().where(table.c.id == other_id))
+        db.session.commit()
+        notify_questions_changed('reload')
+
+    def test_play_quiz_until_the_end(self):
+        '''
+        tests that a quiz never repeats a question, and ends when all questions are played
+        '''
+        category = Category.query.order_by(func.random()).first()
+        total_questions = Question.query.filter(
+            Question.category == category.id).count()
+        previous_questions = []
+        for _ in range(total_questions):
+            response = self.client.post('/api/v1/quizzes', json={
+                'previous_questions': previous_questions,
+                'quiz_category': {'id': category.id}
+            })
+            data = json.loads(response.data)
+            self.assertEqual(response.status_code, 200)
+            # every question should be new, and from the selected category
+            self.assertNotIn(data['question']['id'], previous_questions)
+            self.assertEqual(data['question']['category'], category.id)
+            previous_questions.append(data['question']['id'])
+        # all questions were played, so no question is returned
+        response = self.client.post('/api/v1/quizzes', json={
+            'previous_questions': previous_questions,
+            'quiz_category': {'id': category.id}
+        })
+        data = json.loads(response.data)
+        self.assertTrue(data['success'])
+        self.assertNotIn('question', data)
+
+    def test_play_quiz_new_question(self):
+        '''
+        tests that new questions can be played right after they are posted
+        '''
+        previous_questions = [question.id for question in Question.query.all()]
+        # play once, so that the quiz pool is loaded before the insert
+        self.client.post('/api/v1/quizzes', json={
+            'previous_questions': previous_questions,
+            'quiz_category': {'id': 0}
+        })
+        question = Question('test question', 'test answer', 1, 1)
+        question.insert()
+        response = self.client.post('/api/v1/quizzes', json={
+            'previous_questions': previous_questions,
+            'quiz_category': {'id': 0}
+        })
+        data = json.loads(response.data)
+        self.assertEqual(data['question']['id'], question.id)
+        # cleanup the DB
+        question.delete()
+
+    def test_quiz_session(self):
+        '''
+        tests playing a whole quiz with a server side session
+        '''
+        category = Category.query.order_by(func.random()).first()
+        response = self.client.post('/api/v1/quizzes/sessions', json={
+            'quiz_category': {'id': category.id}
+        })
+        data = json.loads(response.data)
+        # status code should be 200
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['success'])
+        token = data['session']
+        played = []
+        for _ in range(data['total_questions']):
+            response = self.client.post(f'/api/v1/quizzes/sessions/{token}/next')
+            data = json.loads(response.data)
+            self.assertEqual(response.status_code, 200)
+            # the server should never repeat a question
+            self.assertNotIn(data['question']['id'], played)
+            self.assertEqual(data['question']['category'], category.id)
+            played.append(data['question']['id'])
+        # all questions were played, so no question is returned
+        response = self.client.post(f'/api/v1/quizzes/sessions/{token}/next')
+        data = json.loads(response.data)
+        self.assertTrue(data['success'])
+        self.assertNotIn('question', data)
+        # end the session, it should not be found anymore
+        response = self.client.delete(f'/api/v1/quizzes/sessions/{token}')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post(f'/api/v1/quizzes/sessions/{token}/next')
+        self.assertEqual(response.status_code, 404)
+
+    def test_failed_quiz_session(self):
+        '''
+        tests starting a quiz session with empty json
+        '''
+        response = self.client.post('/api/v1/quizzes/sessions', json={})
+        data = json.loads(response.data)
+        # status code should be 400
+        self.assertEqual(response.status_code, 400)
+        # message should be 'bad request'
+        self.assertEqual(data['message'], 'bad request')
+
+    def test_get_categories_not_modified(self):
+        '''
+        tests revalidating categories with an etag
+        '''
+        response = self.client.get('/api/v1/categories')
+        etag = response.headers.get('ETag')
+        # an etag should be sent with the categories
+        self.assertTrue(etag)
+        response = self.client.get('/api/v1/categories',
+                                   headers={'If-None-Match': etag})
+        # status code should be 304, without a body
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.data, b'')
+
+    def test_cached_questions_follow_changes(self):
+        '''
+        tests that cached question pages are revalidated, and refreshed after a new question
+        '''
+        response = self.client.get('/api/v1/questions')
+        data = json.loads(response.data)
+        etag = response.headers.get('ETag')
+        self.assertTrue(etag)
+        # the etag is derived from the data, a process local modification time is not sent
+        self.assertIsNone(response.headers.get('Last-Modified'))
+        # the same page is not modified
+        response = self.client.get('/api/v1/questions',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        # adding a question changes the page
+        question = Question('test question', 'test answer', 1, 1)
+        question.insert()
+        response = self.client.get('/api/v1/questions',
+                                   headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.data)['total_questions'],
+                         data['total_questions'] + 1)
+        # cleanup the DB
+        question.delete()
+
+    def test_question_without_difficulty(self):
+        '''
+        tests that deleting a question without a difficulty succeeds, and that failing listeners don't fail writes
+        '''
+        # load the counters and the quiz pool, so the listeners update them
+        self.client.get('/api/v1/questions')
+        self.client.post('/api/v1/quizzes', json={'previous_questions': [], 'quiz_category': {'id': 1}})
+        question = Question('No difficulty?', 'none', 1, None)
+        question.insert()
+        response = self.client.delete(f'/api/v1/questions/{question.id}')
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(Question.query.get(question.id))
+
+        # a listener that raises is logged and reloaded, the committed delete still succeeds
+        def broken(action, questions):
+            if action != 'reload':
+                raise RuntimeError('broken listener')
+        question = Question('Broken listener?', 'yes', 1, 1)
+        question.insert()
+        with mock.patch('flaskr.models._question_listeners', [broken]):
+            with self.assertLogs('flaskr.models', 'ERROR'):
+                response = self.client.delete(f'/api/v1/questions/{question.id}')
+        self.assertEqual(response.status_code, 200)
+        # the real listeners missed the delete
+        notify_questions_changed('reload')
+
+    def test_migrations_are_applied(self):
+        '''
+        tests that the app starts with an up to date schema
+        '''
+        # all migrations were applied by create_app, nothing is left to apply
+        self.assertEqual(upgrade(), [])
+        # question categories are integers referencing categories
+        question = Question.query.filter(Question.category.isnot(None)).first()
+        self.assertEqual(type(question.category), int)
+        self.assertIsNotNone(Category.query.get(question.category))
+
+    def test_migrate_removed_categories(self):
+        '''
+        tests that migrating a trivia.psql schema empties the categories that were removed
+        '''
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_engine('sqlite:///' + os.path.join(directory, 'old.db'))
+            # the text categories of trivia.psql, one of them was removed
+            engine.execute('CREATE TABLE categories (id INTEGER PRIMARY KEY, type VARCHAR)')
+            engine.execute('CREATE TABLE questions (id INTEGER PRIMARY KEY, question VARCHAR, answer VARCHAR, '
+                           'category VARCHAR, difficulty INTEGER)')
+            engine.execute("INSERT INTO categories VALUES (1, 'Science')")
+            engine.execute("INSERT INTO questions VALUES (1, 'kept?', 'yes', '1', 1), (2, 'orphan?', 'no', '7', 1)")
+            with self.assertLogs('flaskr.migrations', 'WARNING') as logs:
+                upgrade(engine)
+            self.assertIn('1 questions had a removed category', logs.output[0])
+            self.assertEqual(engine.execute('SELECT id, category FROM questions ORDER BY id').fetchall(),
+                             [(1, 1), (2, None)])
+            engine.dispose()
+
+    def test_bulk_post_questions(self):
+        '''
+        tests posting questions in bulk, with an envalid line
+        '''
+        lines = [
+            json.dumps({'question': 'bulk question 1', 'answer': 'a', 'difficulty': 1, 'category': 1}),
+            json.dumps({'question': 'bulk question 2', 'answer': 'a', 'difficulty': 9, 'category': 1}),
+            'not json',
+            json.dumps({'question': 'bulk question 3', 'answer': 'a', 'difficulty': 2, 'category': 2}),
+        ]
+        response = self.client.post('/api/v1/questions/bulk', data='\n'.join(lines),
+                                    content_type='application/x-ndjson')
+        data = json.loads(response.data)
+        # status code should be 200
+        self.assertEqual(response.status_code, 200)
+        # valid lines are inserted, envalid ones are reported with their line number
+        self.assertEqual(data['inserted'], 2)
+        self.assertEqual(data['rejected'], 2)
+        self.assertEqual([error['line'] for error in data['errors']], [2, 3])
+        # cleanup the DB
+        questions = Question.query.filter(Question.question.like('bulk question %')).all()
+        self.assertEqual(len(questions), 2)
+        for question in questions:
+            question.delete()
+
+    def test_bulk_post_csv_questions(self):
+        '''
+        tests posting questions in bulk as csv
+        '''
+        body = 'question,answer,difficulty,category\nbulk csv question,a,3,4\n'
+        response = self.client.post('/api/v1/questions/bulk', data=body,
+                                    content_type='text/csv')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data['inserted'], 1)
+        # cleanup the DB
+        Question.query.filter(Question.question == 'bulk csv question').one().delete()
+
+    def test_bulk_post_questions_in_one_transaction(self):
+        '''
+        tests that bulk posts report lines that are not utf-8, and import nothing when a batch fails
+        '''
+        line = json.dumps({'question': 'bulk question 1', 'answer': 'a', 'difficulty': 1, 'category': 1})
+        body = b'\n'.join([line.encode(), b'{"question": "caf\xe9"}'])
+        data = json.loads(self.client.post('/api/v1/questions/bulk', data=body,
+                                           content_type='application/x-ndjson').data)
+        self.assertEqual(data['errors'], [{'line': 2, 'message': 'invalid utf-8'}])
+        body = b'question,answer,difficulty,category\ncaf\xe9,a,3,4\nbulk question 2,a,3,4\n'
+        data = json.loads(self.client.post('/api/v1/questions/bulk', data=body, content_type='text/csv').data)
+        self.assertEqual((data['inserted'], data['errors']), (1, [{'line': 2, 'message': 'invalid utf-8'}]))
+        for question in Question.query.filter(Question.question.like('bulk question %')):
+            question.delete()
+        # the second batch fails, the first one is rolled back with it
+        self.app.config['BULK_BATCH_SIZE'] = 1
+        calls = []
+
+        def failing_insert_rows(rows):
+            calls.append(rows)
+            if len(calls) == 2:
+                raise RuntimeError('the database went away')
+            insert_rows(rows)
+        with mock.patch('flaskr.bulk.insert_rows', failing_insert_rows):
+            response = self.client.post('/api/v1/questions/bulk', data=f'{line}\n{line}',
+                                        content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Question.query.filter(Question.question.like('bulk question %')).count(), 0)
+
+    def test_export_command(self):
+        '''
+        tests exporting all questions from the command line
+        '''
+        result = self.app.test_cli_runner().invoke(args=['trivia', 'export'])
+        lines = result.output.splitlines()
+        # one json line per question
+        self.assertEqual(len(lines), Question.query.count())
+        self.assertEqual(set(json.loads(lines[0])), {'id', 'question', 'answer', 'category', 'difficulty'})
+
+    def test_export_questions(self):
+        '''
+        tests streaming all questions, with and without gzip
+        '''
+        response = self.client.get('/api/v1/questions/export')
+        # status code should be 200
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = response.data.decode().splitlines()
+        # one json line per question, ordered by id
+        ids = [json.loads(line)['id'] for line in lines]
+        self.assertEqual(ids, [question.id for question in Question.query.order_by(Question.id)])
+        # the same lines are sent compressed if the client accepts gzip
+        response = self.client.get('/api/v1/questions/export',
+                                   headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+        self.assertEqual(gzip.decompress(response.data).decode().splitlines(), lines)
+
+    def test_post_new_question_minimal(self):
+        '''
+        tests posting a new question, asking for a minimal response
+        '''
+        total_questions = Question.query.count()
+        response = self.client.post('/api/v1/questions?return=minimal', json={
+            'question': 'test question',
+            'answer': 'test answer',
+            'difficulty': 3,
+            'category': 1})
+        data = json.loads(response.data)
+        # status code should be 200
+        self.assertEqual(response.status_code, 200)
+        # only the id is returned
+        self.assertEqual(set(data), {'success', 'id'})
+        # the counted total follows the insert and the delete
+        response = self.client.get('/api/v1/questions')
+        self.assertEqual(json.loads(response.data)['total_questions'], total_questions + 1)
+        Question.query.get(data['id']).delete()
+        response = self.client.get('/api/v1/questions')
+        self.assertEqual(json.loads(response.data)['total_questions'], total_questions)
+
+    def test_read_replica_routing(self):
+        '''
+        tests that read only routes use a replica, except right after a write
+        '''
+        # use the test database itself as a replica, and count its statements
+        self.app.config['SQLALCHEMY_BINDS'] = {
+            'replica_0': self.app.config['SQLALCHEMY_DATABASE_URI']}
+        replica = db.get_engine(self.app, bind='replica_0')
+        statements = []
+
+        def count_statement(conn, cursor, statement, *args):
+            statements.append(statement)
+        event.listen(replica, 'before_cursor_execute', count_statement)
+        try:
+            response = self.client.get('/api/v1/questions?page=1')
+            self.assertEqual(response.status_code, 200)
+            # the listing was read from the replica
+            self.assertGreater(len(statements), 0)
+            # quiz sessions are kept outside the database, playing one doesn't pin the client to the primary
+            response = self.client.post('/api/v1/quizzes/sessions', json={'quiz_category': {'id': 1}})
+            token = json.loads(response.data)['session']
+            response = self.client.post(f'/api/v1/quizzes/sessions/{token}/next')
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('trivia_read_primary', response.headers.get('Set-Cookie', ''))
+            # a write goes to the primary, and asks the client to read from the primary for a while
+            response = self.client.post('/api/v1/questions?return=minimal', json={
+                'question': 'test question',
+                'answer': 'test answer',
+                'difficulty': 3,
+                'category': 1})
+            question_id = json.loads(response.data)['id']
+            self.assertIn('trivia_read_primary', response.headers.get('Set-Cookie'))
+            statements.clear()
+            response = self.client.get('/api/v1/questions?page=2')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(statements, [])
+        finally:
+            event.remove(replica, 'before_cursor_execute', count_statement)
+            self.app.config['SQLALCHEMY_BINDS'] = {}
+        # cleanup the DB
+        Question.query.get(question_id).delete()
+
+    def test_metrics(self):
+        '''
+        tests the per route metrics, and the Server-Timing header
+        '''
+        labels = 'route="/api/v1/categories/<category_id>/questions",method="GET"'
+
+        def count(name):
+            # read a counter of the route from /metrics, other tests may have used the route too
+            response = self.client.get('/metrics')
+            self.assertEqual(response.status_code, 200)
+            for line in response.data.decode().splitlines():
+                if line.startswith(f'{name}{{{labels}}} '):
+                    return int(line.split()[-1])
+            return 0
+        requests = count('trivia_request_duration_seconds_count')
+        self.app.config['SERVER_TIMING'] = True
+        response = self.client.get('/api/v1/categories/1/questions')
+        self.assertEqual(response.status_code, 200)
+        # the database and serialization times are sent back
+        self.assertIn('statements"', response.headers.get('Server-Timing'))
+        self.assertIn('serialize;dur=', response.headers.get('Server-Timing'))
+        # the request was counted once, under its url rule
+        self.assertEqual(count('trivia_request_duration_seconds_count'), requests + 1)
+        self.assertEqual(count('trivia_request_sql_statements_count'), requests + 1)
+        # a failing statement isn't counted, and leaves no start time behind
+        with self.app.test_request_context():
+            request_metrics.start_request()
+            with self.assertRaises(DBAPIError):
+                db.session.execute('SELECT * FROM missing_table')
+            db.session.rollback()
+            db.session.execute('SELECT 1')
+            self.assertEqual(g.metrics_statements, 1)
+            self.assertNotIn('metrics_query_start', db.session.connection().info)
+            db.session.rollback()
+
+    def test_profile_signed_request(self):
+        '''
+        tests that only requests with a signed header are profiled
+        '''
+        with tempfile.TemporaryDirectory() as directory:
+            self.app.config.update(PROFILE_ENABLED=True, PROFILE_SAMPLE_RATE=0, PROFILE_SECRET='secret',
+                                   PROFILE_MODE='cprofile', PROFILE_DIR=directory)
+            request_profiler.init_app(self.app)
+            self.client.get('/api/v1/categories')
+            # an unsigned request is not profiled
+            self.assertEqual(os.listdir(directory), [])
+            self.client.get('/api/v1/categories', headers={
+                'X-Profile-Request': sign_profile_request('wrong secret')})
+            self.assertEqual(os.listdir(directory), [])
+            response = self.client.get('/api/v1/categories', headers={
+                'X-Profile-Request': sign_profile_request('secret')})
+            self.assertEqual(response.status_code, 200)
+            # a cProfile file was written for the signed request
+            files = os.listdir(directory)
+            self.assertEqual(len(files), 1)
+            self.assertTrue(files[0].endswith('.prof'))
+            pstats.Stats(os.path.join(directory, files[0]))
+
+    def test_json_response_matches_jsonify(self):
+        '''
+        tests that the fast json encoder returns the same bytes as jsonify
+        '''
+        rows = question_page(0, 20)
+        # the fixtures have non ascii text, like the en dash of question 16
+        self.assertFalse(all(row.question.isascii() for row in rows))
+        payloads = [
+            {'success': True, 'questions': format_rows(rows), 'total_questions': 20,
+             'categories': {1: 'Science', 2: 'Art', 10: 'Other'}},
+            {'success': True, 'questions': format_rows(questions_by_ids([rows[3].id, rows[1].id])), 'next_cursor': None},
+            # non ascii text is escaped like the standard library does
+            {'question': {'answer': 'caf\u00e9 \x7f "quoted" \U0001f600', 'id': 1}},
+        ]
+        with self.app.test_request_context():
+            expected = [jsonify(payload).data for payload in payloads]
+            if serializers.orjson is not None:
+                # the fast path encodes everything itself, without falling back to jsonify
+                self.assertTrue(serializers.fast_path_enabled())
+                serializers.jsonify = None
+            try:
+                self.assertEqual([json_response(payload).data for payload in payloads], expected)
+            finally:
+                serializers.jsonify = jsonify
+
+    def test_compressed_questions(self):
+        '''
+        tests that large responses are compressed, and still revalidated with their etag
+        '''
+        self.app.config['QUESTIONS_PER_PAGE'] = 20
+        plain = self.client.get('/api/v1/questions')
+        response = self.client.get('/api/v1/questions', headers={'Accept-Encoding': 'gzip'})
+        # status code should be 200
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers.get('Content-Encoding'), 'gzip')
+        self.assertIn('Accept-Encoding', response.headers.get('Vary'))
+        # the same json is sent, compressed
+        self.assertEqual(gzip.decompress(response.data), plain.data)
+        self.assertLess(len(response.data), len(plain.data))
+        # the compressed page can be revalidated with its weak etag
+        etag = response.headers.get('ETag')
+        self.assertTrue(etag.startswith('W/'))
+        response = self.client.get('/api/v1/questions', headers={
+            'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        # small responses are not compressed
+        response = self.client.get('/api/v1/categories', headers={'Accept-Encoding': 'gzip'})
+        self.assertIsNone(response.headers.get('Content-Encoding'))
+
+    def test_warm_up_command(self):
+        '''
+        tests preloading the caches from the command line
+        '''
+        result = self.app.test_cli_runner().invoke(args=['trivia', 'warmup'])
+        self.assertEqual(result.exit_code, 0)
+        # every step reports its time
+        for step in ('connection', 'categories', 'question counters', 'quiz pool', 'search index'):
+            self.assertIn(f'{step}: ', result.output)
+
+    def test_play_adaptive_quiz(self):
+        '''
+        tests that adaptive quizzes follow the player's answers
+        '''
+        def difficulties(recent_answers):
+            picked = []
+            for _ in range(30):
+                response = self.client.post('/api/v1/quizzes', json={
+                    'previous_questions': [], 'quiz_category': {'id': 0},
+                    'mode': 'adaptive', 'recent_answers': recent_answers})
+                self.assertEqual(response.status_code, 200)
+                picked.append(json.loads(response.data)['question']['difficulty'])
+            return sum(picked) / len(picked)
+        # players answering right get harder questions than players answering wrong
+        self.assertGreater(difficulties([True] * 5), difficulties([False] * 5))
+        # only the last ADAPTIVE_QUIZ_WINDOW answers count, and none of them with a window of 0
+        for window, counted in ((2, [False, True]), (0, [])):
+            self.app.config['ADAPTIVE_QUIZ_WINDOW'] = window
+            with mock.patch('flaskr.quiz.target_difficulty', wraps=target_difficulty) as target:
+                self.client.post('/api/v1/quizzes', json={
+                    'previous_questions': [], 'quiz_category': {'id': 0},
+                    'mode': 'adaptive', 'recent_answers': [True, True, False, True]})
+            target.assert_called_once_with(counted)
+        # recent_answers should be a list of booleans
+        response = self.client.post('/api/v1/quizzes', json={
+            'previous_questions': [], 'quiz_category': {'id': 0},
+            'mode': 'adaptive', 'recent_answers': ['yes']})
+        self.assertEqual(response.status_code, 400)
+
+    def test_play_adaptive_quiz_until_the_end(self):
+        '''
+        tests that adaptive quizzes still play every question of a category once
+        '''
+        total = Question.query.filter(Question.category == 1).count()
+        played = []
+        for _ in range(total):
+            response = self.client.post('/api/v1/quizzes', json={
+                'previous_questions': played, 'quiz_category': {'id': 1},
+                'mode': 'adaptive', 'recent_answers': [True]})
+            played.append(json.loads(response.data)['question']['id'])
+        self.assertEqual(len(set(played)), total)
+        # then the game ends
+        response = self.client.post('/api/v1/quizzes', json={
+            'previous_questions': played, 'quiz_category': {'id': 1},
+            'mode': 'adaptive', 'recent_answers': [True]})
+        self.assertNotIn('question', json.loads(response.data))
+
+    def test_alias_table(self):
+        '''
+        tests that the alias method samples indexes in proportion to their weights
+        '''
+        table = AliasTable([1, 0, 3])
+        counts = [0, 0, 0]
+        for _ in range(4000):
+            counts[table.sample()] += 1
+        self.assertEqual(counts[1], 0)
+        self.assertAlmostEqual(counts[2] / counts[0], 3, delta=0.6)
+
+    def test_play_quiz_deck(self):
+        '''
+        tests getting quiz questions in decks, continuing with a token until every question was played
+        '''
+        total = Question.query.filter(Question.category == 1).count()
+        response = self.client.post('/api/v1/quizzes', json={
+            'previous_questions': [], 'quiz_category': {'id': 1}, 'deck_size': 2})
+        data = json.loads(response.data)
+        # status code should be 200
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(data['questions']), min(2, total))
+        played = [question['id'] for question in data['questions']]
+        while data['continuation']:
+            response = self.client.post('/api/v1/quizzes', json={
+                'continuation': data['continuation'], 'deck_size': 2})
+            data = json.loads(response.data)
+            played += [question['id'] for question in data['questions']]
+        # every question of the category was dealt once
+        self.assertEqual(sorted(played), sorted(question.id for question in
+                                                Question.query.filter(Question.category == 1)))
+        # a tampered token should return a 400 error
+        response = self.client.post('/api/v1/quizzes', json={
+            'continuation': 'not a token', 'deck_size': 2})
+        self.assertEqual(response.status_code, 400)
+        # ids above every question id are ignored, and don't grow the token
+        response = self.client.post('/api/v1/quizzes', json={
+            'previous_questions': [2000000000], 'quiz_category': {'id': 1}, 'deck_size': 1})
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(len(data['continuation']), 200)
+
+    def test_get_categories_stats(self):
+        '''
+        tests getting the number of questions of every category
+        '''
+        response = self.client.get('/api/v1/categories/stats')
+        data = json.loads(response.data)
+        # status code should be 200
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(data['categories']), {str(category.id) for category in Category.query})
+        # the counters match the questions table
+        science = data['categories']['1']
+        self.assertEqual(science['total_questions'], Question.query.filter(Question.category == 1).count())
+        self.assertEqual(science['difficulties']['3'], Question.query.filter(
+            Question.category == 1, Question.difficulty == 3).count())
+        self.assertEqual(sum(science['difficulties'].values()), science['total_questions'])
+        self.assertEqual(data['total_questions'], Question.query.count())
+        # and follow new questions
+        question = Question('test question', 'test answer', 1, 3)
+        question.insert()
+        data = json.loads(self.client.get('/api/v1/categories/stats').data)
+        self.assertEqual(data['categories']['1']['total_questions'], science['total_questions'] + 1)
+        self.assertEqual(data['categories']['1']['difficulties']['3'], science['difficulties']['3'] + 1)
+        # cleanup the DB
+        question.delete()
+        # questions without a difficulty are counted under 'unknown'
+        question = Question('No difficulty?', 'none', 1, None)
+        question.insert()
+        response = self.client.get('/api/v1/categories/stats')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['categories']['1']['difficulties']['unknown'], 1)
+        self.assertEqual(data['categories']['1']['total_questions'], science['total_questions'] + 1)
+        question.delete()
+
+    def test_serve_from_snapshot(self):
+        '''
+        tests answering the read routes from a snapshot, and reloading it when a new one is written
+        '''
+        path = os.path.join(tempfile.mkdtemp(), 'questions.snapshot')
+        urls = ('/api/v1/categories', '/api/v1/questions?page=2',
+                '/api/v1/categories/1/questions', '/api/v1/questions?after_id=5&limit=3')
+        expected = [json.loads(self.client.get(url).data) for url in urls]
+        result = self.app.test_cli_runner().invoke(args=['trivia', 'snapshot', path])
+        self.assertEqual(result.exit_code, 0)
+        self.app.config.update(SERVE_FROM_SNAPSHOT=True, SNAPSHOT_PATH=path, SNAPSHOT_CHECK_INTERVAL=0)
+        question_snapshot.init_app(self.app)
+        # go back to the database, and reload everything from it, after the test
+        self.addCleanup(question_snapshot.init_app, self.app)
+        self.addCleanup(os.remove, path)
+        # the snapshot gives the same answers as the database
+        for url, data in zip(urls, expected):
+            self.assertEqual(json.loads(self.client.get(url).data), data)
+        self.assertIsNotNone(question_snapshot.current())
+        response = self.client.post('/api/v1/quizzes', json={
+            'previous_questions': [], 'quiz_category': {'id': 1}})
+        self.assertEqual(json.loads(response.data)['question']['category'], 1)
+        # new questions show up once a new snapshot is written, the counters follow the snapshot until then
+        total = expected[1]['total_questions']
+        question = Question('Who wrote zyxwvut?', 'test answer', 1, 1)
+        question.insert()
+        after_last = f'/api/v1/questions?after_id={question.id - 1}'
+        self.assertEqual(self.client.get(after_last).status_code, 404)
+        self.assertEqual(json.loads(self.client.get('/api/v1/questions').data)['total_questions'], total)
+        self.app.test_cli_runner().invoke(args=['trivia', 'snapshot', path])
+        data = json.loads(self.client.get(after_last).data)
+        self.assertEqual([q['id'] for q in data['questions']], [question.id])
+        self.assertEqual(json.loads(self.client.get('/api/v1/questions').data)['total_questions'], total + 1)
+        question.delete()
+        self.assertEqual(json.loads(self.client.get('/api/v1/questions').data)['total_questions'], total + 1)
+        # a question without a difficulty keeps it, instead of getting difficulty 0
+        question_id = db.session.execute(Question.__table__.insert().values(
+            question='No difficulty?', answer='none', category=1)).inserted_primary_key[0]
+        db.session.commit()
+        self.app.test_cli_runner().invoke(args=['trivia', 'snapshot', path])
+        snapshot = question_snapshot.current()
+        self.assertIsNone(snapshot.by_ids([question_id])[0].difficulty)
+        self.assertIn((question_id, 1, None), snapshot.keys())
+        self.assertEqual(snapshot.counts()[(1, None)], 1)
+        response = self.client.get('/api/v1/categories/stats')
+        self.assertEqual(json.loads(response.data)['categories']['1']['difficulties']['unknown'], 1)
+        db.session.execute(Question.__table__.delete().where(Question.__table__.c.id == question_id))
+        db.session.commit()
+
+    def test_batch_questions(self):
+        '''
+        tests creating and deleting questions in one batch, with a result per operation
+        '''
+        doomed = [Question(f'Doomed question {number}?', 'answer', 1, 2) for number in range(3)]
+        for question in doomed:
+            question.insert()
+        total = json.loads(self.client.get('/api/v1/questions').data)['total_questions']
+        statements = []
+
+        def count(*args):
+            statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            response = self.client.post('/api/v1/questions/batch', json={'operations': [
+                {'op': 'delete', 'id': doomed[0].id},
+                {'op': 'create', 'question': 'Batched question?', 'answer': 'yes', 'category': 1, 'difficulty': 3},
+                {'op': 'delete', 'id': doomed[1].id},
+                {'op': 'delete', 'id': 987654},
+                {'op': 'create', 'question': 'No answer?', 'category': 1, 'difficulty': 3},
+                {'op': 'delete', 'id': doomed[2].id},
+                {'op': 'update', 'id': 1}]})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in data['results']],
+                         ['deleted', 'created', 'deleted', 'not_found', 'rejected', 'deleted', 'rejected'])
+        self.assertEqual((data['created'], data['deleted']), (1, 3))
+        # the three deletes run as one statement
+        self.assertEqual(len([statement for statement in statements if statement.startswith('DELETE')]), 1)
+        # the counters and the pool follow the batch
+        self.assertEqual(json.loads(self.client.get('/api/v1/questions').data)['total_questions'], total - 2)
+        created = data['results'][1]['id']
+        self.assertEqual(self.client.post('/api/v1/questions/batch', json={'operations': [
+            {'op': 'delete', 'id': created}]}).status_code, 200)
+        # the creates run as one multi-row statement, and every id belongs to its own question
+        statements.clear()
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            response = self.client.post('/api/v1/questions/batch', json={'operations': [
+                {'op': 'create', 'question': f'Batched question {number}?', 'answer': 'yes', 'category': 1, 'difficulty': 3}
+                for number in range(5)]})
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        ids = [result['id'] for result in json.loads(response.data)['results']]
+        self.assertEqual(len([statement for statement in statements if statement.startswith('INSERT')]), 1)
+        self.assertEqual([Question.query.get(question_id).question for question_id in ids],
+                         [f'Batched question {number}?' for number in range(5)])
+        self.assertEqual(self.client.post('/api/v1/questions/batch', json={'operations': [
+            {'op': 'delete', 'id': question_id} for question_id in ids]}).status_code, 200)
+        # operations should be a non empty list
+        response = self.client.post('/api/v1/questions/batch', json={'operations': []})
+        self.assertEqual(response.status_code, 400)
+
+    def test_suggest_questions(self):
+        '''
+        tests suggesting questions from a prefix, and following new questions
+        '''
+        response = self.client.get('/api/v1/questions/suggest?prefix=tit')
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(data['suggestions'])
+        for suggestion in data['suggestions']:
+            self.assertIn('tit', suggestion['snippet'].lower())
+        question = Question('Which ' + 'very ' * 30 + 'long question mentions qwertyuiop?', 'answer', 1, 1)
+        question.insert()
+        statements = []
+
+        def count(*args):
+            statements.append(args[2])
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            response = self.client.get('/api/v1/questions/suggest?prefix=long qwerty&limit=1')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+        data = json.loads(response.data)
+        # the index answers without the database, with a snippet around the match
+        self.assertEqual(statements, [])
+        self.assertEqual([suggestion['id'] for suggestion in data['suggestions']], [question.id])
+        snippet = data['suggestions'][0]['snippet']
+        self.assertLessEqual(len(snippet), self.app.config['SUGGEST_SNIPPET_LENGTH'] + 6)
+        self.assertIn('qwertyuiop', snippet)
+        question.delete()
+        data = json.loads(self.client.get('/api/v1/questions/suggest?prefix=qwerty').data)
+        self.assertEqual(data['suggestions'], [])
+        # one and two letter prefixes are ranked ahead, and stay in sync with inserts and deletes
+        question = Question('Qq qq qq?', 'answer', 1, 1)
+        question.insert()
+
+        def suggested(prefix):
+            data = json.loads(self.client.get(f'/api/v1/questions/suggest?prefix={prefix}&limit=5').data)
+            return [suggestion['id'] for suggestion in data['suggestions']]
+
+        def scanned(prefix):
+            totals = question_search.scores([prefix])
+            return sorted(totals, key=lambda question_id: (-totals[question_id], question_id))[:5]
+        data = json.loads(self.client.get('/api/v1/questions/suggest?prefix=qq').data)
+        # the whole question comes with the snippet
+        self.assertEqual(data['suggestions'][0], {'id': question.id, 'question': 'Qq qq qq?', 'snippet': 'Qq qq qq?'})
+        self.assertEqual(suggested('q'), scanned('q'))
+        question.delete()
+        self.assertEqual(suggested('q'), scanned('q'))
+        self.assertNotIn(question.id, suggested('qq'))
+        # a prefix is required
+        self.assertEqual(self.client.get('/api/v1/questions/suggest').status_code, 400)
+
+
+class ASGIResponse:
+    '''
+    a response from the ASGI app, with the attributes the tests read from Flask responses
+    '''
+
+    def __init__(self, status_code, headers, data):
+        self.status_code = status_code
+        self.headers = headers
+        self.data = data
+
+
+class ASGITestClient:
+    '''
+    a minimal synchronous client for the ASGI app, mirroring the Flask test client methods used in the tests
+    '''
+
+    def __init__(self, app):
+        self.app = app
+        # the async database connection belongs to one event loop, keep it for all requests
+        self.loop = asyncio.new_event_loop()
+
+    def close(self):
+        self.loop.run_until_complete(self.app.shutdown())
+        self.loop.close()
+
+    def open(self, method, url, json_body=None, headers=None):
+        path, _, query = url.partition('?')
+        body = json.dumps(json_body).encode() if json_body is not None else b''
+        messages = [{'type': 'http.request', 'body': body}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+        scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode(),
+                 'headers': [(key.lower().encode(), value.encode()) for key, value in (headers or {}).items()]}
+        self.loop.run_until_complete(self.app(scope, receive, send))
+        headers = {key.decode().title(): value.decode() for key, value in sent[0]['headers']}
+        return ASGIResponse(sent[0]['status'], headers, sent[1]['body'])
+
+    def get(self, url, headers=None):
+        return self.open('GET', url, headers=headers)
+
+    def options(self, url, headers=None):
+        return self.open('OPTIONS', url, headers=headers)
+
+    def post(self, url, json=None):
+        return self.open('POST', url, json)
+
+    def delete(self, url):
+        return self.open('DELETE', url)
+
+
+# the async drivers are optional, the parity tests only run when the one for the test database is installed
+ASYNC_DRIVER = 'asyncpg' if (TestConfig.SQLALCHEMY_DATABASE_URI or '').startswith('postgres') else 'aiosqlite'
+
+
+@unittest.skipUnless(importlib.util.find_spec(ASYNC_DRIVER), f'{ASYNC_DRIVER} is not installed')
+class TriviaASGIParity(TriviaAPI):
+    '''
+    runs the test cases of the original API contract against the ASGI app
+    '''
+
+    # the routes served by the ASGI app
+    PARITY_TESTS = (
+        'test_get_paginated_questions',
+        'test_envalid_question_page',
+        'test_empty_post_questions',
+        'test_post_search_questions',
+        'test_envalid_post_search_questions',
+        'test_bad_post_search_questions',
+        'test_post_new_question',
+        'test_post_new_question_minimal',
+        'test_get_category_questions',
+        'test_get_envalid_category',
+        'test_get_categories',
+        'test_cors_headers',
+        'test_play_quiz',
+        'test_play_quiz_until_the_end',
+        'test_failed_play_quiz',
+        'test_errors_are_logged',
+        'test_search_matches_flask',
+    )
+
+    def setUp(self):
+        if self._testMethodName not in self.PARITY_TESTS:
+            self.skipTest('not part of the ASGI contract')
+        super().setUp()
+        # send the requests to the ASGI app instead of the Flask app
+        self.client = ASGITestClient(create_asgi_app('testing'))
+
+    def tearDown(self):
+        self.client.close()
+        super().tearDown()
+
+    def test_search_matches_flask(self):
+        '''
+        tests that searching ranks questions like the in-memory search of the Flask app
+        '''
+        flask_client = self.app.test_client()
+        self.app.config['SEARCH_BACKEND'] = 'memory'
+        question_search.init_app(self.app)
+        self.addCleanup(question_search.init_app, self.app)
+        for body in ({'searchTerm': 'title'}, {'searchTerm': 'the'}, {'searchTerm': 'who'},
+                     {'searchTerm': 'what is', 'searchAnswers': True}):
+            expected = json.loads(flask_client.post('/api/v1/questions/search', json=body).data)
+            self.assertEqual(json.loads(self.client.post('/api/v1/questions/search', json=body).data), expected)
+
+    def test_errors_are_logged(self):
+        '''
+        tests that unexpected errors are logged before answering with a 500 error
+        '''
+        async def broken():
+            raise RuntimeError('the database went away')
+        with mock.patch.object(self.client.app, 'category_dict', broken):
+            with self.assertLogs('flaskr.asgi', 'ERROR') as logs:
+                response = self.client.get('/api/v1/categories')
+        self.assertEqual(response.status_code, 500)
+        self.assertIn('GET /api/v1/categories failed', logs.output[0])
+        self.assertIn('the database went away', logs.output[0])
+
 
 # Make the tests conveniently executable
 if __name__ == "__main__":
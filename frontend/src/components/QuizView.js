@@ -15,6 +15,8 @@ class QuizView extends Component {
         categories: {},
         numCorrect: 0,
         currentQuestion: {},
+        deck: [],
+        continuation: undefined,
         guess: '',
         forceEnd: false
     }
@@ -47,26 +49,56 @@ class QuizView extends Component {
     const previousQuestions = [...this.state.previousQuestions]
     if(this.state.currentQuestion.id) { previousQuestions.push(this.state.currentQuestion.id) }
 
+    if(previousQuestions.length >= questionsPerPlay) {
+      // the game is over, the final score is shown
+      this.setState({ previousQuestions: previousQuestions })
+      return;
+    }
+
+    if(this.state.deck.length) {
+      // the next question was already fetched with the deck
+      const [nextQuestion, ...deck] = this.state.deck
+      this.setState({
+        showAnswer: false,
+        previousQuestions: previousQuestions,
+        currentQuestion: nextQuestion,
+        deck: deck,
+        guess: ''
+      })
+      return;
+    }
+
+    if(this.state.continuation === null) {
+      // the last deck was short, every question of the category was played
+      this.setState({ previousQuestions: previousQuestions, forceEnd: true })
+      return;
+    }
+
+    // the first deck holds the whole game, the token of a deck only extends games longer than the server's largest deck
+    const size = questionsPerPlay - previousQuestions.length
+    const request = this.state.continuation
+      ? { continuation: this.state.continuation, deck_size: size }
+      : { previous_questions: previousQuestions, quiz_category: this.state.quizCategory, deck_size: size }
     $.ajax({
       url: '/api/v1/quizzes', //TODO: update request URL
       type: "POST",
       dataType: 'json',
       contentType: 'application/json',
-      data: JSON.stringify({
-        previous_questions: previousQuestions,
-        quiz_category: this.state.quizCategory
-      }),
+      data: JSON.stringify(request),
       xhrFields: {
         withCredentials: true
       },
       crossDomain: true,
       success: (result) => {
+        const [nextQuestion, ...deck] = result.questions
         this.setState({
           showAnswer: false,
           previousQuestions: previousQuestions,
-          currentQuestion: result.question,
+          currentQuestion: nextQuestion,
+          deck: deck,
+          continuation: result.continuation,
           guess: '',
-          forceEnd: result.question ? false : true
+          forceEnd: nextQuestion ? false : true
         })
         return;
       },
@@ -94,6 +126,8 @@ class QuizView extends Component {
       showAnswer: false,
       numCorrect: 0,
       currentQuestion: {},
+      deck: [],
+      continuation: undefined,
       guess: '',
       forceEnd: false
     })
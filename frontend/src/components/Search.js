@@ -1,8 +1,17 @@
 import React, { Component } from 'react'
+import $ from 'jquery';
+
+// milliseconds without typing before suggestions are fetched
+const SUGGEST_DELAY = 150;
 
 class Search extends Component {
   state = {
     query: '',
+    suggestions: [],
+  }
+
+  componentWillUnmount() {
+    clearTimeout(this.suggestTimer);
   }
 
   getInfo = (event) => {
@@ -11,8 +20,35 @@ class Search extends Component {
   }
 
   handleInputChange = () => {
+    const query = this.search.value;
     this.setState({
-      query: this.search.value
+      query: query
+    })
+    // only ask for suggestions once the user pauses typing
+    clearTimeout(this.suggestTimer);
+    this.suggestTimer = setTimeout(() => this.getSuggestions(query), SUGGEST_DELAY);
+  }
+
+  getSuggestions = (prefix) => {
+    if (!prefix.trim()) {
+      this.setState({ suggestions: [] })
+      return;
+    }
+    $.ajax({
+      url: `/api/v1/questions/suggest?prefix=${encodeURIComponent(prefix)}`,
+      type: "GET",
+      success: (result) => {
+        // a slower answer for an older prefix should not replace newer suggestions
+        if (prefix === this.state.query) {
+          this.setState({ suggestions: result.suggestions })
+        }
+        return;
+      },
+      error: (error) => {
+        // suggestions are optional, searching still works without them
+        this.setState({ suggestions: [] })
+        return;
+      }
     })
   }
 
@@ -23,7 +59,14 @@ class Search extends Component {
           placeholder="Search questions..."
           ref={input => this.search = input}
           onChange={this.handleInputChange}
+          list="search-suggestions"
         />
+        <datalist id="search-suggestions">
+          {this.state.suggestions.map((suggestion) => (
+            // picking a suggestion searches for the whole question, the snippet is only shown
+            <option key={suggestion.id} value={suggestion.question} label={suggestion.snippet} />
+          ))}
+        </datalist>
         <input type="submit" value="Submit" className="button"/>
       </form>
     )